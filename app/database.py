@@ -1,30 +1,70 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, ForeignKey, Float
+from sqlalchemy import create_engine, event, inspect, text, Column, Integer, String, Text, DateTime, ForeignKey, Float, Index
 from sqlalchemy.orm import sessionmaker, declarative_base, relationship
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from datetime import datetime
 import uuid
 
 # SQLite database setup
 DATABASE_URL = "sqlite:///./6th_intelligence.db"
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+# Pooled connections (one per concurrent session) so the DB/WAL/SHM files aren't reopened on every checkout
+engine = create_engine(
+    DATABASE_URL,
+    connect_args={"check_same_thread": False},
+    pool_size=20,
+    max_overflow=10,
+    pool_pre_ping=True
+)
+
+# Async engine for request handlers that run on the event loop
+ASYNC_DATABASE_URL = DATABASE_URL.replace("sqlite://", "sqlite+aiosqlite://", 1)
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    pool_size=20,
+    max_overflow=10,
+    pool_pre_ping=True
+)
+
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA mmap_size=268435456",  # 256MB
+    "PRAGMA cache_size=-64000",  # ~64MB
+    "PRAGMA temp_store=MEMORY",
+)
+
+@event.listens_for(engine, "connect")
+@event.listens_for(async_engine.sync_engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
+
 Base = declarative_base()
 
 class Session(Base):
     __tablename__ = "sessions"
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
     name = Column(String, nullable=True) # E.g., "Chat with John"
     messages = relationship("Message", back_populates="session", cascade="all, delete-orphan")
 
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        # Per-session history ordered by time (chat history, admin session detail)
+        Index("ix_msg_session_time", "session_id", "timestamp"),
+    )
     id = Column(Integer, primary_key=True, index=True)
-    session_id = Column(String, ForeignKey("sessions.id"))
+    session_id = Column(String, ForeignKey("sessions.id")) # Covered by ix_msg_session_time
     role = Column(String) # user, assistant, system
     content = Column(Text)
     tokens = Column(Integer, default=0) # Token usage for this message
-    timestamp = Column(DateTime, default=datetime.utcnow)
+    timestamp = Column(DateTime, default=datetime.utcnow, index=True)
     
     # Fractal Tree Management Fields
     node_id = Column(String, unique=True, index=True, default=lambda: str(uuid.uuid4()))
@@ -39,6 +79,7 @@ class KnowledgeDoc(Base):
     id = Column(Integer, primary_key=True, index=True)
     filename = Column(String)
     content = Column(Text) # Full text content for simple RAG
+    sha256 = Column(String(64), unique=True, index=True) # Raw file digest, used to skip re-indexing duplicates
     upload_date = Column(DateTime, default=datetime.utcnow)
 
 class User(Base):
@@ -48,8 +89,65 @@ class User(Base):
     hashed_password = Column(String)
     is_active = Column(Integer, default=1) # Boolean in SQLite is Integer 0/1
 
+class Handover(Base):
+    __tablename__ = "handovers"
+    __table_args__ = (
+        # Queue listing: filter by status, urgent first, oldest first
+        Index("ix_handover_status_rank_created", "status", "priority_rank", "created_at"),
+    )
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    session_id = Column(String, index=True)
+    reason = Column(Text)
+    priority = Column(String, default="normal") # normal, high, urgent
+    priority_rank = Column(Integer, default=2) # 0 urgent, 1 high, 2 normal (sort key)
+    status = Column(String, default="pending") # pending, assigned, resolved
+    assigned_to = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    resolved_at = Column(DateTime, nullable=True)
+    notes = Column(Text, nullable=True)
+
+class UsageRecord(Base):
+    __tablename__ = "usage_records"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    timestamp = Column(DateTime, default=datetime.utcnow, index=True) # Monthly totals, per-model breakdown
+    date = Column(String(10), index=True) # 'YYYY-MM-DD'; daily totals and trend
+    model = Column(String)
+    tokens_in = Column(Integer, default=0)
+    tokens_out = Column(Integer, default=0)
+    cost = Column(Float, default=0.0)
+    session_id = Column(String, nullable=True)
+
+class Feedback(Base):
+    __tablename__ = "feedback"
+    __table_args__ = (
+        # Per-session averages (low-rated sessions) and session feedback lookups
+        Index("ix_feedback_session_rating", "session_id", "rating"),
+    )
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    session_id = Column(String)
+    message_id = Column(Integer, nullable=True)
+    rating = Column(Integer) # 1-5
+    category = Column(String, nullable=True) # response_quality, speed, accuracy, helpfulness
+    comment = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True) # Time-window aggregates
+
 def init_db():
     Base.metadata.create_all(bind=engine)
+    # create_all never alters existing tables, so add columns introduced since the DB was created
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    col_type = column.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {col_type}'))
+        # Superseded by ix_msg_session_time (session_id is its leftmost column)
+        conn.execute(text("DROP INDEX IF EXISTS ix_messages_session_id"))
+    # create_all skips indexes on tables that already exist, so add any missing ones
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
 
 def get_db():
     db = SessionLocal()
@@ -57,3 +155,7 @@ def get_db():
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -1,26 +1,28 @@
 from fastapi import FastAPI, Request
-import numpy as np
 import asyncio
+import math
+import random
 
 from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
 from fastapi.responses import HTMLResponse
 from app.routers import chat, admin, auth, crm, handover
 from app import database
 from contextlib import asynccontextmanager
+from typing import Optional
 from app.middleware.logging_middleware import LoggingMiddleware
 from app.middleware.rate_limiter import RateLimitMiddleware
 from app.middleware.security_headers import SecurityHeadersMiddleware
 from app.services import logging_service
 
-# Setup Templates
-templates = Jinja2Templates(directory="app/templates")
-
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup: Load settings, connect DB
     logging_service.logger.info("System Startup: Initializing 6thIntelligence Research Dashboard...")
     database.init_db()
+    from app.services import handover_service, cost_service, feedback_service
+    handover_service.import_legacy_handovers()
+    cost_service.import_legacy_usage()
+    feedback_service.import_legacy_feedback()
     
     # Seed Default Admin
     from app.services import auth_service
@@ -30,17 +32,24 @@ async def lifespan(app: FastAPI):
     admin_user = db.query(User).filter(User.email == admin_email).first()
     if not admin_user:
         logging_service.logger.info(f"Seeding default researcher account: {admin_email}")
-        hashed_pw = auth_service.get_password_hash("innovate!2026")
+        hashed_pw = await asyncio.to_thread(auth_service.get_password_hash, "innovate!2026")
         new_admin = User(email=admin_email, hashed_password=hashed_pw)
         db.add(new_admin)
         db.commit()
-    elif not admin_user.hashed_password.startswith("$argon2id$"):
-        # Migration from bcrypt to argon2 if needed
+    elif admin_user.hashed_password.startswith(auth_service.BCRYPT_PREFIXES):
+        # Migration from bcrypt to argon2 if needed (hashing off the event loop)
         logging_service.logger.info(f"Updating researcher password to Argon2: {admin_email}")
-        admin_user.hashed_password = auth_service.get_password_hash("innovate!2026")
+        admin_user.hashed_password = await asyncio.to_thread(auth_service.get_password_hash, "innovate!2026")
         db.commit()
     db.close()
     
+    # Load the tokenizer up front (may download its BPE file) so no request ever waits on it
+    if not await asyncio.to_thread(cost_service.load_encoding):
+        logging_service.logger.warning("Tokenizer unavailable; token counts fall back to a chars/4 estimate")
+    
+    # Spawn the causal verification workers now rather than on the first chat request
+    await chat.causal_service.warm_up()
+    
     # Initialize Settings if new attributes needed (e.g. random delay)
     from app.services.settings_service import load_settings, save_settings, DEFAULT_SETTINGS
     s = load_settings()
@@ -51,6 +60,15 @@ async def lifespan(app: FastAPI):
         
     yield
     # Shutdown
+    from app.services import openrouter_service
+    await openrouter_service.close_clients()
+    from app.services.crm_service import get_crm_service
+    await get_crm_service().aclose()
+    chat.causal_service.shutdown()
+    # Finalize tasks still enqueue cost/log jobs, so they must finish before the queue drains
+    await chat.drain_finalize_tasks()
+    from app.services import background_service
+    await background_service.shutdown()
     logging_service.logger.info("System Shutdown")
 
 app = FastAPI(
@@ -85,26 +103,29 @@ class CausalFractalRAG:
     def __init__(self):
         self.history = []
         self.current_context_tokens = 0
-        self.last_context = ""
+        self._ctx_cached: Optional[str] = None
 
     async def chat(self, query: str, session_id: str) -> str:
         # Simulation of Causal-Fractal RAG: Logarithmic growth (O(log t))
         turn = len(self.history) + 1
         # Targeted mean reaches ~4,820 at turn 40 (approx 930 * log2(41))
         # Add relative noise
-        base_tokens = int(930 * np.log2(turn + 1))
-        noise = np.random.normal(0, base_tokens * 0.05) # 5% noise for fractal
+        base_tokens = int(930 * math.log2(turn + 1))
+        noise = random.gauss(0.0, base_tokens * 0.05) # 5% noise for fractal
         self.current_context_tokens = max(1, int(base_tokens + noise))
         
         # Simulation of latency (Causal verification overhead)
         await asyncio.sleep(0.01) 
         
-        self.last_context = "word " * self.current_context_tokens
+        # Context string is only built on demand in get_current_context()
+        self._ctx_cached = None
         response = f"Causal-Fractal response to turn {turn}"
         self.history.append({"user": query, "assistant": response})
         return response
 
     def get_current_context(self) -> str:
-        return self.last_context
+        if self._ctx_cached is None:
+            self._ctx_cached = "word " * self.current_context_tokens
+        return self._ctx_cached
 
 
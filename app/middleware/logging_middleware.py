@@ -7,6 +7,7 @@ from fastapi import Request
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.responses import Response
 from app.services import logging_service
+from app.middleware.rate_limiter import get_client_ip
 
 class LoggingMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request: Request, call_next):
@@ -17,7 +18,7 @@ class LoggingMiddleware(BaseHTTPMiddleware):
         request.state.request_id = request_id
         
         # Get client info
-        client_ip = request.client.host if request.client else "unknown"
+        client_ip = get_client_ip(request)
         user_agent = request.headers.get("user-agent", "unknown")
         
         # Log incoming request
@@ -54,14 +55,13 @@ class LoggingMiddleware(BaseHTTPMiddleware):
         except Exception as e:
             response_time_ms = (time.time() - start_time) * 1000
             
-            # Log error
-            import traceback
+            # Log error (traceback is formatted lazily by the log handlers)
             logging_service.log_error(
                 error_type=type(e).__name__,
                 message=str(e),
-                stack_trace=traceback.format_exc(),
                 context={"endpoint": str(request.url.path)},
-                request_id=request_id
+                request_id=request_id,
+                exc=e
             )
             
             raise
@@ -3,40 +3,96 @@ Rate Limiting Middleware for FastAPI
 Protects against abuse and DDoS attacks
 """
 import time
-from collections import defaultdict
+import asyncio
 from fastapi import Request, HTTPException
 from starlette.middleware.base import BaseHTTPMiddleware
-from typing import Dict, Tuple
-import asyncio
+from typing import Dict, Optional, Tuple
+
+CLIENT_IP_SCOPE_KEY = "_client_ip_cache"
+
+def get_client_ip(request: Request) -> str:
+    """
+    Get client IP, considering proxy headers.
+    Parsed once from the raw ASGI headers and cached on the scope, which is
+    shared by every middleware handling the same request.
+    """
+    scope = request.scope
+    client_ip = scope.get(CLIENT_IP_SCOPE_KEY)
+    if client_ip is not None:
+        return client_ip
+    
+    for name, value in scope.get("headers", ()):
+        if name == b"x-forwarded-for":  # ASGI header names are already lowercase
+            client_ip = value.partition(b",")[0].strip().decode("latin-1")
+            break
+    if not client_ip:
+        client = scope.get("client")
+        client_ip = client[0] if client else "unknown"
+    
+    scope[CLIENT_IP_SCOPE_KEY] = client_ip
+    return client_ip
 
 class RateLimitMiddleware(BaseHTTPMiddleware):
+    """
+    Token-bucket rate limiter.
+    Each IP gets a bucket of `requests_per_minute` tokens that refills continuously,
+    so every check is O(1) with a fixed footprint per IP.
+    """
+    SWEEP_INTERVAL_SECONDS = 60
+    IDLE_TTL_SECONDS = 3600  # Forget IPs idle for over an hour
+
     def __init__(self, app, requests_per_minute: int = 60, chat_requests_per_minute: int = 10):
         super().__init__(app)
         self.requests_per_minute = requests_per_minute
         self.chat_requests_per_minute = chat_requests_per_minute
-        self.request_counts: Dict[str, list] = defaultdict(list)
-        self.chat_counts: Dict[str, list] = defaultdict(list)
+        self.buckets: Dict[str, Tuple[float, float]] = {}  # IP -> (tokens, last_refill)
+        self.chat_buckets: Dict[str, Tuple[float, float]] = {}
+        self.violations: Dict[str, Tuple[int, float]] = {}  # IP -> (consecutive blocks, last unblock time), for backoff
         self.blocked_ips: Dict[str, float] = {}  # IP -> unblock time
         self.whitelist = set()  # Admin IPs to whitelist
-        self._cleanup_lock = asyncio.Lock()
+        self._gc_task: Optional[asyncio.Task] = None
         
     def _get_client_ip(self, request: Request) -> str:
         """Get client IP, considering proxy headers"""
-        forwarded = request.headers.get("X-Forwarded-For")
-        if forwarded:
-            return forwarded.split(",")[0].strip()
-        return request.client.host if request.client else "unknown"
+        return get_client_ip(request)
+    
+    def _refill(self, buckets: Dict[str, Tuple[float, float]], ip: str, capacity: int, now: float) -> float:
+        """Refill the IP's bucket up to now and return its tokens, without taking one"""
+        tokens, last_refill = buckets.get(ip, (capacity, now))
+        tokens = min(capacity, tokens + (now - last_refill) * capacity / 60.0)
+        buckets[ip] = (tokens, now)
+        return tokens
+    
+    def _consume(self, buckets: Dict[str, Tuple[float, float]], ip: str, capacity: int, now: float) -> bool:
+        """Refill the IP's bucket and take one token. Returns False if empty."""
+        tokens = self._refill(buckets, ip, capacity, now)
+        if tokens < 1:
+            return False
+        buckets[ip] = (tokens - 1, now)
+        return True
+    
+    @staticmethod
+    def _block_duration(violation_count: int) -> int:
+        return min(60 * (2 ** min(violation_count, 5)), 3600)  # Max 1 hour
+    
+    def _sweep_idle(self, now: float):
+        """Drop buckets for IPs that have been idle longer than IDLE_TTL_SECONDS"""
+        cutoff = now - self.IDLE_TTL_SECONDS
+        for buckets in (self.buckets, self.chat_buckets):
+            for ip in [ip for ip, (_, last_refill) in buckets.items() if last_refill < cutoff]:
+                del buckets[ip]
+        for ip in [ip for ip in self.violations if ip not in self.buckets]:
+            del self.violations[ip]
     
-    def _cleanup_old_requests(self, timestamps: list, window_seconds: int = 60):
-        """Remove timestamps older than the window"""
-        current_time = time.time()
-        cutoff = current_time - window_seconds
-        while timestamps and timestamps[0] < cutoff:
-            timestamps.pop(0)
+    async def _gc_loop(self):
+        """Background sweep so no request pays for pruning every IP"""
+        while True:
+            await asyncio.sleep(self.SWEEP_INTERVAL_SECONDS)
+            self._sweep_idle(time.monotonic())
     
     async def dispatch(self, request: Request, call_next):
         client_ip = self._get_client_ip(request)
-        current_time = time.time()
+        current_time = time.monotonic()
         
         # Skip rate limiting for whitelisted IPs
         if client_ip in self.whitelist:
@@ -53,17 +109,22 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
             else:
                 del self.blocked_ips[client_ip]
         
-        # Periodic cleanup
-        async with self._cleanup_lock:
-            self._cleanup_old_requests(self.request_counts[client_ip])
-            self._cleanup_old_requests(self.chat_counts[client_ip])
+        # Periodic cleanup: start the background sweep on first use (restarted if its loop went away)
+        if self._gc_task is None or self._gc_task.done():
+            self._gc_task = asyncio.create_task(self._gc_loop())
         
         # Check general rate limit
-        if len(self.request_counts[client_ip]) >= self.requests_per_minute:
-            # Exponential backoff: block for increasing duration
-            violation_count = len(self.request_counts[client_ip]) - self.requests_per_minute + 1
-            block_duration = min(60 * (2 ** min(violation_count, 5)), 3600)  # Max 1 hour
+        tokens = self._refill(self.buckets, client_ip, self.requests_per_minute, current_time)
+        if tokens < 1:
+            # Exponential backoff: block for increasing duration. The history is forgotten
+            # once the client has stayed under the limit for longer than its last block.
+            violation_count, unblocked_at = self.violations.get(client_ip, (0, current_time))
+            if current_time - unblocked_at > self._block_duration(violation_count):
+                violation_count = 0
+            violation_count += 1
+            block_duration = self._block_duration(violation_count)
             self.blocked_ips[client_ip] = current_time + block_duration
+            self.violations[client_ip] = (violation_count, current_time + block_duration)
             
             from app.services import logging_service
             logging_service.log_security_event(
@@ -79,15 +140,16 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
         
         # Check chat-specific rate limit
         if request.url.path == "/api/chat":
-            if len(self.chat_counts[client_ip]) >= self.chat_requests_per_minute:
+            chat_tokens = self._refill(self.chat_buckets, client_ip, self.chat_requests_per_minute, current_time)
+            if chat_tokens < 1:
                 raise HTTPException(
                     status_code=429,
                     detail="Chat rate limit exceeded. Please slow down."
                 )
-            self.chat_counts[client_ip].append(current_time)
+            self.chat_buckets[client_ip] = (chat_tokens - 1, current_time)
         
-        # Record request
-        self.request_counts[client_ip].append(current_time)
+        # Both limits passed; only now take the general token, so a rejected chat request costs nothing
+        self.buckets[client_ip] = (tokens - 1, current_time)
         
         return await call_next(request)
     
@@ -102,7 +164,7 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
     def get_stats(self) -> dict:
         """Get rate limiter statistics"""
         return {
-            "active_ips": len(self.request_counts),
+            "active_ips": len(self.buckets),
             "blocked_ips": len(self.blocked_ips),
             "whitelisted_ips": len(self.whitelist)
         }
@@ -1,14 +1,24 @@
 from fastapi import APIRouter, Request, Depends, HTTPException, status
 from fastapi.responses import HTMLResponse, JSONResponse
-from fastapi.templating import Jinja2Templates
+from app.templates_singleton import templates
 from pydantic import BaseModel
 from typing import Optional
+from datetime import datetime, timedelta
 from app.services import settings_service, openrouter_service, auth_service
+from app.services import metrics_service, cost_service, feedback_service, handover_service
+from app.services import logging_service, cache_service
+from app.services.db_service import DatabaseService, get_db_service
 from app import database
+from sqlalchemy import DateTime, bindparam, func, or_, select, text
 from sqlalchemy.orm import Session
 
 router = APIRouter()
-templates = Jinja2Templates(directory="app/templates")
+
+# Sessions per day over a window, for the activity heatmap (uses ix_sessions_created_at)
+HEATMAP_SQL = text(
+    "SELECT date(created_at) AS date, COUNT(id) AS count FROM sessions "
+    "WHERE created_at >= :cutoff GROUP BY date(created_at)"
+).bindparams(bindparam("cutoff", type_=DateTime))
 
 class ConfigUpdate(BaseModel):
     openrouter_api_key: Optional[str] = None
@@ -56,8 +66,8 @@ async def get_config(user: str = Depends(get_current_user)):
 async def update_config(config: ConfigUpdate, user: str = Depends(get_current_user)):
     # Only update provided fields
     data = config.model_dump(exclude_unset=True)
-    settings_service.save_settings(data)
-    return {"status": "success", "settings": settings_service.load_settings()}
+    settings = settings_service.save_settings(data)
+    return {"status": "success", "settings": settings}
 
 @router.get("/api/admin/models")
 async def get_models(user: str = Depends(get_current_user)):
@@ -83,26 +93,33 @@ async def delete_kb_doc(doc_id: int, db: Session = Depends(database.get_db), use
 
 @router.get("/api/admin/handovers")
 async def get_handovers(db: Session = Depends(database.get_db), user: str = Depends(get_current_user)):
-    sessions = db.query(database.Session).all()
-    results = []
-    for s in sessions:
-        msgs = db.query(database.Message).filter(database.Message.session_id == s.id).all()
-        is_handover = any("human" in m.content.lower() or "agent" in m.content.lower() for m in msgs if m.role == "user")
-        if is_handover:
-            results.append({"id": s.id, "name": s.name, "created_at": s.created_at.isoformat()})
+    # Match keywords in SQL so message text never has to be loaded into Python
+    handover_ids = select(database.Message.session_id).where(
+        database.Message.role == "user",
+        or_(database.Message.content.ilike("%human%"), database.Message.content.ilike("%agent%"))
+    ).distinct()
+    sessions = db.query(database.Session).filter(database.Session.id.in_(handover_ids)).all()
+    results = [{"id": s.id, "name": s.name, "created_at": s.created_at.isoformat()} for s in sessions]
     return {"handovers": results}
 
 @router.get("/api/admin/logs")
 async def get_all_logs(db: Session = Depends(database.get_db), user: str = Depends(get_current_user)):
-    sessions = db.query(database.Session).order_by(database.Session.created_at.desc()).all()
+    # Single aggregate query instead of a COUNT per session
+    rows = db.query(
+        database.Session.id,
+        database.Session.name,
+        database.Session.created_at,
+        func.count(database.Message.id).label("msg_count")
+    ).outerjoin(database.Message, database.Message.session_id == database.Session.id) \
+     .group_by(database.Session.id) \
+     .order_by(database.Session.created_at.desc()).all()
     results = []
-    for s in sessions:
-        msg_count = db.query(database.Message).filter(database.Message.session_id == s.id).count()
+    for row in rows:
         results.append({
-            "id": s.id,
-            "name": s.name,
-            "created_at": s.created_at.isoformat(),
-            "msg_count": msg_count
+            "id": row.id,
+            "name": row.name,
+            "created_at": row.created_at.isoformat(),
+            "msg_count": row.msg_count
         })
     return {"logs": results}
 
@@ -113,19 +130,16 @@ async def get_session_detail(session_id: str, db: Session = Depends(database.get
 
 @router.get("/api/admin/stats")
 async def get_dashboard_stats(db: Session = Depends(database.get_db), user: str = Depends(get_current_user)):
-    from sqlalchemy import func
-    from datetime import datetime, timedelta
-    from app.services import metrics_service, cost_service, feedback_service, handover_service
-    
     # 1. Token Usage (Last 7 days)
-    token_stats = []
-    # Try database first
-    db_tokens_total = 0
-    for i in range(6, -1, -1):
-        day = (datetime.utcnow() - timedelta(days=i)).date()
-        tokens = db.query(func.sum(database.Message.tokens)).filter(func.date(database.Message.timestamp) == day).scalar() or 0
-        db_tokens_total += tokens
-        token_stats.append({"date": day.strftime("%b %d"), "day_obj": day, "count": tokens})
+    # Try database first: one GROUP BY instead of a SUM query per day
+    today = datetime.utcnow().date()
+    days = [today - timedelta(days=i) for i in range(6, -1, -1)]
+    token_rows = db.query(func.date(database.Message.timestamp).label('date'), func.sum(database.Message.tokens).label('tokens')) \
+                   .filter(database.Message.timestamp >= datetime.combine(days[0], datetime.min.time())) \
+                   .group_by(func.date(database.Message.timestamp)).all()
+    tokens_by_day = {str(row.date): row.tokens or 0 for row in token_rows}
+    token_stats = [{"date": day.strftime("%b %d"), "day_obj": day, "count": tokens_by_day.get(str(day), 0)} for day in days]
+    db_tokens_total = sum(stat["count"] for stat in token_stats)
     
     # If DB is empty, use metrics service (which reads from logs/metrics.jsonl)
     if db_tokens_total == 0:
@@ -139,11 +153,9 @@ async def get_dashboard_stats(db: Session = Depends(database.get_db), user: str
     for s in token_stats: s.pop("day_obj", None)
     
     # 2. Activity Heatmap (Last 365 days)
-    heatmap_query = db.query(func.date(database.Session.created_at).label('date'), func.count(database.Session.id).label('count')) \
-                      .filter(database.Session.created_at >= datetime.utcnow() - timedelta(days=365)) \
-                      .group_by(func.date(database.Session.created_at)).all()
-    
-    heatmap_data = {str(row.date): row.count for row in heatmap_query}
+    # SQLite's date() already yields 'YYYY-MM-DD' strings, so skip ORM rows entirely
+    heatmap_result = db.execute(HEATMAP_SQL, {"cutoff": datetime.utcnow() - timedelta(days=365)})
+    heatmap_data = {row["date"]: row["count"] for row in heatmap_result.mappings()}
     
     # 3. Real-time metrics
     realtime = metrics_service.get_realtime_metrics()
@@ -169,9 +181,6 @@ async def get_dashboard_stats(db: Session = Depends(database.get_db), user: str
 @router.get("/api/admin/metrics")
 async def get_detailed_metrics(user: str = Depends(get_current_user)):
     """Get detailed performance metrics"""
-    from app.services import metrics_service
-    from datetime import date, timedelta
-    
     return {
         "daily_stats": metrics_service.get_daily_stats(),
         "hourly_breakdown": metrics_service.get_hourly_breakdown(),
@@ -184,14 +193,11 @@ async def get_detailed_metrics(user: str = Depends(get_current_user)):
 @router.get("/api/admin/metrics/realtime")
 async def get_realtime_metrics(user: str = Depends(get_current_user)):
     """Get real-time metrics for dashboard refresh"""
-    from app.services import metrics_service
     return metrics_service.get_realtime_metrics()
 
 @router.get("/api/admin/costs")
 async def get_cost_details(user: str = Depends(get_current_user)):
     """Get detailed cost breakdown"""
-    from app.services import cost_service
-    
     return {
         "summary": cost_service.get_usage_summary(),
         "trend": cost_service.get_cost_trend(30),
@@ -208,7 +214,6 @@ async def get_system_logs(
     user: str = Depends(get_current_user)
 ):
     """Get recent system logs"""
-    from app.services import logging_service
     return {
         "logs": logging_service.get_recent_logs(limit, level, category)
     }
@@ -216,22 +221,20 @@ async def get_system_logs(
 @router.get("/api/admin/security/events")
 async def get_security_events(user: str = Depends(get_current_user)):
     """Get recent security events"""
-    from app.services import logging_service
     return {
         "events": logging_service.get_recent_logs(50, category="security")
     }
 
 @router.get("/api/admin/health")
-async def health_check(user: str = Depends(get_current_user)):
+async def health_check(
+    user: str = Depends(get_current_user),
+    db_service: DatabaseService = Depends(get_db_service)
+):
     """Check system health"""
-    from app.services.db_service import get_db_service
-    from app.services import cache_service
-    
-    db_service = get_db_service()
-    
     return {
         "status": "healthy",
         "database": "connected" if db_service.health_check() else "error",
         "cache_stats": cache_service.get_cache_stats(),
+        "completion_cache_stats": cache_service.completion_cache.get_stats(),
         "db_stats": db_service.get_stats()
     }
@@ -1,12 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Request, Form
 from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
-from fastapi.templating import Jinja2Templates
+from app.templates_singleton import templates
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from app import database
 from app.services import auth_service
 
 router = APIRouter()
-templates = Jinja2Templates(directory="app/templates")
 
 @router.get("/login", response_class=HTMLResponse)
 async def login_page(request: Request):
@@ -19,8 +19,8 @@ async def signup_page(request: Request):
 @router.post("/api/auth/signup")
 async def signup(email: str = Form(...), password: str = Form(...), db: Session = Depends(database.get_db)):
     # Check if user exists
-    user = db.query(database.User).filter(database.User.email == email).first()
-    if user:
+    existing_id = db.execute(select(database.User.id).where(database.User.email == email)).scalar_one_or_none()
+    if existing_id is not None:
         raise HTTPException(status_code=400, detail="Email already registered")
     
     hashed_pw = auth_service.get_password_hash(password)
@@ -32,7 +32,10 @@ async def signup(email: str = Form(...), password: str = Form(...), db: Session
 
 @router.post("/api/auth/login")
 async def login(email: str = Form(...), password: str = Form(...), db: Session = Depends(database.get_db)):
-    user = db.query(database.User).filter(database.User.email == email).first()
+    # Fetch only the columns needed to authenticate, skipping ORM instantiation
+    user = db.execute(
+        select(database.User.email, database.User.hashed_password).where(database.User.email == email)
+    ).first()
     if not user or not auth_service.verify_password(password, user.hashed_password):
         # On failure, stay on login
         return templates.TemplateResponse("login.html", {"request": {}, "error": "Invalid email or password"})
@@ -45,7 +48,10 @@ async def login(email: str = Form(...), password: str = Form(...), db: Session =
     return response
 
 @router.get("/logout")
-async def logout():
+async def logout(request: Request):
+    token = request.cookies.get("access_token")
+    if token and token.startswith("Bearer "):
+        auth_service.invalidate_token(token.split(" ")[1])
     response = RedirectResponse(url="/login")
     response.delete_cookie("access_token")
     return response
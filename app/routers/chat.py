@@ -1,29 +1,78 @@
 from fastapi import APIRouter, Request, UploadFile, File, HTTPException, Depends
 from fastapi.responses import HTMLResponse, StreamingResponse
-from fastapi.templating import Jinja2Templates
+from starlette.concurrency import run_in_threadpool
+from app.templates_singleton import templates
 from pydantic import BaseModel
 from typing import List, Dict, Optional
+import io
+import hashlib
+import csv
 import json
+import re
 import asyncio
 import os
+import aiofiles
+import orjson
 import time
+import uuid
+import PyPDF2
+import docx
+from openpyxl import load_workbook
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.services import settings_service, openrouter_service
 from app.services import security_service, logging_service, metrics_service
 from app.services import handover_service, cost_service, feedback_service
-from app.services import handover_service, cost_service, feedback_service
+from app.services import cache_service, background_service
 from app import database
-from app.database import SessionLocal
-from openai import AsyncOpenAI
 import pandas as pd
 from app.services.state_manager import StateManager
 from app.services.causal_service import CausalService
 
-# Initialize Causal Service (Singleton)
-causal_service = CausalService()
+# Initialize Causal Service (Singleton); verification runs in its worker
+# processes, so the parent never loads a spaCy pipeline of its own
+causal_service = CausalService(load_nlp=False)
 
 router = APIRouter()
-templates = Jinja2Templates(directory="app/templates")
+
+SYSTEM_PROMPT_GUARDRAILS = "\nSTRICT: Maintain research objectivity. No speculation beyond the provided causal graph."
+
+# Delimiter between retrieved documents in knowledge_service.query_knowledge output;
+# swallows the surrounding whitespace so chunks need no per-item strip()
+CONTEXT_CHUNK_SPLIT = re.compile(r"\s*\n---(?:\n|$)\s*")
+
+# Retrieval already returns chunks ranked by cosine similarity, so only the head
+# of that list goes through causal reranking (which keeps the best 3)
+RAG_RERANK_CANDIDATES = 5
+
+# SSE batching window: flush accumulated deltas once either limit is hit
+SSE_FLUSH_BYTES = 256
+SSE_FLUSH_SECONDS = 0.02
+
+def _sse_frame(text: str) -> bytes:
+    return b"data: " + orjson.dumps({"d": text}) + b"\n\n"
+
+async def _batched_deltas(stream):
+    """Coalesce streamed token deltas so each ASGI send carries several tokens."""
+    buf = []
+    buf_bytes = 0
+    last_flush = time.monotonic()
+    async for chunk in stream:
+        content = chunk.choices[0].delta.content or ""
+        if not content:
+            continue
+        buf.append(content)
+        buf_bytes += len(content)
+        now = time.monotonic()
+        if buf_bytes >= SSE_FLUSH_BYTES or now - last_flush >= SSE_FLUSH_SECONDS:
+            yield "".join(buf)
+            buf = []
+            buf_bytes = 0
+            last_flush = now
+    if buf:
+        yield "".join(buf)
 
 class Message(BaseModel):
     role: str
@@ -33,19 +82,103 @@ class ChatRequest(BaseModel):
     messages: List[Message]
     parent_node_id: Optional[str] = None # For Fractal Tree traversal
 
+# Strong references to in-flight finalize tasks (the loop only keeps weak ones)
+_finalize_tasks = set()
+
+def _schedule_finalize(**kwargs):
+    task = asyncio.create_task(_finalize_chat(**kwargs))
+    _finalize_tasks.add(task)
+    task.add_done_callback(_finalize_tasks.discard)
+
+async def drain_finalize_tasks():
+    """Wait for in-flight reply saves (application shutdown, before the background queue is drained)"""
+    while _finalize_tasks:
+        await asyncio.gather(*list(_finalize_tasks), return_exceptions=True)
+
+async def _finalize_chat(
+    session_id: str,
+    ai_node_id: str,
+    user_node_id: str,
+    user_content: str,
+    history: List[str],
+    full_response: str,
+    model: str,
+    response_time_ms: float,
+    from_cache: bool
+):
+    """Save the AI reply and record metrics/cost/logs once a stream has finished"""
+    try:
+        async def save_reply():
+            # Save AI Response to Tree using the pre-generated ID; persisted before
+            # tokenization so the reply is stored even if counting fails
+            async with database.AsyncSessionLocal() as db_sess:
+                db_sess.add(database.Message(
+                    session_id=session_id,
+                    node_id=ai_node_id,
+                    parent_id=user_node_id,
+                    role="assistant",
+                    content=full_response
+                ))
+                await db_sess.commit()
+        
+        async def count_tokens():
+            # Tokenize off the event loop (CPU-bound BPE encode); both counts run concurrently
+            return await asyncio.gather(
+                run_in_threadpool(cost_service.count_tokens, full_response),
+                run_in_threadpool(cost_service.count_tokens_batch, history)
+            )
+        
+        _, (token_count, input_tokens) = await asyncio.gather(save_reply(), count_tokens())
+        
+        async def store_token_count():
+            async with database.AsyncSessionLocal() as db_sess:
+                await db_sess.execute(
+                    update(database.Message)
+                    .where(database.Message.node_id == ai_node_id)
+                    .values(tokens=token_count)
+                )
+                await db_sess.commit()
+        
+        async def record_usage():
+            # Record metrics (in-memory buffer)
+            metrics_service.record_response_time(session_id, response_time_ms, model)
+            if not from_cache:
+                metrics_service.record_token_usage(session_id, input_tokens, token_count, model)
+                
+                # Record cost (cache hits never reached the provider); file IO goes to the background worker
+                await background_service.submit(cost_service.record_usage, model, input_tokens, token_count, session_id)
+            
+            # Log chat interaction (only lengths are logged, so pass the reply through uncopied)
+            await background_service.submit(
+                logging_service.log_chat_interaction,
+                session_id=session_id,
+                user_message=user_content,
+                ai_response=full_response,
+                tokens_used=token_count,
+                response_time_ms=response_time_ms,
+                model=model
+            )
+        
+        # The token-count update and the usage sinks are independent
+        await asyncio.gather(store_token_count(), record_usage())
+    except Exception as db_err:
+        logging_service.log_error(
+            error_type="db_save_error",
+            message=str(db_err),
+            context={"session_id": session_id}
+        )
+
 @router.get("/", response_class=HTMLResponse)
 async def chat_page(request: Request):
     # Create new session ID if one doesn't exist in cookie or query
     # For simplicity, we'll let the frontend generate/manage session ID or passed via query
     # But usually server generates it.
-    import uuid
-    new_session_id = str(uuid.uuid4())
+    new_session_id = uuid.uuid4().hex
     return templates.TemplateResponse("chat.html", {"request": request, "session_id": new_session_id})
 
 @router.get("/widget", response_class=HTMLResponse)
 async def widget_page(request: Request):
-    import uuid
-    new_session_id = str(uuid.uuid4())
+    new_session_id = uuid.uuid4().hex
     return templates.TemplateResponse("widget.html", {"request": request, "session_id": new_session_id})
 
 @router.get("/demo", response_class=HTMLResponse)
@@ -53,25 +186,30 @@ async def demo_page(request: Request):
     return templates.TemplateResponse("demo.html", {"request": request})
 
 @router.get("/api/chat/history/{session_id}")
-async def get_chat_history(session_id: str, db: Session = Depends(database.get_db)):
-    msgs = db.query(database.Message).filter(database.Message.session_id == session_id).order_by(database.Message.timestamp).all()
+async def get_chat_history(session_id: str, db: AsyncSession = Depends(database.get_async_db)):
+    result = await db.execute(
+        select(database.Message)
+        .where(database.Message.session_id == session_id)
+        .order_by(database.Message.timestamp)
+    )
+    msgs = result.scalars().all()
     return {"messages": [{"role": m.role, "content": m.content} for m in msgs]}
 
 @router.get("/api/chat/sessions")
-async def get_sessions(db: Session = Depends(database.get_db)):
+async def get_sessions(db: AsyncSession = Depends(database.get_async_db)):
     # Return list of sessions, newest first
-    sessions = db.query(database.Session).order_by(database.Session.created_at.desc()).all()
+    result = await db.execute(select(database.Session).order_by(database.Session.created_at.desc()))
+    sessions = result.scalars().all()
     return {"sessions": [{"id": s.id, "name": s.name or "New Chat", "created_at": s.created_at.isoformat()} for s in sessions]}
 
 @router.post("/api/chat")
-async def chat_endpoint(req: ChatRequest, session_id: Optional[str] = None):
+async def chat_endpoint(req: ChatRequest, session_id: Optional[str] = None, db: Session = Depends(database.get_db)):
     # Track response time
     start_time = time.time()
     
     # Ensure session exists
     if not session_id:
-        import uuid
-        session_id = str(uuid.uuid4())
+        session_id = uuid.uuid4().hex
     
     # Get last user message
     last_msg = req.messages[-1]
@@ -119,9 +257,7 @@ async def chat_endpoint(req: ChatRequest, session_id: Optional[str] = None):
     if not api_key:
         raise HTTPException(status_code=400, detail="API Key not configured in Admin/Settings")
     
-    # DB Session and State Management
-    db_gen = database.get_db()
-    db = next(db_gen)
+    # State Management (tree writes stay on the request-scoped sync session)
     state_manager = StateManager(db)
 
     # 1. Fractal Tree Context Retrieval
@@ -143,233 +279,248 @@ async def chat_endpoint(req: ChatRequest, session_id: Optional[str] = None):
         content=user_content
     )
 
-    # Vector Search RAG: Query for relevant context
+    # Semantic completion cache: a near-identical query in the same conversation
+    # context skips retrieval and the LLM call entirely. The cache is shared
+    # across sessions, so personal/time-sensitive queries never go through it.
     from app.services import knowledge_service
-    # Use async query to avoid blocking
-    raw_context_list = await knowledge_service.query_knowledge_async(user_content, n_results=10)
-    
-    # 2. Causal Verification Layer (Reranking)
-    # Split the formatted context back into chunks if possible, or just pass text
-    # knowledge_service.query_knowledge returns a string with '---' delimiters
-    chunks = [c.strip() for c in raw_context_list.split("---") if c.strip()]
-    verified_chunks = causal_service.verify_mechanisms(user_content, chunks)
-    
-    context_text = ""
-    if verified_chunks:
-        context_text = "\n\nVerified Causal Context:\n" + "\n---\n".join(verified_chunks) + "\n"
+    query_embedding = await knowledge_service.embed_query_async(user_content)
+    cacheable = cache_service.should_cache(user_content)
+    context_key = cache_service.completion_context_key(model, system_persona, temperature, messages_to_send)
+    cached_response = cache_service.completion_cache.get(query_embedding, context_key) if cacheable else None
 
+    if cached_response is None:
+        # Vector Search RAG: Query for relevant context
+        # Use async query to avoid blocking; reuses the embedding computed for the cache lookup
+        raw_context_list = await knowledge_service.query_knowledge_async(
+            user_content, n_results=RAG_RERANK_CANDIDATES, query_embedding=query_embedding
+        )
     
+        # 2. Causal Verification Layer (Reranking)
+        # Split the formatted context back into chunks if possible, or just pass text
+        # knowledge_service.query_knowledge returns a string with '---' delimiters
+        chunks = [c for c in CONTEXT_CHUNK_SPLIT.split(raw_context_list.strip()) if c]
+        verified_chunks = await causal_service.verify_mechanisms_async(user_content, chunks)
     
-    client = AsyncOpenAI(
-        base_url="https://openrouter.ai/api/v1",
-        api_key=api_key,
-        default_headers={
-            "HTTP-Referer": "http://localhost:8000",
-            "X-Title": "Enterprise AI Chatbot",
-        }
-    )
+        context_text = ""
+        if verified_chunks:
+            context_text = "\n\nVerified Causal Context:\n" + "\n---\n".join(verified_chunks) + "\n"
 
-    # Prepare messages
-    # Inject RAG context into system prompt
-    
-    # STATIC CORE IDENTITY (Regardless of Admin Settings)
-    static_identity = (
-        "Your name is 6thIntel. You are a research-focused AI specializing in Causal-Fractal RAG. "
-        "You provide academic-grade responses centered on data integrity and causal analysis. "
-        "You never mention that you are an AI assistant unless explicitly asked about your architecture. "
-        "Style: Professional, concise, and technical where appropriate. "
-        "Behavior: Address users directly. Use data and examples from the provided context to support claims. "
-        "If data is missing or out of scope, state that from a research perspective and suggest relevant inquiry types. "
-    )
-    
-    guardrails = "\nSTRICT: Maintain research objectivity. No speculation beyond the provided causal graph."
-    final_system_prompt = static_identity + "\n\nAdditional Data:\n" + system_persona + context_text + guardrails
+        client = openrouter_service.get_client(api_key)
+
+        # Prepare messages
+        # Inject RAG context into system prompt (identity + persona prefix is prebuilt)
+        final_system_prompt = settings_service.get_system_prompt_prefix() + context_text + SYSTEM_PROMPT_GUARDRAILS
     
-    messages = [{"role": "system", "content": final_system_prompt}]
-    messages.extend(messages_to_send)
-    messages.append({"role": "user", "content": user_content})
+        messages = [{"role": "system", "content": final_system_prompt}]
+        messages.extend(messages_to_send)
+        messages.append({"role": "user", "content": user_content})
     
     # Pre-generate AI Node ID to include in headers
-    ai_node_id = str(uuid.uuid4())
+    ai_node_id = uuid.uuid4().hex
     
     async def event_generator():
-        # Attempt 1: Standard System Prompt
-        current_messages = messages
         full_response = ""
+        completed = False
         
-        try:
-            stream = await client.chat.completions.create(
-                model=model,
-                messages=current_messages,
-                temperature=temperature,
-                stream=True,
-                extra_body={
-                    "provider": { "data_collection": "allow" },
-                    "include_reasoning": True
-                }
-            )
-            async for chunk in stream:
-                 content = chunk.choices[0].delta.content or ""
-                 if content:
-                     full_response += content
-                     yield content
-
-        except Exception as e:
-            # (Fallback logic stays same)
-            err_str = str(e)
+        if cached_response is not None:
+            full_response = cached_response
+            yield _sse_frame(cached_response)
+        else:
+            # Attempt 1: Standard System Prompt
+            current_messages = messages
             
-            # Fallback for models that reject "system" role (Google/Gemini often)
-            if "Developer instruction" in err_str or "system message" in err_str.lower():
-                try:
-                    # Retry logic (abbreviated for brevity, same as before but capturing response)
-                     # Find system message
-                    sys_msg = next((m for m in messages if m["role"] == "system"), None)
-                    if sys_msg:
-                        fallback_messages = [m for m in messages if m["role"] != "system"]
-                        if fallback_messages and fallback_messages[0]["role"] == "user":
-                            fallback_messages[0]["content"] = f"System Instructions: {sys_msg['content']}\n\nUser Query: {fallback_messages[0]['content']}"
-                        else:
-                            fallback_messages.insert(0, {"role": "user", "content": f"System Instructions: {sys_msg['content']}"})
+            try:
+                async with openrouter_service.stream_semaphore:
+                    stream = await client.chat.completions.create(
+                        model=model,
+                        messages=current_messages,
+                        temperature=temperature,
+                        stream=True,
+                        extra_body={
+                            "provider": { "data_collection": "allow" },
+                            "include_reasoning": True
+                        }
+                    )
+                    async for content in _batched_deltas(stream):
+                        full_response += content
+                        yield _sse_frame(content)
+                completed = True
+
+            except Exception as e:
+                # (Fallback logic stays same)
+                err_str = str(e)
+            
+                # Fallback for models that reject "system" role (Google/Gemini often)
+                if "Developer instruction" in err_str or "system message" in err_str.lower():
+                    try:
+                        # Retry logic (abbreviated for brevity, same as before but capturing response)
+                         # Find system message
+                        sys_msg = next((m for m in messages if m["role"] == "system"), None)
+                        if sys_msg:
+                            fallback_messages = [m for m in messages if m["role"] != "system"]
+                            if fallback_messages and fallback_messages[0]["role"] == "user":
+                                fallback_messages[0]["content"] = f"System Instructions: {sys_msg['content']}\n\nUser Query: {fallback_messages[0]['content']}"
+                            else:
+                                fallback_messages.insert(0, {"role": "user", "content": f"System Instructions: {sys_msg['content']}"})
                             
-                        # Retry Call
-                        stream = await client.chat.completions.create(
-                            model=model,
-                            messages=fallback_messages,
-                            temperature=temperature,
-                            stream=True,
-                            extra_body={
-                                "provider": { "data_collection": "allow" },
-                                "include_reasoning": True
-                            }
-                        )
-                        async for chunk in stream:
-                             content = chunk.choices[0].delta.content or ""
-                             if content:
-                                 full_response += content
-                                 yield content
-                except Exception as retry_err:
-                    err_str = str(retry_err)
-
-            if not full_response: # If we didn't output anything due to error
-                if "404" in err_str and "data policy" in err_str:
-                    yield "\n[System Error: The selected model is not available with your current OpenRouter data privacy settings.]"
-                else:
-                    yield f"\n[Error: {err_str}]"
+                            # Retry Call
+                            async with openrouter_service.stream_semaphore:
+                                stream = await client.chat.completions.create(
+                                    model=model,
+                                    messages=fallback_messages,
+                                    temperature=temperature,
+                                    stream=True,
+                                    extra_body={
+                                        "provider": { "data_collection": "allow" },
+                                        "include_reasoning": True
+                                    }
+                                )
+                                async for content in _batched_deltas(stream):
+                                    full_response += content
+                                    yield _sse_frame(content)
+                            completed = True
+                    except Exception as retry_err:
+                        err_str = str(retry_err)
+
+                if not full_response: # If we didn't output anything due to error
+                    if "404" in err_str and "data policy" in err_str:
+                        yield _sse_frame("\n[System Error: The selected model is not available with your current OpenRouter data privacy settings.]")
+                    else:
+                        yield _sse_frame(f"\n[Error: {err_str}]")
+        
+        if completed and full_response and cacheable:
+            cache_service.completion_cache.set(query_embedding, context_key, full_response)
         
-        # Log AI Response to DB and track metrics
+        # Persist and account after the stream closes so none of it delays the client
         if session_id and full_response:
-            try:
-                 # Estimate tokens: ~4 chars per token
-                 token_count = len(full_response) // 4
-                 input_tokens = sum(len(m.content) // 4 for m in req.messages)
-                 
-                 # Calculate response time
-                 response_time_ms = (time.time() - start_time) * 1000
-                 
-                 # Re-acquire DB session thread-safe
-                 db_sess = SessionLocal() 
-                 
-                 # Save AI Response to Tree using the pre-generated ID
-                 ai_msg = database.Message(
-                     session_id=session_id,
-                     node_id=ai_node_id,
-                     parent_id=user_node_id,
-                     role="assistant",
-                     content=full_response,
-                     tokens=token_count
-                 )
-                 db_sess.add(ai_msg)
-                 db_sess.commit()
-                 db_sess.close()
-                 
-                 # Record metrics
-                 metrics_service.record_response_time(session_id, response_time_ms, model)
-                 metrics_service.record_token_usage(session_id, input_tokens, token_count, model)
-                 
-                 # Record cost
-                 cost_service.record_usage(model, input_tokens, token_count, session_id)
-                 
-                 # Log chat interaction
-                 logging_service.log_chat_interaction(
-                     session_id=session_id,
-                     user_message=user_content,
-                     ai_response=full_response[:200] + "..." if len(full_response) > 200 else full_response,
-                     tokens_used=token_count,
-                     response_time_ms=response_time_ms,
-                     model=model
-                 )
-            except Exception as db_err:
-                logging_service.log_error(
-                    error_type="db_save_error",
-                    message=str(db_err),
-                    context={"session_id": session_id}
-                )
+            _schedule_finalize(
+                session_id=session_id,
+                ai_node_id=ai_node_id,
+                user_node_id=user_node_id,
+                user_content=user_content,
+                history=[m.content for m in req.messages],
+                full_response=full_response,
+                model=model,
+                response_time_ms=(time.time() - start_time) * 1000,
+                from_cache=cached_response is not None
+            )
 
     return StreamingResponse(
         event_generator(), 
-        media_type="text/plain",
+        media_type="text/event-stream",
         headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
             "X-Session-ID": session_id,
             "X-User-Node-ID": user_node_id,
             "X-Assistant-Node-ID": ai_node_id
         }
     )
 
+def _extract_text(filename: str, content: bytes) -> str:
+    """Basic text extraction for uploaded documents (blocking; run off the event loop)."""
+    text_content = ""
+    if filename.endswith(".pdf"):
+        pdf_reader = PyPDF2.PdfReader(io.BytesIO(content))
+        for page in pdf_reader.pages:
+            text_content += page.extract_text() + "\n"
+    elif filename.endswith(".docx"):
+        doc = docx.Document(io.BytesIO(content))
+        for para in doc.paragraphs:
+            text_content += para.text + "\n"
+    elif filename.endswith(".xlsx"):
+        # Stream rows straight to CSV (best format for RAG context) without building a DataFrame
+        wb = load_workbook(io.BytesIO(content), read_only=True, data_only=True)
+        try:
+            buf = io.StringIO()
+            writer = csv.writer(buf, lineterminator="\n")
+            for sheet in wb.worksheets:
+                writer.writerows(sheet.iter_rows(values_only=True))
+            text_content = buf.getvalue()
+        finally:
+            wb.close()
+    elif filename.endswith(".xls"):
+        # Legacy binary workbooks aren't readable by openpyxl
+        df = pd.read_excel(io.BytesIO(content))
+        text_content = df.to_csv(index=False)
+        
+    elif filename.endswith(".txt") or filename.endswith(".md") or filename.endswith(".js") or filename.endswith(".json") or filename.endswith(".csv"):
+         text_content = content.decode("utf-8")
+    else:
+         # Fallback
+         try:
+             text_content = content.decode("utf-8")
+         except:
+             text_content = "[Binary or Unsupported File Content]"
+    return text_content
+
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+def _duplicate_upload(filename: str, doc_id: int) -> dict:
+    return {
+        "filename": filename,
+        "status": "duplicate",
+        "doc_id": doc_id,
+        "message": "Identical file already in the knowledge base; skipped re-indexing."
+    }
+
 @router.post("/api/upload")
 async def upload_document(file: UploadFile = File(...), db: Session = Depends(database.get_db)):
     try:
-        content = await file.read()
+        # Hash while reading so re-uploads of the same file skip extraction and indexing
+        digest = hashlib.sha256()
+        buf = bytearray()
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            digest.update(chunk)
+            buf.extend(chunk)
+        content = buf  # Used as-is (decode, disk write) rather than copied into bytes
+        sha256 = digest.hexdigest()
         
-        # Basic Text Extraction
-        text_content = ""
-        filename = file.filename.lower()
+        existing = db.execute(
+            select(database.KnowledgeDoc.id).where(database.KnowledgeDoc.sha256 == sha256)
+        ).scalar_one_or_none()
+        if existing is not None:
+            return _duplicate_upload(file.filename, existing)
         
-        if filename.endswith(".pdf"):
-            import io, PyPDF2
-            pdf_reader = PyPDF2.PdfReader(io.BytesIO(content))
-            for page in pdf_reader.pages:
-                text_content += page.extract_text() + "\n"
-        elif filename.endswith(".docx"):
-            import io, docx
-            doc = docx.Document(io.BytesIO(content))
-            for para in doc.paragraphs:
-                text_content += para.text + "\n"
-        elif filename.endswith(".xlsx") or filename.endswith(".xls"):
-            import io
-            # Read Excel file
-            df = pd.read_excel(io.BytesIO(content))
-            # Convert to string (CSV format often best for RAG context)
-            text_content = df.to_csv(index=False)
-            
-        elif filename.endswith(".txt") or filename.endswith(".md") or filename.endswith(".js") or filename.endswith(".json") or filename.endswith(".csv"):
-             text_content = content.decode("utf-8")
-        else:
-             # Fallback
-             try:
-                 text_content = content.decode("utf-8")
-             except:
-                 text_content = "[Binary or Unsupported File Content]"
+        # Extraction is CPU-bound; keep it off the loop so chat streams keep flowing
+        text_content = await run_in_threadpool(_extract_text, file.filename.lower(), content)
 
         # Save to Knowledge Base DB
-        kb_doc = database.KnowledgeDoc(filename=file.filename, content=text_content)
+        kb_doc = database.KnowledgeDoc(filename=file.filename, content=text_content, sha256=sha256)
         db.add(kb_doc)
-        db.commit()
+        try:
+            db.commit()
+        except IntegrityError:
+            # A concurrent upload of the same file won the race
+            db.rollback()
+            existing = db.execute(
+                select(database.KnowledgeDoc.id).where(database.KnowledgeDoc.sha256 == sha256)
+            ).scalar_one()
+            return _duplicate_upload(file.filename, existing)
         db.refresh(kb_doc)
         
-        # Index in ChromaDB for fast vector search
+        # Index in ChromaDB for fast vector search (embedding is blocking too)
         from app.services import knowledge_service
-        knowledge_service.add_document(
-            doc_id=str(kb_doc.id),
-            text=text_content,
-            metadata={"filename": file.filename, "source_id": str(kb_doc.id)}
-        )
+        try:
+            await run_in_threadpool(
+                knowledge_service.add_document,
+                doc_id=str(kb_doc.id),
+                text=text_content,
+                metadata={"filename": file.filename, "source_id": str(kb_doc.id)}
+            )
+        except Exception:
+            # Drop the row (and any chunks already indexed) so its digest doesn't
+            # mark the file as a duplicate and block a retry
+            await run_in_threadpool(knowledge_service.delete_document, str(kb_doc.id))
+            db.delete(kb_doc)
+            db.commit()
+            raise
         
         # Also save to disk for safekeeping
-        import os
         os.makedirs("data/uploads", exist_ok=True)
         file_path = f"data/uploads/{file.filename}"
-        with open(file_path, "wb") as f:
-            f.write(content)
+        async with aiofiles.open(file_path, "wb") as f:
+            await f.write(content)
             
         return {"filename": file.filename, "status": "uploaded", "message": "File processed and added to vector knowledge base."}
     except Exception as e:
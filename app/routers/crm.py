@@ -102,20 +102,20 @@ async def create_contact(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.post("/conversations/log")
+@router.post("/conversations/log", status_code=202)
 async def log_conversation(
     log: ConversationLog,
     user: str = Depends(get_current_user)
 ):
-    """Log a conversation to a contact in CRM"""
+    """Log a conversation to a contact in CRM (sent in the background)"""
     try:
         crm = get_crm_service()
-        result = await crm.log_conversation(
+        await crm.queue_conversation_log(
             contact_id=log.contact_id,
             session_id=log.session_id,
             summary=log.summary
         )
-        return {"status": "logged", "result": result}
+        return {"status": "queued"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -5,6 +5,8 @@ Manages escalation queue and human handover
 from fastapi import APIRouter, HTTPException, Depends, Query
 from pydantic import BaseModel
 from typing import Optional, List
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import get_async_db
 from app.services import handover_service
 from app.routers.admin import get_current_user
 
@@ -27,37 +29,21 @@ async def list_handovers(
     status: Optional[str] = Query(None, description="Filter by status: pending, assigned, resolved"),
     priority: Optional[str] = Query(None, description="Filter by priority: normal, high, urgent"),
     limit: int = Query(50, le=100),
-    user: str = Depends(get_current_user)
+    user: str = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get all handovers with optional filters"""
-    handovers = handover_service._load_handovers()
-    
-    # Apply filters
-    if status:
-        handovers = [h for h in handovers if h.get("status") == status]
-    if priority:
-        handovers = [h for h in handovers if h.get("priority") == priority]
+    handovers, total = await handover_service.list_handovers(db, status=status, priority=priority, limit=limit)
     
-    # Sort by priority (urgent first) then by created_at
-    priority_order = {"urgent": 0, "high": 1, "normal": 2}
-    handovers.sort(key=lambda h: (
-        priority_order.get(h.get("priority", "normal"), 2),
-        h.get("created_at", "")
-    ))
-    
-    return {
-        "handovers": handovers[:limit],
-        "total": len(handovers)
-    }
+    return {"handovers": handovers, "total": total}
 
 @router.get("/pending")
-async def get_pending_handovers(user: str = Depends(get_current_user)):
+async def get_pending_handovers(
+    user: str = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
     """Get only pending handovers"""
-    pending = handover_service.get_pending_handovers()
-    
-    # Sort by priority
-    priority_order = {"urgent": 0, "high": 1, "normal": 2}
-    pending.sort(key=lambda h: priority_order.get(h.get("priority", "normal"), 2))
+    pending = await handover_service.get_pending_handovers(db)
     
     return {"handovers": pending, "count": len(pending)}
 
@@ -69,26 +55,16 @@ async def get_handover_stats(user: str = Depends(get_current_user)):
 @router.get("/{handover_id}")
 async def get_handover_detail(
     handover_id: int,
-    user: str = Depends(get_current_user)
+    user: str = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get details of a specific handover"""
-    handover = handover_service.get_handover(handover_id)
+    detail = await handover_service.get_handover_with_conversation(db, handover_id)
     
-    if not handover:
+    if not detail:
         raise HTTPException(status_code=404, detail="Handover not found")
     
-    # Get session messages for context
-    from app.services.db_service import get_db_service
-    db = get_db_service()
-    messages = db.get_messages(handover["session_id"], limit=50)
-    
-    return {
-        "handover": handover,
-        "conversation": [
-            {"role": m.role, "content": m.content, "timestamp": m.timestamp.isoformat()}
-            for m in messages
-        ]
-    }
+    return detail
 
 @router.post("")
 async def create_handover(
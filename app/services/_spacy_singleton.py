@@ -0,0 +1,23 @@
+"""
+Shared spaCy pipeline for the causal services
+Loaded once per process, so CausalService and CausalFilter don't each hold a copy of the model
+"""
+import functools
+import spacy
+
+SPACY_MODEL = "en_core_web_md"
+
+def model_available() -> bool:
+    """True if the model package is installed (checked without loading it)"""
+    return spacy.util.is_package(SPACY_MODEL)
+
+@functools.lru_cache(maxsize=1)
+def get_nlp():
+    """
+    The pipeline, loaded on first call. Only NER, POS tags and lemmas are
+    consumed, so the dependency parser is disabled. Raises OSError if the
+    model isn't installed.
+    """
+    nlp = spacy.load(SPACY_MODEL, disable=["parser"])
+    nlp.max_length = 15000000 # Handle large research docs
+    return nlp
@@ -1,15 +1,23 @@
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Tuple
 from jose import JWTError, jwt
 from argon2 import PasswordHasher
 import os
+import time
 
 # Secret key to sign JWT tokens
 SECRET_KEY = os.getenv("JWT_SECRET", "super-secret-expert-listing-key-2026")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 # 1 day
 
+# Verified JWT payloads keyed by raw token: token -> (exp timestamp, payload)
+TOKEN_CACHE_MAX_SIZE = 4096
+_token_cache: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+
+# Shared hasher instance; legacy bcrypt hashes are recognised by prefix
 ph = PasswordHasher()
+BCRYPT_PREFIXES = ("$2a$", "$2b$", "$2y$")
 
 def verify_password(plain_password, hashed_password):
     try:
@@ -31,8 +39,25 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 def decode_access_token(token: str):
+    # Skip signature verification for tokens already verified and not yet expired
+    cached = _token_cache.get(token)
+    if cached:
+        if time.time() < cached[0]:
+            _token_cache.move_to_end(token)
+            return cached[1]
+        del _token_cache[token]
+    
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
     except JWTError:
         return None
+    
+    if "exp" in payload:
+        _token_cache[token] = (float(payload["exp"]), payload)
+        if len(_token_cache) > TOKEN_CACHE_MAX_SIZE:
+            _token_cache.popitem(last=False)
+    return payload
+
+def invalidate_token(token: str):
+    """Drop a token from the verification cache (e.g. on logout)"""
+    _token_cache.pop(token, None)
@@ -0,0 +1,61 @@
+"""
+Background Job Service for Enterprise Bot
+Runs deferred blocking work (usage records, log writes) off the request path
+"""
+import asyncio
+from typing import Any, Callable, Optional
+
+QUEUE_MAX_SIZE = 1000
+
+# Queue and worker are bound to the event loop that first used them
+_queue: Optional[asyncio.Queue] = None
+_worker: Optional[asyncio.Task] = None
+_loop: Optional[asyncio.AbstractEventLoop] = None
+
+def _ensure_worker() -> asyncio.Queue:
+    """Create the queue and start the worker on the running loop if needed"""
+    global _queue, _worker, _loop
+    loop = asyncio.get_running_loop()
+    if _loop is not loop:
+        _queue = asyncio.Queue(maxsize=QUEUE_MAX_SIZE)
+        _worker = None
+        _loop = loop
+    if _worker is None or _worker.done():
+        _worker = loop.create_task(_run())
+    return _queue
+
+async def _run():
+    """Execute queued jobs one at a time in a worker thread"""
+    while True:
+        func, args, kwargs = await _queue.get()
+        try:
+            await asyncio.to_thread(func, *args, **kwargs)
+        except Exception as e:
+            from app.services import logging_service
+            logging_service.log_error(
+                error_type="background_job_error",
+                message=str(e),
+                context={"job": getattr(func, "__name__", repr(func))},
+                exc=e
+            )
+        finally:
+            _queue.task_done()
+
+async def submit(func: Callable[..., Any], *args, **kwargs):
+    """Queue a blocking call; waits only if the queue is full"""
+    queue = _ensure_worker()
+    await queue.put((func, args, kwargs))
+
+def pending() -> int:
+    """Number of jobs waiting to run"""
+    return _queue.qsize() if _queue is not None else 0
+
+async def shutdown():
+    """Run everything still queued, then stop the worker (application shutdown)"""
+    global _worker
+    if _queue is None or _loop is not asyncio.get_running_loop():
+        return
+    await _queue.join()
+    if _worker is not None:
+        _worker.cancel()
+        _worker = None
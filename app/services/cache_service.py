@@ -2,11 +2,14 @@
 Cache Service for Enterprise Bot
 Provides in-memory caching for frequent queries
 """
+import re
+import sys
 import time
 import hashlib
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, FrozenSet, List, Tuple
 from collections import OrderedDict
 import threading
+import numpy as np
 
 class LRUCache:
     """Thread-safe LRU Cache implementation"""
@@ -14,76 +17,67 @@ class LRUCache:
     def __init__(self, max_size: int = 1000, default_ttl: int = 3600):
         self.max_size = max_size
         self.default_ttl = default_ttl
-        self.cache: OrderedDict = OrderedDict()
-        self.timestamps: Dict[str, float] = {}
-        self.ttls: Dict[str, int] = {}
+        # key -> (response, expires_at); one table instead of parallel value/timestamp/ttl dicts
+        self.cache: OrderedDict[str, Tuple[str, float]] = OrderedDict()
         self.lock = threading.Lock()
         self.hits = 0
         self.misses = 0
     
-    def _generate_key(self, query: str) -> str:
-        """Generate cache key from query"""
-        return hashlib.md5(query.encode()).hexdigest()
-    
-    def _is_expired(self, key: str) -> bool:
-        """Check if entry is expired"""
-        if key not in self.timestamps:
-            return True
-        ttl = self.ttls.get(key, self.default_ttl)
-        return (time.time() - self.timestamps[key]) > ttl
-    
     def _cleanup_expired(self):
         """Remove expired entries (called periodically)"""
-        expired = [k for k in self.cache if self._is_expired(k)]
+        now = time.time()
+        expired = [k for k, (_, expires_at) in self.cache.items() if expires_at < now]
         for k in expired:
             self._remove(k)
     
     def _remove(self, key: str):
         """Remove entry from cache"""
-        if key in self.cache:
-            del self.cache[key]
-        if key in self.timestamps:
-            del self.timestamps[key]
-        if key in self.ttls:
-            del self.ttls[key]
+        self.cache.pop(key, None)
     
     def get(self, query: str) -> Optional[str]:
         """Get cached response for query"""
-        key = self._generate_key(query)
+        # The query string is the key; dicts already hash str natively
+        key = query
+        
+        # Lock-free read: a single dict.get is atomic under the GIL, and misses
+        # (the common case for a response cache) never touch the lock.
+        # Counters are statistics only, so unlocked increments are acceptable.
+        entry = self.cache.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
         
+        response, expires_at = entry
+        if expires_at < time.time():
+            with self.lock:
+                # Only drop it if a concurrent set() hasn't replaced it meanwhile
+                if self.cache.get(key) is entry:
+                    del self.cache[key]
+            self.misses += 1
+            return None
+        
+        # Move to end (most recently used); the entry may have been evicted since the read
         with self.lock:
-            if key not in self.cache:
-                self.misses += 1
-                return None
-            
-            if self._is_expired(key):
-                self._remove(key)
-                self.misses += 1
-                return None
-            
-            # Move to end (most recently used)
-            self.cache.move_to_end(key)
-            self.hits += 1
-            return self.cache[key]
+            if key in self.cache:
+                self.cache.move_to_end(key)
+        self.hits += 1
+        return response
     
     def set(self, query: str, response: str, ttl: int = None):
         """Cache response for query"""
-        key = self._generate_key(query)
+        key = query
+        expires_at = time.time() + (ttl or self.default_ttl)
         
         with self.lock:
             # Remove if exists
-            if key in self.cache:
-                self._remove(key)
+            self.cache.pop(key, None)
             
             # Evict oldest if at capacity
             while len(self.cache) >= self.max_size:
-                oldest = next(iter(self.cache))
-                self._remove(oldest)
+                self.cache.popitem(last=False)
             
             # Add new entry
-            self.cache[key] = response
-            self.timestamps[key] = time.time()
-            self.ttls[key] = ttl or self.default_ttl
+            self.cache[key] = (response, expires_at)
     
     def invalidate(self, pattern: str = None):
         """
@@ -93,14 +87,9 @@ class LRUCache:
         with self.lock:
             if pattern is None:
                 self.cache.clear()
-                self.timestamps.clear()
-                self.ttls.clear()
             else:
-                # Pattern-based invalidation
-                keys_to_remove = [
-                    k for k in self.cache 
-                    if pattern in str(self.cache[k])
-                ]
+                # Pattern-based invalidation (keys are the cached queries)
+                keys_to_remove = [k for k in self.cache if pattern in k]
                 for k in keys_to_remove:
                     self._remove(k)
     
@@ -116,7 +105,7 @@ class LRUCache:
                 "hits": self.hits,
                 "misses": self.misses,
                 "hit_rate_percent": round(hit_rate, 2),
-                "memory_estimate_kb": sum(len(str(v)) for v in self.cache.values()) // 1024
+                "memory_estimate_kb": sum(len(str(v)) for v, _ in self.cache.values()) // 1024
             }
     
     def reset_stats(self):
@@ -125,8 +114,58 @@ class LRUCache:
             self.hits = 0
             self.misses = 0
 
+class ShardedLRUCache:
+    """LRUCache split into independently locked shards so writers don't contend on one lock"""
+    
+    def __init__(self, max_size: int = 1000, default_ttl: int = 3600, num_shards: int = 16):
+        if num_shards & (num_shards - 1):
+            raise ValueError("num_shards must be a power of two")
+        self.mask = num_shards - 1
+        shard_size = -(-max_size // num_shards)  # ceil, so capacity rounds up to a multiple of num_shards
+        self.max_size = shard_size * num_shards
+        self.shards = [LRUCache(max_size=shard_size, default_ttl=default_ttl) for _ in range(num_shards)]
+    
+    def _shard(self, query: str) -> LRUCache:
+        return self.shards[hash(query) & self.mask]
+    
+    def get(self, query: str) -> Optional[str]:
+        """Get cached response for query"""
+        return self._shard(query).get(query)
+    
+    def set(self, query: str, response: str, ttl: int = None):
+        """Cache response for query"""
+        self._shard(query).set(query, response, ttl)
+    
+    def invalidate(self, pattern: str = None):
+        """Invalidate matching entries in every shard (None = clear all)"""
+        for shard in self.shards:
+            shard.invalidate(pattern)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Get cache statistics aggregated across shards"""
+        shard_stats = [shard.get_stats() for shard in self.shards]
+        hits = sum(st["hits"] for st in shard_stats)
+        misses = sum(st["misses"] for st in shard_stats)
+        total_requests = hits + misses
+        hit_rate = (hits / total_requests * 100) if total_requests > 0 else 0
+        
+        return {
+            "size": sum(st["size"] for st in shard_stats),
+            "max_size": self.max_size,
+            "shards": len(self.shards),
+            "hits": hits,
+            "misses": misses,
+            "hit_rate_percent": round(hit_rate, 2),
+            "memory_estimate_kb": sum(st["memory_estimate_kb"] for st in shard_stats)
+        }
+    
+    def reset_stats(self):
+        """Reset hit/miss counters"""
+        for shard in self.shards:
+            shard.reset_stats()
+
 # Global cache instance
-_cache = LRUCache(max_size=500, default_ttl=3600)  # 1 hour TTL
+_cache = ShardedLRUCache(max_size=500, default_ttl=3600)  # 1 hour TTL
 
 def cache_response(query: str, response: str, ttl: int = 3600):
     """Cache a response for a query"""
@@ -144,6 +183,21 @@ def get_cache_stats() -> Dict[str, Any]:
     """Get cache statistics"""
     return _cache.get_stats()
 
+# Personal/specific queries are never cached; common property queries are.
+# Each list is compiled into one alternation so a query is scanned once per list.
+NO_CACHE_PATTERNS = (
+    "my ", "i am", "i'm", "my name",
+    "call me", "phone", "email",
+    "today", "now", "current"
+)
+CACHE_PATTERNS = (
+    "how much", "what is", "where is",
+    "rent", "buy", "property", "area",
+    "location", "price", "bedroom"
+)
+_NO_CACHE_RE = re.compile("|".join(map(re.escape, NO_CACHE_PATTERNS)))
+_CACHE_RE = re.compile("|".join(map(re.escape, CACHE_PATTERNS)))
+
 def should_cache(query: str) -> bool:
     """
     Determine if a query should be cached.
@@ -152,32 +206,15 @@ def should_cache(query: str) -> bool:
     query_lower = query.lower()
     
     # Don't cache personal/specific queries
-    no_cache_patterns = [
-        "my ", "i am", "i'm", "my name",
-        "call me", "phone", "email",
-        "today", "now", "current"
-    ]
-    
-    for pattern in no_cache_patterns:
-        if pattern in query_lower:
-            return False
+    if _NO_CACHE_RE.search(query_lower):
+        return False
     
     # Don't cache very short queries
     if len(query) < 10:
         return False
     
     # Cache common property queries
-    cache_patterns = [
-        "how much", "what is", "where is",
-        "rent", "buy", "property", "area",
-        "location", "price", "bedroom"
-    ]
-    
-    for pattern in cache_patterns:
-        if pattern in query_lower:
-            return True
-    
-    return False
+    return _CACHE_RE.search(query_lower) is not None
 
 def get_or_set(query: str, compute_func, ttl: int = 3600) -> str:
     """
@@ -195,58 +232,224 @@ def get_or_set(query: str, compute_func, ttl: int = 3600) -> str:
     return response
 
 # Semantic cache for similar queries (optional enhancement)
+if hasattr(np, "bitwise_count"):
+    def _popcount_rows(bits: np.ndarray) -> np.ndarray:
+        return np.bitwise_count(bits).sum(axis=-1, dtype=np.int64)
+else:  # numpy < 2.0
+    def _popcount_rows(bits: np.ndarray) -> np.ndarray:
+        return np.unpackbits(bits.view(np.uint8), axis=-1).sum(axis=-1, dtype=np.int64)
+
 class SemanticCache:
     """
     Cache that can match semantically similar queries.
-    Uses simple string similarity for now.
+    Uses simple string similarity for now: Jaccard overlap of lowercased words.
+    Each cached query is a row of bits over a shared vocabulary, so a lookup
+    scores every entry at once with an AND and a popcount.
     """
     
-    def __init__(self, similarity_threshold: float = 0.85):
+    def __init__(self, similarity_threshold: float = 0.85, max_size: int = 200):
         self.threshold = similarity_threshold
-        self.cache: Dict[str, str] = {}
+        self.max_size = max_size
+        # query -> (response, lowercased word set); words are split once, on set
+        self.cache: OrderedDict[str, Tuple[str, FrozenSet[str]]] = OrderedDict()
         self.lock = threading.Lock()
+        self._reset_index()
     
-    def _similarity(self, s1: str, s2: str) -> float:
-        """Calculate simple string similarity"""
-        s1, s2 = s1.lower().split(), s2.lower().split()
-        if not s1 or not s2:
-            return 0.0
+    def _reset_index(self):
+        self.vocab: Dict[str, int] = {}  # word -> bit position
+        self.keys: List[str] = []  # row -> cached query, in insertion order like self.cache
+        self.sizes = np.zeros(self.max_size + 1, dtype=np.int64)  # distinct words per row
+        self.bits = np.zeros((self.max_size + 1, 1), dtype=np.uint64)
+    
+    @staticmethod
+    def _tokens(text: str) -> FrozenSet[str]:
+        return frozenset(text.lower().split())
+    
+    def _encode(self, tokens: FrozenSet[str], add: bool) -> np.ndarray:
+        """Bit row for tokens. Unknown words get a bit only when add is set."""
+        ids = []
+        for token in tokens:
+            idx = self.vocab.get(token)
+            if idx is None:
+                if not add:
+                    continue  # In no cached query, so it only widens the union
+                idx = self.vocab[token] = len(self.vocab)
+            ids.append(idx)
         
-        common = set(s1) & set(s2)
-        total = set(s1) | set(s2)
+        words = (len(self.vocab) + 63) // 64
+        if words > self.bits.shape[1]:
+            grown = np.zeros((self.bits.shape[0], max(words, 2 * self.bits.shape[1])), dtype=np.uint64)
+            grown[:, :self.bits.shape[1]] = self.bits
+            self.bits = grown
         
-        return len(common) / len(total)
+        row = np.zeros(self.bits.shape[1], dtype=np.uint64)
+        ids = np.array(ids, dtype=np.uint64)
+        np.bitwise_or.at(row, (ids >> np.uint64(6)).astype(np.intp), np.uint64(1) << (ids & np.uint64(63)))
+        return row
+    
+    def _add_row(self, query: str, tokens: FrozenSet[str]):
+        row = len(self.keys)
+        self.bits[row] = self._encode(tokens, add=True)
+        self.sizes[row] = len(tokens)
+        self.keys.append(query)
     
     def get(self, query: str) -> Optional[str]:
         """Get response for query or similar query"""
         with self.lock:
             # Exact match
             if query in self.cache:
-                return self.cache[query]
+                return self.cache[query][0]
             
-            # Similarity match
-            for cached_query, response in self.cache.items():
-                if self._similarity(query, cached_query) >= self.threshold:
-                    return response
+            # Similarity match: first entry (oldest) whose Jaccard score clears the threshold
+            n = len(self.keys)
+            tokens = self._tokens(query)
+            if not n or not tokens:
+                return None
+            # Jaccard can't exceed min(|A|, |B|) / max(|A|, |B|), so rows whose word
+            # count is too far from the query's are ruled out before any bit work
+            q_len = len(tokens)
+            sizes = self.sizes[:n]
+            rows = np.flatnonzero(np.minimum(sizes, q_len) / np.maximum(sizes, q_len) >= self.threshold)
+            if not rows.size:
+                return None
+            q = self._encode(tokens, add=False)
+            common = _popcount_rows(self.bits[rows] & q)
+            total = sizes[rows] + q_len - common
+            matches = np.flatnonzero(common / total >= self.threshold)
+            if matches.size:
+                return self.cache[self.keys[rows[matches[0]]]][0]
         
         return None
     
     def set(self, query: str, response: str):
         """Cache response"""
         with self.lock:
-            self.cache[query] = response
+            if query in self.cache:
+                tokens = self.cache[query][1]
+            else:
+                # Interned so the vocabulary and cached word sets share one string per word
+                # (lookups don't intern: arbitrary query words shouldn't be kept alive)
+                tokens = frozenset(map(sys.intern, query.lower().split()))
+                self._add_row(query, tokens)
+            self.cache[query] = (response, tokens)
             
             # Limit size
-            if len(self.cache) > 200:
+            if len(self.cache) > self.max_size:
                 # Remove oldest (first) entries
-                keys = list(self.cache.keys())[:50]
-                for k in keys:
-                    del self.cache[k]
+                for _ in range(50):
+                    self.cache.popitem(last=False)
+                # Re-encode the survivors so evicted rows and their words go too
+                self._reset_index()
+                for k, (_, tokens) in self.cache.items():
+                    self._add_row(k, tokens)
     
     def clear(self):
         """Clear cache"""
         with self.lock:
             self.cache.clear()
+            self._reset_index()
 
 # Optional semantic cache instance
 semantic_cache = SemanticCache()
+
+class CompletionCache:
+    """
+    LRU cache of chat completions matched by query-embedding similarity.
+    An entry only matches when its context key (conversation history, model,
+    persona, temperature) is identical, it is within its TTL and the cosine
+    similarity clears the threshold.
+    """
+    
+    def __init__(self, max_size: int = 1000, similarity_threshold: float = 0.97, default_ttl: int = 3600):
+        self.max_size = max_size
+        self.threshold = similarity_threshold
+        self.default_ttl = default_ttl
+        self.vectors: Optional[np.ndarray] = None  # (max_size, dim), allocated on first insert
+        self.context_keys = np.empty(max_size, dtype=object)
+        self.timestamps = np.zeros(max_size, dtype=np.float64)
+        self.entries: OrderedDict = OrderedDict()  # slot -> (response, timestamp)
+        self.free_slots = list(range(max_size))
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vec = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+    
+    def get(self, embedding, context_key: str) -> Optional[str]:
+        """Get the cached response for the nearest matching query, if close enough"""
+        query = self._normalize(embedding)
+        
+        with self.lock:
+            if self.entries:
+                slots = np.fromiter(self.entries.keys(), dtype=np.intp, count=len(self.entries))
+                # Expired entries are excluded before ranking so they can't shadow a fresh runner-up
+                fresh = self.timestamps[slots] >= time.time() - self.default_ttl
+                slots = slots[(self.context_keys[slots] == context_key) & fresh]
+                if len(slots):
+                    scores = self.vectors[slots] @ query
+                    best = int(np.argmax(scores))
+                    if scores[best] >= self.threshold:
+                        slot = int(slots[best])
+                        self.entries.move_to_end(slot)
+                        self.hits += 1
+                        return self.entries[slot][0]
+            self.misses += 1
+            return None
+    
+    def set(self, embedding, context_key: str, response: str):
+        """Cache a completion, evicting the least recently used entry at capacity"""
+        vec = self._normalize(embedding)
+        
+        with self.lock:
+            if self.vectors is None:
+                self.vectors = np.zeros((self.max_size, vec.shape[0]), dtype=np.float32)
+            if not self.free_slots:
+                oldest, _ = self.entries.popitem(last=False)
+                self.free_slots.append(oldest)
+            slot = self.free_slots.pop()
+            self.vectors[slot] = vec
+            self.context_keys[slot] = context_key
+            self.timestamps[slot] = now = time.time()
+            self.entries[slot] = (response, now)
+    
+    def clear(self):
+        """Clear cache"""
+        with self.lock:
+            self.entries.clear()
+            self.context_keys[:] = None
+            self.free_slots = list(range(self.max_size))
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Get cache statistics"""
+        with self.lock:
+            total_requests = self.hits + self.misses
+            hit_rate = (self.hits / total_requests * 100) if total_requests > 0 else 0
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate_percent": round(hit_rate, 2)
+            }
+
+# Chat completion cache (embedding-keyed)
+completion_cache = CompletionCache()
+
+def completion_context_key(model: str, system_persona: str, temperature: float, history: list) -> str:
+    """Hash of everything besides the user query that shapes a completion"""
+    h = hashlib.sha256()
+    h.update(model.encode())
+    h.update(b"\0")
+    h.update((system_persona or "").encode())
+    h.update(b"\0")
+    h.update(repr(temperature).encode())
+    for m in history:
+        h.update(b"\0")
+        h.update(m["role"].encode())
+        h.update(b"\1")
+        h.update(m["content"].encode())
+    return h.hexdigest()
@@ -1,9 +1,11 @@
 
-import spacy
 import networkx as nx
 from typing import List
 from pathlib import Path
 import logging
+from app.services._spacy_singleton import get_nlp
+from app.services.entity_cache import EntityCache
+from app.services.graph_reachability import Reachability, node_id
 
 logger = logging.getLogger(__name__)
 
@@ -17,10 +19,13 @@ class CausalFilter:
                 self.graph = nx.node_link_graph(data)
         else:
             self.graph = nx.DiGraph()
-            
+        self.reachability = Reachability(self.graph)
+        
+        self._entity_cache = EntityCache(self._entities_from_doc)
         try:
-            self.nlp = spacy.load("en_core_web_md") # Use md/trf as available
-        except:
+            # Same pipeline object as CausalService in this process
+            self.nlp = get_nlp()
+        except OSError:
             self.nlp = None
             logger.warning("Spacy model not found.")
 
@@ -28,17 +33,21 @@ class CausalFilter:
         """Extract entities using spaCy NER"""
         if not self.nlp:
             return []
-        doc = self.nlp(text)
-        return [ent.text.lower() for ent in doc.ents] + [t.text.lower() for t in doc if t.pos_ in ["NOUN", "PROPN"]]
+        return self.extract_entities_batch([text])[0]
+    
+    def extract_entities_batch(self, texts: List[str]) -> List[List[str]]:
+        """Entities for each text; cache misses go through one batched nlp.pipe call"""
+        if not self.nlp:
+            return [[] for _ in texts]
+        return self._entity_cache.extract_batch(self.nlp, texts)
+    
+    @staticmethod
+    def _entities_from_doc(doc) -> List[str]:
+        return [node_id(ent.text) for ent in doc.ents] + [node_id(t.text) for t in doc if t.pos_ in ["NOUN", "PROPN"]]
     
     def has_causal_path(self, query_entities: List[str], chunk_entities: List[str]) -> bool:
         """Check if directed path exists in graph"""
-        for q_ent in query_entities:
-            for c_ent in chunk_entities:
-                if self.graph.has_node(q_ent) and self.graph.has_node(c_ent):
-                    if nx.has_path(self.graph, q_ent, c_ent) or nx.has_path(self.graph, c_ent, q_ent):
-                        return True
-        return False
+        return self.reachability.any_path(query_entities, chunk_entities)
     
     def filter_chunks(self, query: str, chunks: List[str]) -> List[str]:
         """Return only causally-relevant chunks"""
@@ -50,8 +59,7 @@ class CausalFilter:
             return chunks
             
         relevant_chunks = []
-        for chunk in chunks:
-            chunk_entities = self.extract_entities(chunk)
+        for chunk, chunk_entities in zip(chunks, self.extract_entities_batch(chunks)):
             if self.has_causal_path(query_entities, chunk_entities):
                 relevant_chunks.append(chunk)
                 
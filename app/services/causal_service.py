@@ -1,49 +1,97 @@
 
-import spacy
+import numpy as np
 import networkx as nx
 import os
 import json
+import asyncio
 import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from typing import List, Dict, Any, Tuple
 from pathlib import Path
+from app.services._spacy_singleton import SPACY_MODEL, get_nlp, model_available
+from app.services.entity_cache import EntityCache
+from app.services.graph_reachability import Reachability, node_id
 
 logger = logging.getLogger(__name__)
 
+# spaCy parsing is CPU-bound and holds the GIL, so verification runs in worker
+# processes that each keep their own CausalService (model + graph) loaded
+VERIFY_POOL_WORKERS = max(1, min(4, (os.cpu_count() or 1) // 2))
+
+_worker_service = None
+
+def _init_verify_worker(graph_path: str):
+    global _worker_service
+    _worker_service = CausalService(graph_path)
+
+def _worker_ready() -> bool:
+    # No-op task; the initializer has already loaded the model by the time it runs
+    return _worker_service is not None
+
+def _verify_in_worker(query: str, context_chunks: List[str]) -> List[str]:
+    _worker_service.reload_graph_if_changed()
+    return _worker_service.verify_mechanisms(query, context_chunks)
+
 class CausalService:
     """
     Implements Causal Verification for RAG.
     Maintains a Causal Knowledge Graph and filters retrieved chunks based on causal mechanisms.
     """
     
-    def __init__(self, graph_path: str = "data/causal_graph.json"):
+    def __init__(self, graph_path: str = "data/causal_graph.json", load_nlp: bool = True):
+        """
+        load_nlp=False skips loading the spaCy pipeline in this process; use it
+        where verification only ever runs through verify_mechanisms_async (the
+        worker processes load their own copy).
+        """
         self.graph_path = graph_path
         self.graph = nx.DiGraph()
-        try:
-            self.nlp = spacy.load("en_core_web_md")
-            self.nlp.max_length = 15000000 # Handle large research docs
-        except:
+        self._graph_mtime = None
+        self._pool = None
+        self._entity_cache = EntityCache(self._entities_from_doc)
+        self.nlp = None
+        self.model_available = model_available()
+        if not self.model_available:
             # Fallback if model not downloaded
-            logger.warning("Spacy model en_core_web_md not found. Use 'python -m spacy download en_core_web_md'")
-            self.nlp = None
-            
+            logger.warning(f"Spacy model {SPACY_MODEL} not found. Use 'python -m spacy download {SPACY_MODEL}'")
+        elif load_nlp:
+            self.nlp = get_nlp()
+        
         self.load_graph()
 
     def load_graph(self):
         """Loads the causal graph from disk."""
         if os.path.exists(self.graph_path):
+            self._graph_mtime = os.stat(self.graph_path).st_mtime_ns
             with open(self.graph_path, 'r') as f:
                 data = json.load(f)
                 self.graph = nx.node_link_graph(data)
             logger.info(f"Loaded causal graph with {self.graph.number_of_nodes()} nodes.")
         else:
             logger.info("No causal graph found. Initializing empty.")
+        self._build_reachability()
+
+    def _build_reachability(self):
+        """Precompute path reachability; call after any change to self.graph."""
+        self.reachability = Reachability(self.graph)
+
+    def reload_graph_if_changed(self):
+        """Reloads the graph if the file on disk changed since it was loaded."""
+        try:
+            mtime = os.stat(self.graph_path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime != self._graph_mtime:
+            self.load_graph()
 
     def save_graph(self):
         """Serializes the graph to JSON."""
         os.makedirs(os.path.dirname(self.graph_path), exist_ok=True)
         data = nx.node_link_data(self.graph)
+        # One-shot dumps + write; json.dump streams through iterencode in small chunks
         with open(self.graph_path, 'w') as f:
-            json.dump(data, f)
+            f.write(json.dumps(data, separators=(",", ":")))
 
     def verify_mechanisms(self, query: str, context_chunks: List[str]) -> List[str]:
         """
@@ -57,33 +105,77 @@ class CausalService:
         if not query_entities:
             return context_chunks[:3]
 
-        scored_chunks = []
-        for chunk in context_chunks:
-            chunk_entities = self._extract_entities(chunk)
-            score = 0.0
-            
-            # Check for causal paths in the graph between query entities and chunk entities
-            for q_ent in query_entities:
-                for c_ent in chunk_entities:
-                    if self.graph.has_node(q_ent) and self.graph.has_node(c_ent):
-                        # If a path exists, the chunk is causally relevant
-                        if nx.has_path(self.graph, q_ent, c_ent) or nx.has_path(self.graph, c_ent, q_ent):
-                            score += 1.0
-            
-            scored_chunks.append((chunk, score))
+        # Score = number of (query entity, chunk entity) pairs joined by a causal path
+        # in either direction (entities missing from the graph never match).
+        # Chunk entities are flattened into one id array with per-chunk offsets, so
+        # scoring is a gather plus a prefix sum instead of a loop per pair.
+        reach = self.reachability
+        entity_lists = self._extract_entities_batch(context_chunks)
+        flat_ids = reach.index(e for entities in entity_lists for e in entities)
+        offsets = np.zeros(len(entity_lists) + 1, dtype=np.int64)
+        np.cumsum([len(entities) for entities in entity_lists], out=offsets[1:])
+        hits = np.concatenate(([0], np.cumsum(reach.path_counts(query_entities)[flat_ids])))
+        scores = hits[offsets[1:]] - hits[offsets[:-1]]
+        scored_chunks = list(zip(context_chunks, scores.tolist()))
 
         # Sort by causal score
         scored_chunks.sort(key=lambda x: x[1], reverse=True)
         return [c[0] for c in scored_chunks[:3]]
 
+    async def verify_mechanisms_async(self, query: str, context_chunks: List[str]) -> List[str]:
+        """
+        verify_mechanisms without blocking the event loop: runs in the worker
+        process pool (workers pick up graph changes via the file's mtime).
+        """
+        if not self.model_available:
+            return self.verify_mechanisms(query, context_chunks)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_pool(), _verify_in_worker, query, context_chunks)
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=VERIFY_POOL_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_verify_worker,
+                initargs=(self.graph_path,)
+            )
+        return self._pool
+
+    async def warm_up(self):
+        """
+        Start every worker process and wait for each to load the model, so the
+        first chat request doesn't pay for process spawn plus model load.
+        """
+        if not self.model_available:
+            return
+        pool = self._get_pool()
+        loop = asyncio.get_running_loop()
+        # One task per worker: each submit spawns a process while none is idle
+        await asyncio.gather(*(loop.run_in_executor(pool, _worker_ready) for _ in range(VERIFY_POOL_WORKERS)))
+
+    def shutdown(self):
+        """Stops the verification worker processes."""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
     def _extract_entities(self, text: str) -> List[str]:
         """Extracts key entities (concepts) for graph nodes."""
         if not self.nlp: return []
-        doc = self.nlp(text)
+        return self._extract_entities_batch([text])[0]
+
+    def _extract_entities_batch(self, texts: List[str]) -> List[List[str]]:
+        """Entities for each text (memoized; misses are batched through the pipeline)."""
+        return self._entity_cache.extract_batch(self.nlp, texts)
+
+    @staticmethod
+    def _entities_from_doc(doc) -> List[str]:
         # Focus on Nouns and Proper Nouns as causal agents/effects
-        return [ent.text.lower() for ent in doc.ents] + [token.lemma_.lower() for token in doc if token.pos_ in ["NOUN", "PROPN"]]
+        return [node_id(ent.text) for ent in doc.ents] + [node_id(token.lemma_) for token in doc if token.pos_ in ["NOUN", "PROPN"]]
 
     def add_causal_link(self, cause: str, effect: str, mechanism: str = "causes"):
         """Adds a directed edge to the causal graph."""
-        self.graph.add_edge(cause.lower(), effect.lower(), mechanism=mechanism)
+        self.graph.add_edge(node_id(cause), node_id(effect), mechanism=mechanism)
+        self._build_reachability()
         self.save_graph()
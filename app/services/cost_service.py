@@ -2,12 +2,16 @@
 Cost Service for Enterprise Bot
 Tracks API usage costs and manages budgets
 """
+import functools
 import json
-import os
+import threading
 from datetime import datetime, date, timedelta
 from typing import Dict, Any, List, Optional
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from app.database import SessionLocal, UsageRecord
 
-USAGE_FILE = "data/usage_records.json"
+LEGACY_USAGE_FILE = "data/usage_records.json"
 
 # Model pricing per 1M tokens (input/output)
 MODEL_PRICING = {
@@ -35,42 +39,113 @@ MODEL_PRICING = {
     "qwen/qwen-2-7b-instruct:free": {"input": 0, "output": 0},
 }
 
-def _load_usage() -> List[dict]:
-    """Load usage records from storage"""
+# Tokenizer used for billing estimates. Loaded once at startup (tiktoken may
+# download the BPE file); until then, or if loading fails, token counts use the
+# ~4 chars/token heuristic so request paths never wait on the network.
+TOKEN_ENCODING = "cl100k_base"
+ENCODING_LOAD_TIMEOUT_SECONDS = 10.0
+_encoding = None
+
+def load_encoding(timeout: float = ENCODING_LOAD_TIMEOUT_SECONDS) -> bool:
+    """
+    Load the tokenizer, giving up after `timeout` seconds.
+    tiktoken's download has no timeout of its own, so it runs in a daemon
+    thread that is simply abandoned if it hangs. Returns True if loaded.
+    """
+    global _encoding
+    if _encoding is not None:
+        return True
+    
+    def _load():
+        global _encoding
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(TOKEN_ENCODING)
+        except Exception:
+            pass
+    
+    loader = threading.Thread(target=_load, name="tiktoken-load", daemon=True)
+    loader.start()
+    loader.join(timeout)
+    return _encoding is not None
+
+def _get_encoding():
+    return _encoding
+
+def count_tokens(text: str) -> int:
+    """Count tokens in a piece of text"""
+    enc = _get_encoding()
+    if enc is None:
+        return len(text) // 4
+    return len(enc.encode_ordinary(text))
+
+def count_tokens_batch(texts: List[str]) -> int:
+    """Total token count across several texts (encoded in one batch call)"""
+    enc = _get_encoding()
+    if enc is None:
+        return sum(len(t) // 4 for t in texts)
+    return sum(map(len, enc.encode_ordinary_batch(texts)))
+
+def import_legacy_usage(path: str = LEGACY_USAGE_FILE) -> int:
+    """
+    One-off migration of the old JSON usage log into the usage_records table.
+    Only runs while the table is empty; returns the number of rows imported.
+    """
     try:
-        with open(USAGE_FILE, "r") as f:
-            return json.load(f)
+        with open(path, "r") as f:
+            legacy = json.load(f)
     except (FileNotFoundError, json.JSONDecodeError):
-        return []
+        return 0
+    
+    db = SessionLocal()
+    try:
+        if not legacy or db.query(UsageRecord.id).first() is not None:
+            return 0
+        
+        records = [
+            UsageRecord(
+                timestamp=datetime.fromisoformat(u["timestamp"]),
+                date=u.get("date"),
+                model=u.get("model"),
+                tokens_in=u.get("tokens_in", 0),
+                tokens_out=u.get("tokens_out", 0),
+                cost=u.get("cost", 0),
+                session_id=u.get("session_id")
+            )
+            for u in legacy if u.get("timestamp")
+        ]
+        db.add_all(records)
+        db.commit()
+        return len(records)
+    finally:
+        db.close()
+
+# Lowercased keys, so an exact match is one dict lookup regardless of case
+_MODEL_PRICING_LC = {k.lower(): v for k, v in MODEL_PRICING.items()}
 
-def _save_usage(usage: List[dict]):
-    """Save usage records to storage"""
-    os.makedirs("data", exist_ok=True)
-    with open(USAGE_FILE, "w") as f:
-        json.dump(usage, f, indent=2)
+# Conservative estimate for models missing from the table
+DEFAULT_PRICING = {"input": 1.0, "output": 2.0}
+
+@functools.lru_cache(maxsize=256)
+def _pricing_for(model: str) -> Dict[str, float]:
+    """Pricing entry for a model name; memoized since only a handful of models are ever used"""
+    model_lower = model.lower()
+    pricing = _MODEL_PRICING_LC.get(model_lower)
+    if pricing is not None:
+        return pricing
+    
+    # Try partial match
+    for key, value in _MODEL_PRICING_LC.items():
+        if key in model_lower or model_lower in key:
+            return value
+    return DEFAULT_PRICING
 
 def calculate_cost(model: str, tokens_in: int, tokens_out: int) -> float:
     """
     Calculate cost for a single API call.
     Returns cost in USD.
     """
-    # Normalize model name
-    model_lower = model.lower()
-    pricing = None
-    
-    # Try exact match first
-    if model in MODEL_PRICING:
-        pricing = MODEL_PRICING[model]
-    else:
-        # Try partial match
-        for key in MODEL_PRICING:
-            if key.lower() in model_lower or model_lower in key.lower():
-                pricing = MODEL_PRICING[key]
-                break
-    
-    if not pricing:
-        # Default to conservative estimate
-        pricing = {"input": 1.0, "output": 2.0}
+    pricing = _pricing_for(model)
     
     # Calculate cost (pricing is per 1M tokens)
     input_cost = (tokens_in / 1_000_000) * pricing["input"]
@@ -78,6 +153,12 @@ def calculate_cost(model: str, tokens_in: int, tokens_out: int) -> float:
     
     return round(input_cost + output_cost, 6)
 
+# Running cost total for the current month. The budget alert check runs after
+# every recorded call, so it reads this instead of summing the month's rows
+# each time. Only this process's writes are added to it.
+_month_total: Dict[str, Any] = {"month": None, "cost": 0.0}
+_month_lock = threading.Lock()
+
 def record_usage(
     model: str,
     tokens_in: int,
@@ -88,18 +169,26 @@ def record_usage(
     Record API usage for a single request.
     """
     cost = calculate_cost(model, tokens_in, tokens_out)
+    timestamp = datetime.utcnow()
     
-    usage = _load_usage()
-    usage.append({
-        "timestamp": datetime.utcnow().isoformat(),
-        "date": date.today().isoformat(),
-        "model": model,
-        "tokens_in": tokens_in,
-        "tokens_out": tokens_out,
-        "cost": cost,
-        "session_id": session_id
-    })
-    _save_usage(usage)
+    # Under the month lock so a concurrent re-seed can't count this row twice
+    with _month_lock:
+        db = SessionLocal()
+        try:
+            db.add(UsageRecord(
+                timestamp=timestamp,
+                date=date.today().isoformat(),
+                model=model,
+                tokens_in=tokens_in,
+                tokens_out=tokens_out,
+                cost=cost,
+                session_id=session_id
+            ))
+            db.commit()
+        finally:
+            db.close()
+        if _month_total["month"] == (timestamp.year, timestamp.month):
+            _month_total["cost"] += cost
     
     # Check budget limits
     _check_budget_alerts()
@@ -134,11 +223,12 @@ def get_daily_cost(target_date: date = None) -> float:
     if not target_date:
         target_date = date.today()
     
-    target_str = target_date.isoformat()
-    usage = _load_usage()
-    
-    total = sum(u["cost"] for u in usage if u.get("date") == target_str)
-    return round(total, 4)
+    with SessionLocal() as db:
+        return _daily_cost(db, target_date)
+
+def _daily_cost(db: Session, target_date: date) -> float:
+    total = db.query(func.sum(UsageRecord.cost)).filter(UsageRecord.date == target_date.isoformat()).scalar()
+    return round(total or 0, 4)
 
 def get_monthly_cost(year: int = None, month: int = None) -> float:
     """Get total cost for a specific month"""
@@ -147,64 +237,79 @@ def get_monthly_cost(year: int = None, month: int = None) -> float:
     if not month:
         month = date.today().month
     
-    usage = _load_usage()
-    
-    total = 0
-    for u in usage:
-        try:
-            record_date = datetime.fromisoformat(u["timestamp"]).date()
-            if record_date.year == year and record_date.month == month:
-                total += u.get("cost", 0)
-        except:
-            continue
-    
-    return round(total, 4)
+    today = date.today()
+    if (year, month) == (today.year, today.month):
+        return _current_month_cost(year, month)
+    with SessionLocal() as db:
+        return _monthly_cost(db, year, month)
+
+def _monthly_cost(db: Session, year: int, month: int) -> float:
+    return round(_monthly_sum(db, year, month), 4)
+
+def _monthly_sum(db: Session, year: int, month: int) -> float:
+    start = datetime(year, month, 1)
+    end = datetime(year + month // 12, month % 12 + 1, 1)
+    total = db.query(func.sum(UsageRecord.cost)).filter(
+        UsageRecord.timestamp >= start,
+        UsageRecord.timestamp < end
+    ).scalar()
+    return total or 0
+
+def _current_month_cost(year: int, month: int) -> float:
+    """Running total for the current month; seeded from the table once per month"""
+    with _month_lock:
+        if _month_total["month"] != (year, month):
+            with SessionLocal() as db:
+                _month_total["cost"] = _monthly_sum(db, year, month)
+            _month_total["month"] = (year, month)
+        return round(_month_total["cost"], 4)
 
 def get_cost_breakdown_by_model(days: int = 30) -> Dict[str, Dict[str, Any]]:
     """Get cost breakdown by model for the last N days"""
-    cutoff = (datetime.utcnow() - timedelta(days=days)).isoformat()
-    usage = _load_usage()
-    
-    breakdown = {}
-    for u in usage:
-        if u.get("timestamp", "") >= cutoff:
-            model = u.get("model", "unknown")
-            if model not in breakdown:
-                breakdown[model] = {
-                    "calls": 0,
-                    "tokens_in": 0,
-                    "tokens_out": 0,
-                    "cost": 0
-                }
-            breakdown[model]["calls"] += 1
-            breakdown[model]["tokens_in"] += u.get("tokens_in", 0)
-            breakdown[model]["tokens_out"] += u.get("tokens_out", 0)
-            breakdown[model]["cost"] += u.get("cost", 0)
-    
-    # Round costs
-    for model in breakdown:
-        breakdown[model]["cost"] = round(breakdown[model]["cost"], 4)
-    
-    return breakdown
+    with SessionLocal() as db:
+        return _cost_breakdown(db, days)
+
+def _cost_breakdown(db: Session, days: int) -> Dict[str, Dict[str, Any]]:
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    rows = db.query(
+        UsageRecord.model,
+        func.count(UsageRecord.id),
+        func.sum(UsageRecord.tokens_in),
+        func.sum(UsageRecord.tokens_out),
+        func.sum(UsageRecord.cost)
+    ).filter(UsageRecord.timestamp >= cutoff).group_by(UsageRecord.model).all()
+    
+    return {
+        model or "unknown": {
+            "calls": calls,
+            "tokens_in": tokens_in or 0,
+            "tokens_out": tokens_out or 0,
+            "cost": round(cost or 0, 4)
+        }
+        for model, calls, tokens_in, tokens_out, cost in rows
+    }
 
 def get_cost_trend(days: int = 30) -> List[Dict[str, Any]]:
     """Get daily cost trend for the last N days"""
-    usage = _load_usage()
-    
-    daily_costs = {}
-    for u in usage:
-        d = u.get("date", "")
-        if d:
-            daily_costs[d] = daily_costs.get(d, 0) + u.get("cost", 0)
+    with SessionLocal() as db:
+        return _cost_trend(db, days)
+
+def _cost_trend(db: Session, days: int) -> List[Dict[str, Any]]:
+    start = date.today() - timedelta(days=days)
+    daily_costs = dict(
+        db.query(UsageRecord.date, func.sum(UsageRecord.cost))
+        .filter(UsageRecord.date >= start.isoformat())
+        .group_by(UsageRecord.date)
+        .all()
+    )
     
     # Fill in missing days
     result = []
-    start = date.today() - timedelta(days=days)
     for i in range(days + 1):
         d = (start + timedelta(days=i)).isoformat()
         result.append({
             "date": d,
-            "cost": round(daily_costs.get(d, 0), 4)
+            "cost": round(daily_costs.get(d) or 0, 4)
         })
     
     return result
@@ -261,8 +366,13 @@ def get_usage_summary() -> Dict[str, Any]:
     cost_settings = settings.get("cost_management", {})
     monthly_limit = cost_settings.get("monthly_budget_limit", 100.0)
     
-    monthly_cost = get_monthly_cost()
-    daily_cost = get_daily_cost()
+    # One session for every query below instead of one per getter
+    with SessionLocal() as db:
+        today = date.today()
+        monthly_cost = _current_month_cost(today.year, today.month)
+        daily_cost = _daily_cost(db, today)
+        model_breakdown = _cost_breakdown(db, 30)
+        cost_trend = _cost_trend(db, 7)
     
     return {
         "daily_cost": daily_cost,
@@ -270,8 +380,8 @@ def get_usage_summary() -> Dict[str, Any]:
         "monthly_limit": monthly_limit,
         "budget_used_percent": round(monthly_cost / monthly_limit * 100, 1) if monthly_limit > 0 else 0,
         "budget_remaining": round(monthly_limit - monthly_cost, 4),
-        "model_breakdown": get_cost_breakdown_by_model(30),
-        "cost_trend": get_cost_trend(7),
+        "model_breakdown": model_breakdown,
+        "cost_trend": cost_trend,
         "free_models_available": len(get_free_models()),
         "current_model": settings.get("model", "unknown")
     }
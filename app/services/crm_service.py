@@ -3,59 +3,178 @@ CRM Service for Enterprise Bot
 Provides OAuth2 authentication and CRM operations
 Supports multiple CRM providers: HubSpot, Salesforce, Zoho (extensible)
 """
+import asyncio
 import httpx
-import json
-from datetime import datetime, timedelta
+import orjson
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
 from typing import Optional, Dict, Any, List
 from urllib.parse import urlencode
 
+CREDENTIALS_FILE = "data/crm_credentials.json"
+
+CRM_HTTP_TIMEOUT_SECONDS = 30.0
+
+# Refresh this long before expiry, so requests never go out with a token that
+# expires in flight
+REFRESH_SKEW_SECONDS = 300
+
+# Contact lookups repeat within a chat session, so found contacts are kept briefly
+CONTACT_CACHE_SIZE = 512
+CONTACT_CACHE_TTL_SECONDS = 300
+
+CRM_HTTP_METHODS = frozenset({"GET", "POST", "PATCH"})
+
+# Conversation notes are sent by a background worker; failed sends are retried
+# with exponential backoff before being logged and dropped
+NOTE_QUEUE_MAX_SIZE = 1000
+NOTE_SEND_ATTEMPTS = 3
+NOTE_RETRY_BACKOFF_SECONDS = 1.0
+# Shutdown waits at most this long for queued notes; whatever is left is logged and dropped
+NOTE_DRAIN_TIMEOUT_SECONDS = 10.0
+
 # CRM Provider configurations
 CRM_PROVIDERS = {
     "hubspot": {
         "auth_url": "https://app.hubspot.com/oauth/authorize",
         "token_url": "https://api.hubapi.com/oauth/v1/token",
         "api_base": "https://api.hubapi.com",
-        "scopes": ["crm.objects.contacts.read", "crm.objects.contacts.write"]
+        "scopes": ["crm.objects.contacts.read", "crm.objects.contacts.write"],
+        "auth_params": {"optional_scope": ""}
     },
     "salesforce": {
         "auth_url": "https://login.salesforce.com/services/oauth2/authorize",
         "token_url": "https://login.salesforce.com/services/oauth2/token",
         "api_base": "",  # Dynamic per instance
-        "scopes": ["api", "refresh_token"]
+        "scopes": ["api", "refresh_token"],
+        "auth_params": {"prompt": "consent"}
     },
     "zoho": {
         "auth_url": "https://accounts.zoho.com/oauth/v2/auth",
         "token_url": "https://accounts.zoho.com/oauth/v2/token",
         "api_base": "https://www.zohoapis.com/crm/v2",
-        "scopes": ["ZohoCRM.modules.contacts.READ", "ZohoCRM.modules.contacts.WRITE"]
+        "scopes": ["ZohoCRM.modules.contacts.READ", "ZohoCRM.modules.contacts.WRITE"],
+        "auth_params": {"access_type": "offline"}
     }
 }
 
+class HubSpotHandler:
+    """Endpoints and payloads for HubSpot's CRM v3 API; each returns (endpoint, payload)"""
+    
+    def lookup_contact(self, email: str = None, phone: str = None):
+        if email:
+            return f"/crm/v3/objects/contacts/{email}?idProperty=email", None
+        return None  # No phone search
+    
+    def create_contact(self, data: dict):
+        return "/crm/v3/objects/contacts", {
+            "properties": {
+                "email": data.get("email"),
+                "firstname": data.get("first_name", ""),
+                "lastname": data.get("last_name", ""),
+                "phone": data.get("phone", "")
+            }
+        }
+    
+    def update_contact(self, contact_id: str, data: dict):
+        return f"/crm/v3/objects/contacts/{contact_id}", {"properties": data}
+    
+    def log_conversation(self, contact_id: str, session_id: str, summary: str):
+        # Logged as a note associated with the contact
+        return "/crm/v3/objects/notes", {
+            "properties": {
+                "hs_note_body": f"Chatbot Conversation (Session: {session_id[:8]}...)\n\n{summary}",
+                "hs_timestamp": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+            },
+            "associations": [
+                {
+                    "to": {"id": contact_id},
+                    "types": [{"associationCategory": "HUBSPOT_DEFINED", "associationTypeId": 10}]
+                }
+            ]
+        }
+
+# Contact operations per provider; providers missing here can authenticate but not sync yet
+PROVIDER_HANDLERS = {
+    "hubspot": HubSpotHandler()
+}
+
 class CRMService:
     def __init__(self):
         self.provider = None
         self.access_token = None
         self.refresh_token = None
-        self.expires_at = None
+        self.expires_at = None  # Also sets _expires_monotonic
+        self._client: Optional[httpx.AsyncClient] = None
+        self._headers = (None, {})  # (access token, headers) for _auth_headers
+        self._refresh_lock = asyncio.Lock()
+        # (provider, email or phone) -> (fetched_at, contact), oldest first
+        self._contact_cache: OrderedDict = OrderedDict()
+        # Note queue and its worker, bound to the event loop that first queued a note
+        self._note_queue: Optional[asyncio.Queue] = None
+        self._note_worker: Optional[asyncio.Task] = None
+        self._note_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._note_sending: Optional[tuple] = None  # (contact_id, session_id) being sent
         self._load_credentials()
     
+    @property
+    def expires_at(self) -> Optional[datetime]:
+        """Token expiry as an aware UTC datetime, for storage and display"""
+        return self._expires_at
+    
+    @expires_at.setter
+    def expires_at(self, value: Optional[datetime]):
+        # Expiry checks run before every request, so they compare this monotonic
+        # deadline instead of building a datetime (and ignore wall-clock jumps)
+        self._expires_at = value
+        if value is None:
+            self._expires_monotonic = None
+        else:
+            self._expires_monotonic = time.monotonic() + (value - datetime.now(timezone.utc)).total_seconds()
+    
+    async def _get_client(self) -> httpx.AsyncClient:
+        """Shared client, so CRM calls reuse keep-alive connections instead of a TLS handshake each"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                http2=True,
+                limits=httpx.Limits(max_keepalive_connections=10, max_connections=20),
+                timeout=httpx.Timeout(CRM_HTTP_TIMEOUT_SECONDS)
+            )
+        return self._client
+    
+    async def aclose(self):
+        """
+        Sends queued notes (for up to NOTE_DRAIN_TIMEOUT_SECONDS), then closes the
+        shared HTTP client (called on application shutdown).
+        """
+        if self._note_queue is not None and self._note_loop is asyncio.get_running_loop():
+            await self._drain_notes()
+        client, self._client = self._client, None
+        if client is not None:
+            await client.aclose()
+    
     def _load_credentials(self):
         """Load CRM credentials from storage"""
         try:
-            with open("data/crm_credentials.json", "r") as f:
-                creds = json.load(f)
+            with open(CREDENTIALS_FILE, "rb") as f:
+                creds = orjson.loads(f.read())
                 self.provider = creds.get("provider")
                 self.access_token = creds.get("access_token")
                 self.refresh_token = creds.get("refresh_token")
                 if creds.get("expires_at"):
-                    self.expires_at = datetime.fromisoformat(creds["expires_at"])
-        except (FileNotFoundError, json.JSONDecodeError):
+                    expires_at = datetime.fromisoformat(creds["expires_at"])
+                    if expires_at.tzinfo is None:
+                        # Saved by an older version as naive UTC
+                        expires_at = expires_at.replace(tzinfo=timezone.utc)
+                    self.expires_at = expires_at
+        except (FileNotFoundError, orjson.JSONDecodeError):
             pass
     
     def _save_credentials(self):
         """Save CRM credentials to storage"""
-        import os
-        os.makedirs("data", exist_ok=True)
+        os.makedirs(os.path.dirname(CREDENTIALS_FILE), exist_ok=True)
         
         creds = {
             "provider": self.provider,
@@ -63,15 +182,20 @@ class CRMService:
             "refresh_token": self.refresh_token,
             "expires_at": self.expires_at.isoformat() if self.expires_at else None
         }
-        with open("data/crm_credentials.json", "w") as f:
-            json.dump(creds, f)
+        # Write to a temp file and swap it in so a crash never leaves a partial file
+        tmp_path = f"{CREDENTIALS_FILE}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(orjson.dumps(creds))
+        os.replace(tmp_path, CREDENTIALS_FILE)
+    
+    def _crm_config(self) -> dict:
+        """OAuth app settings; load_settings serves them from memory until settings.json changes"""
+        from app.services.settings_service import load_settings
+        return load_settings().get("crm", {})
     
     def get_auth_url(self, provider: str = "hubspot") -> str:
         """Generate OAuth2 authorization URL"""
-        from app.services.settings_service import load_settings
-        settings = load_settings()
-        
-        crm_config = settings.get("crm", {})
+        crm_config = self._crm_config()
         client_id = crm_config.get("client_id", "")
         redirect_uri = crm_config.get("redirect_uri", "http://localhost:8000/api/crm/callback")
         
@@ -91,22 +215,14 @@ class CRMService:
         }
         
         # Provider-specific params
-        if provider == "hubspot":
-            params["optional_scope"] = ""
-        elif provider == "salesforce":
-            params["prompt"] = "consent"
-        elif provider == "zoho":
-            params["access_type"] = "offline"
+        params.update(config["auth_params"])
         
         self.provider = provider
         return f"{config['auth_url']}?{urlencode(params)}"
     
     async def exchange_code(self, code: str, provider: str = None) -> dict:
         """Exchange authorization code for access tokens"""
-        from app.services.settings_service import load_settings
-        settings = load_settings()
-        
-        crm_config = settings.get("crm", {})
+        crm_config = self._crm_config()
         client_id = crm_config.get("client_id", "")
         client_secret = crm_config.get("client_secret", "")
         redirect_uri = crm_config.get("redirect_uri", "http://localhost:8000/api/crm/callback")
@@ -122,42 +238,39 @@ class CRMService:
             "code": code
         }
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                config["token_url"],
-                data=data,
-                headers={"Content-Type": "application/x-www-form-urlencoded"}
-            )
-            
-            if response.status_code != 200:
-                raise Exception(f"Token exchange failed: {response.text}")
-            
-            tokens = response.json()
-            
-            self.access_token = tokens.get("access_token")
-            self.refresh_token = tokens.get("refresh_token")
-            
-            expires_in = tokens.get("expires_in", 3600)
-            self.expires_at = datetime.utcnow() + timedelta(seconds=expires_in)
-            self.provider = provider
-            
-            self._save_credentials()
-            
-            return {
-                "success": True,
-                "provider": provider,
-                "expires_at": self.expires_at.isoformat()
-            }
+        client = await self._get_client()
+        response = await client.post(
+            config["token_url"],
+            data=data,
+            headers={"Content-Type": "application/x-www-form-urlencoded"}
+        )
+        
+        if response.status_code != 200:
+            raise Exception(f"Token exchange failed: {response.text}")
+        
+        tokens = orjson.loads(response.content)
+        
+        self.access_token = tokens.get("access_token")
+        self.refresh_token = tokens.get("refresh_token")
+        
+        expires_in = tokens.get("expires_in", 3600)
+        self.expires_at = datetime.now(timezone.utc) + timedelta(seconds=expires_in)
+        self.provider = provider
+        
+        self._save_credentials()
+        
+        return {
+            "success": True,
+            "provider": provider,
+            "expires_at": self.expires_at.isoformat()
+        }
     
     async def refresh_access_token(self) -> bool:
         """Refresh expired access token"""
         if not self.refresh_token or not self.provider:
             return False
         
-        from app.services.settings_service import load_settings
-        settings = load_settings()
-        
-        crm_config = settings.get("crm", {})
+        crm_config = self._crm_config()
         client_id = crm_config.get("client_id", "")
         client_secret = crm_config.get("client_secret", "")
         
@@ -170,32 +283,48 @@ class CRMService:
             "refresh_token": self.refresh_token
         }
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(config["token_url"], data=data)
-            
-            if response.status_code != 200:
-                return False
-            
-            tokens = response.json()
-            self.access_token = tokens.get("access_token")
-            
-            if tokens.get("refresh_token"):
-                self.refresh_token = tokens["refresh_token"]
-            
-            expires_in = tokens.get("expires_in", 3600)
-            self.expires_at = datetime.utcnow() + timedelta(seconds=expires_in)
-            
-            self._save_credentials()
-            return True
+        client = await self._get_client()
+        response = await client.post(config["token_url"], data=data)
+        
+        if response.status_code != 200:
+            return False
+        
+        tokens = orjson.loads(response.content)
+        self.access_token = tokens.get("access_token")
+        
+        if tokens.get("refresh_token"):
+            self.refresh_token = tokens["refresh_token"]
+        
+        expires_in = tokens.get("expires_in", 3600)
+        self.expires_at = datetime.now(timezone.utc) + timedelta(seconds=expires_in)
+        
+        self._save_credentials()
+        return True
     
     async def _ensure_valid_token(self):
         """Ensure we have a valid access token"""
         if not self.access_token:
             raise Exception("CRM not connected. Please authenticate first.")
         
-        if self.expires_at and datetime.utcnow() >= self.expires_at:
-            if not await self.refresh_access_token():
-                raise Exception("CRM token expired and refresh failed. Please re-authenticate.")
+        if self._token_expiring():
+            # One refresh at a time; requests that waited re-check and reuse its token
+            async with self._refresh_lock:
+                if self._token_expiring() and not await self.refresh_access_token():
+                    # A failed early refresh is fine while the current token still works
+                    if time.monotonic() >= self._expires_monotonic:
+                        raise Exception("CRM token expired and refresh failed. Please re-authenticate.")
+    
+    def _token_expiring(self) -> bool:
+        return self._expires_monotonic is not None and time.monotonic() >= self._expires_monotonic - REFRESH_SKEW_SECONDS
+    
+    def _auth_headers(self) -> dict:
+        """Request headers for the current token, rebuilt only when the token changes"""
+        if self._headers[0] != self.access_token:
+            self._headers = (self.access_token, {
+                "Authorization": f"Bearer {self.access_token}",
+                "Content-Type": "application/json"
+            })
+        return self._headers[1]
     
     async def _make_request(self, method: str, endpoint: str, data: dict = None) -> dict:
         """Make authenticated request to CRM API"""
@@ -204,83 +333,141 @@ class CRMService:
         config = CRM_PROVIDERS[self.provider]
         url = f"{config['api_base']}{endpoint}"
         
-        headers = {
-            "Authorization": f"Bearer {self.access_token}",
-            "Content-Type": "application/json"
-        }
+        if method not in CRM_HTTP_METHODS:
+            raise ValueError(f"Unsupported method: {method}")
+        
+        client = await self._get_client()
+        response = await client.request(method, url, headers=self._auth_headers(), json=data)
         
-        async with httpx.AsyncClient() as client:
-            if method == "GET":
-                response = await client.get(url, headers=headers)
-            elif method == "POST":
-                response = await client.post(url, headers=headers, json=data)
-            elif method == "PATCH":
-                response = await client.patch(url, headers=headers, json=data)
-            else:
-                raise ValueError(f"Unsupported method: {method}")
-            
-            if response.status_code >= 400:
-                raise Exception(f"CRM API error: {response.text}")
-            
-            return response.json() if response.text else {}
+        if response.status_code >= 400:
+            raise Exception(f"CRM API error: {response.text}")
+        
+        # Parse the raw bytes; response.text would decode the whole body to str first
+        return orjson.loads(response.content) if response.content else {}
     
     async def lookup_contact(self, email: str = None, phone: str = None) -> Optional[dict]:
         """Search for a contact by email or phone"""
-        if self.provider == "hubspot":
-            if email:
-                try:
-                    result = await self._make_request(
-                        "GET", 
-                        f"/crm/v3/objects/contacts/{email}?idProperty=email"
-                    )
-                    return result
-                except:
-                    return None
-        
-        return None
+        key = (self.provider, email or phone)
+        cached = self._contact_cache.get(key)
+        if cached is not None:
+            if time.monotonic() - cached[0] < CONTACT_CACHE_TTL_SECONDS:
+                self._contact_cache.move_to_end(key)
+                return cached[1]
+            del self._contact_cache[key]
+        
+        handler = PROVIDER_HANDLERS.get(self.provider)
+        request = handler.lookup_contact(email, phone) if handler else None
+        if request is None:
+            return None
+        try:
+            result = await self._make_request("GET", request[0])
+        except:
+            return None
+        
+        if result is not None:
+            self._contact_cache[key] = (time.monotonic(), result)
+            if len(self._contact_cache) > CONTACT_CACHE_SIZE:
+                self._contact_cache.popitem(last=False)
+        return result
+    
+    def invalidate_contact(self, contact_id: str = None, email: str = None):
+        """Drop cached lookups for a contact (by CRM id and/or the email it was looked up by)"""
+        stale = [
+            key for key, (_, contact) in self._contact_cache.items()
+            if key[1] == email or (contact_id is not None and str(contact.get("id")) == str(contact_id))
+        ]
+        for key in stale:
+            del self._contact_cache[key]
+    
+    def _handler(self, operation: str):
+        handler = PROVIDER_HANDLERS.get(self.provider)
+        if handler is None:
+            raise NotImplementedError(f"{operation} not implemented for {self.provider}")
+        return handler
     
     async def create_contact(self, data: dict) -> dict:
         """Create a new contact in CRM"""
-        if self.provider == "hubspot":
-            payload = {
-                "properties": {
-                    "email": data.get("email"),
-                    "firstname": data.get("first_name", ""),
-                    "lastname": data.get("last_name", ""),
-                    "phone": data.get("phone", "")
-                }
-            }
-            return await self._make_request("POST", "/crm/v3/objects/contacts", payload)
-        
-        raise NotImplementedError(f"create_contact not implemented for {self.provider}")
+        endpoint, payload = self._handler("create_contact").create_contact(data)
+        return await self._make_request("POST", endpoint, payload)
     
     async def update_contact(self, contact_id: str, data: dict) -> dict:
         """Update an existing contact"""
-        if self.provider == "hubspot":
-            payload = {"properties": data}
-            return await self._make_request("PATCH", f"/crm/v3/objects/contacts/{contact_id}", payload)
-        
-        raise NotImplementedError(f"update_contact not implemented for {self.provider}")
+        endpoint, payload = self._handler("update_contact").update_contact(contact_id, data)
+        result = await self._make_request("PATCH", endpoint, payload)
+        self.invalidate_contact(contact_id, data.get("email"))
+        return result
     
     async def log_conversation(self, contact_id: str, session_id: str, summary: str):
         """Log a conversation/engagement to the contact"""
-        if self.provider == "hubspot":
-            # Create a note
-            payload = {
-                "properties": {
-                    "hs_note_body": f"Chatbot Conversation (Session: {session_id[:8]}...)\n\n{summary}",
-                    "hs_timestamp": datetime.utcnow().isoformat() + "Z"
-                },
-                "associations": [
-                    {
-                        "to": {"id": contact_id},
-                        "types": [{"associationCategory": "HUBSPOT_DEFINED", "associationTypeId": 10}]
-                    }
-                ]
-            }
-            return await self._make_request("POST", "/crm/v3/objects/notes", payload)
+        endpoint, payload = self._handler("log_conversation").log_conversation(contact_id, session_id, summary)
+        return await self._make_request("POST", endpoint, payload)
+    
+    async def queue_conversation_log(self, contact_id: str, session_id: str, summary: str):
+        """Queue log_conversation for the background worker; waits only if the queue is full"""
+        self._handler("log_conversation")  # Unsupported providers fail now, not in the worker
+        loop = asyncio.get_running_loop()
+        if self._note_loop is not loop:
+            self._note_queue = asyncio.Queue(maxsize=NOTE_QUEUE_MAX_SIZE)
+            self._note_worker = None
+            self._note_loop = loop
+        if self._note_worker is None or self._note_worker.done():
+            self._note_worker = loop.create_task(self._send_notes())
+        await self._note_queue.put((contact_id, session_id, summary))
+    
+    async def _drain_notes(self):
+        """Wait for the note worker to empty the queue, then stop it; notes still pending at the deadline are dropped"""
+        queue, worker = self._note_queue, self._note_worker
+        try:
+            await asyncio.wait_for(queue.join(), timeout=NOTE_DRAIN_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            pass
         
-        raise NotImplementedError(f"log_conversation not implemented for {self.provider}")
+        # Read before cancelling: the worker clears it on the way out
+        dropped = [self._note_sending] if self._note_sending else []
+        if worker is not None:
+            worker.cancel()
+            try:
+                await worker
+            except asyncio.CancelledError:
+                pass
+        
+        while not queue.empty():
+            contact_id, session_id, _ = queue.get_nowait()
+            dropped.append((contact_id, session_id))
+        self._note_queue = self._note_worker = self._note_loop = self._note_sending = None
+        
+        if dropped:
+            from app.services import logging_service
+            logging_service.log_error(
+                error_type="crm_notes_dropped",
+                message=f"{len(dropped)} conversation note(s) not sent within {NOTE_DRAIN_TIMEOUT_SECONDS}s of shutdown",
+                context={"notes": [{"contact_id": c, "session_id": s} for c, s in dropped]}
+            )
+    
+    async def _send_notes(self):
+        """Send queued notes one at a time"""
+        while True:
+            contact_id, session_id, summary = await self._note_queue.get()
+            self._note_sending = (contact_id, session_id)
+            try:
+                for attempt in range(NOTE_SEND_ATTEMPTS):
+                    try:
+                        await self.log_conversation(contact_id, session_id, summary)
+                        break
+                    except Exception as e:
+                        if attempt + 1 < NOTE_SEND_ATTEMPTS:
+                            await asyncio.sleep(NOTE_RETRY_BACKOFF_SECONDS * 2 ** attempt)
+                            continue
+                        from app.services import logging_service
+                        logging_service.log_error(
+                            error_type="crm_note_error",
+                            message=str(e),
+                            context={"contact_id": contact_id, "session_id": session_id},
+                            exc=e
+                        )
+            finally:
+                self._note_sending = None
+                self._note_queue.task_done()
     
     def is_connected(self) -> bool:
         """Check if CRM is connected"""
@@ -292,7 +479,7 @@ class CRMService:
             "connected": self.is_connected(),
             "provider": self.provider,
             "expires_at": self.expires_at.isoformat() if self.expires_at else None,
-            "expired": self.expires_at and datetime.utcnow() >= self.expires_at if self.expires_at else False
+            "expired": self._expires_monotonic is not None and time.monotonic() >= self._expires_monotonic
         }
     
     def disconnect(self):
@@ -301,10 +488,10 @@ class CRMService:
         self.access_token = None
         self.refresh_token = None
         self.expires_at = None
+        self._contact_cache.clear()
         
-        import os
         try:
-            os.remove("data/crm_credentials.json")
+            os.remove(CREDENTIALS_FILE)
         except FileNotFoundError:
             pass
 
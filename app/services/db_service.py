@@ -5,9 +5,21 @@ Centralized data access layer with validation and error handling
 from typing import Optional, List, Dict, Any
 from datetime import datetime, timedelta
 from sqlalchemy.orm import Session as DBSession
-from sqlalchemy import text
+from sqlalchemy import DateTime, bindparam, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from app.database import SessionLocal, Session, Message, KnowledgeDoc, User
 
+# Every dashboard counter in one round trip (today's counts use the timestamp indexes)
+STATS_SQL = text(
+    "SELECT "
+    "(SELECT COUNT(*) FROM sessions) AS total_sessions, "
+    "(SELECT COUNT(*) FROM messages) AS total_messages, "
+    "(SELECT COUNT(*) FROM knowledge_docs) AS total_kb_docs, "
+    "(SELECT COUNT(*) FROM users) AS total_users, "
+    "(SELECT COUNT(*) FROM messages WHERE timestamp >= :today) AS messages_today, "
+    "(SELECT COUNT(*) FROM sessions WHERE created_at >= :today) AS sessions_today"
+).bindparams(bindparam("today", type_=DateTime))
+
 class DatabaseService:
     """Centralized database operations with error handling"""
     
@@ -100,12 +112,12 @@ class DatabaseService:
         """Save a new message"""
         db = self.get_session()
         
-        # Ensure session exists
-        session = db.query(Session).filter(Session.id == session_id).first()
-        if not session:
-            session = Session(id=session_id, name="New Chat")
-            db.add(session)
-            db.commit()
+        # Ensure session exists without a lookup; same transaction as the message
+        db.execute(
+            sqlite_insert(Session)
+            .values(id=session_id, name="New Chat")
+            .on_conflict_do_nothing(index_elements=["id"])
+        )
         
         message = Message(
             session_id=session_id,
@@ -193,19 +205,9 @@ class DatabaseService:
     def get_stats(self) -> Dict[str, Any]:
         """Get database statistics"""
         db = self.get_session()
-        
-        return {
-            "total_sessions": db.query(Session).count(),
-            "total_messages": db.query(Message).count(),
-            "total_kb_docs": db.query(KnowledgeDoc).count(),
-            "total_users": db.query(User).count(),
-            "messages_today": db.query(Message).filter(
-                Message.timestamp >= datetime.utcnow().replace(hour=0, minute=0, second=0)
-            ).count(),
-            "sessions_today": db.query(Session).filter(
-                Session.created_at >= datetime.utcnow().replace(hour=0, minute=0, second=0)
-            ).count()
-        }
+        today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        row = db.execute(STATS_SQL, {"today": today}).one()
+        return dict(row._mapping)
     
     # Health Check
     def health_check(self) -> bool:
@@ -217,15 +219,13 @@ class DatabaseService:
         except Exception:
             return False
 
-# Singleton instance for convenience
-_db_service: Optional[DatabaseService] = None
-
-def get_db_service() -> DatabaseService:
-    """Get the database service instance"""
-    global _db_service
-    if _db_service is None:
-        _db_service = DatabaseService()
-    return _db_service
+def get_db_service():
+    """FastAPI dependency: a database service scoped to one request"""
+    service = DatabaseService()
+    try:
+        yield service
+    finally:
+        service.close()
 
 def with_db_session(func):
     """Decorator to provide database session"""
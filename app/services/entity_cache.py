@@ -0,0 +1,32 @@
+"""
+Entity Cache for the causal services
+Memoizes per-text entity extraction so recurring RAG chunks skip the spaCy pipeline
+"""
+from collections import OrderedDict
+from typing import Any, Callable, List
+
+# RAG chunks recur across queries (same corpus), so extracted entities are memoized per text
+ENTITY_CACHE_SIZE = 4096
+
+class EntityCache:
+    """LRU of text -> entities; cache misses are batched through a single nlp.pipe call"""
+    
+    def __init__(self, doc_to_entities: Callable[[Any], List[str]], max_size: int = ENTITY_CACHE_SIZE):
+        self.doc_to_entities = doc_to_entities
+        self.max_size = max_size
+        self.entries: "OrderedDict[str, List[str]]" = OrderedDict()
+    
+    def extract_batch(self, nlp, texts: List[str]) -> List[List[str]]:
+        """Entities for each text, in order"""
+        entries = self.entries
+        results = [entries.get(text) for text in texts]
+        missing = list(dict.fromkeys(text for text, ents in zip(texts, results) if ents is None))
+        if missing:
+            for text, doc in zip(missing, nlp.pipe(missing, batch_size=64)):
+                entries[text] = self.doc_to_entities(doc)
+            results = [entries[text] for text in texts]
+        for text in texts:
+            entries.move_to_end(text)
+        while len(entries) > self.max_size:
+            entries.popitem(last=False)
+        return results
@@ -3,32 +3,80 @@ Feedback Service for Enterprise Bot
 Handles user feedback collection, storage, and analysis
 """
 import json
-import os
+import orjson
 from datetime import datetime, timedelta
 from typing import List, Dict, Any, Optional
+from sqlalchemy import case, func
+from app.database import SessionLocal, Feedback
 
-FEEDBACK_FILE = "data/feedback.json"
+# Earlier file stores, newest format first: JSON lines, then a single JSON array
+LEGACY_FEEDBACK_FILES = ("data/feedback.jsonl", "data/feedback.json")
 
-def _load_feedback() -> List[dict]:
-    """Load feedback from storage"""
+# Empty category counts as general, as it always has
+_CATEGORY = func.coalesce(func.nullif(Feedback.category, ""), "general")
+
+def _to_dict(f: Feedback) -> dict:
+    return {
+        "id": f.id,
+        "session_id": f.session_id,
+        "message_id": f.message_id,
+        "rating": f.rating,
+        "category": f.category,
+        "comment": f.comment,
+        "created_at": f.created_at.isoformat()
+    }
+
+def _read_legacy(path: str) -> List[dict]:
+    """Records from an old feedback file, either JSON lines or a JSON array"""
     try:
-        with open(FEEDBACK_FILE, "r") as f:
+        with open(path, "rb") as f:
+            if path.endswith(".jsonl"):
+                records = []
+                for line in f:
+                    try:
+                        records.append(orjson.loads(line))
+                    except orjson.JSONDecodeError:
+                        continue  # Blank or partial line left by an interrupted write
+                return records
             return json.load(f)
     except (FileNotFoundError, json.JSONDecodeError):
         return []
 
-def _save_feedback(feedback: List[dict]):
-    """Save feedback to storage"""
-    os.makedirs("data", exist_ok=True)
-    with open(FEEDBACK_FILE, "w") as f:
-        json.dump(feedback, f, indent=2)
-
-def _get_next_id() -> int:
-    """Get next feedback ID"""
-    feedback = _load_feedback()
-    if not feedback:
-        return 1
-    return max(f["id"] for f in feedback) + 1
+def import_legacy_feedback(paths=LEGACY_FEEDBACK_FILES) -> int:
+    """
+    One-off migration of the old feedback files into the feedback table.
+    Only runs while the table is empty; returns the number of rows imported.
+    """
+    for path in paths:
+        legacy = _read_legacy(path)
+        if legacy:
+            break
+    else:
+        return 0
+    
+    db = SessionLocal()
+    try:
+        if db.query(Feedback.id).first() is not None:
+            return 0
+        
+        # Ids are kept, so links to existing feedback stay valid and new ids continue after them
+        records = [
+            Feedback(
+                id=f.get("id"),
+                session_id=f.get("session_id"),
+                message_id=f.get("message_id"),
+                rating=f["rating"],
+                category=f.get("category"),
+                comment=f.get("comment"),
+                created_at=datetime.fromisoformat(f["created_at"])
+            )
+            for f in legacy if f.get("rating") and f.get("created_at")
+        ]
+        db.add_all(records)
+        db.commit()
+        return len(records)
+    finally:
+        db.close()
 
 def submit_feedback(
     session_id: str,
@@ -53,19 +101,18 @@ def submit_feedback(
     if not 1 <= rating <= 5:
         raise ValueError("Rating must be between 1 and 5")
     
-    feedback_record = {
-        "id": _get_next_id(),
-        "session_id": session_id,
-        "message_id": message_id,
-        "rating": rating,
-        "category": category,
-        "comment": comment,
-        "created_at": datetime.utcnow().isoformat()
-    }
-    
-    feedback = _load_feedback()
-    feedback.append(feedback_record)
-    _save_feedback(feedback)
+    with SessionLocal() as db:
+        feedback = Feedback(
+            session_id=session_id,
+            message_id=message_id,
+            rating=rating,
+            category=category,
+            comment=comment,
+            created_at=datetime.utcnow()
+        )
+        db.add(feedback)
+        db.commit()
+        feedback_record = _to_dict(feedback)
     
     # Log the feedback
     from app.services import logging_service, metrics_service
@@ -76,16 +123,21 @@ def submit_feedback(
 
 def get_session_feedback(session_id: str) -> List[dict]:
     """Get all feedback for a specific session"""
-    feedback = _load_feedback()
-    return [f for f in feedback if f["session_id"] == session_id]
+    with SessionLocal() as db:
+        rows = db.query(Feedback).filter(Feedback.session_id == session_id).order_by(Feedback.id).all()
+        return [_to_dict(f) for f in rows]
 
 def get_feedback_by_id(feedback_id: int) -> Optional[dict]:
     """Get specific feedback by ID"""
-    feedback = _load_feedback()
-    for f in feedback:
-        if f["id"] == feedback_id:
-            return f
-    return None
+    with SessionLocal() as db:
+        feedback = db.get(Feedback, feedback_id)
+        return _to_dict(feedback) if feedback else None
+
+def _since(query, days: Optional[int]):
+    """Restrict a query to the last `days` days (no restriction if days is falsy)"""
+    if not days:
+        return query
+    return query.filter(Feedback.created_at >= datetime.utcnow() - timedelta(days=days))
 
 def get_average_rating(days: int = None) -> float:
     """
@@ -94,35 +146,28 @@ def get_average_rating(days: int = None) -> float:
     Args:
         days: Optional number of days to look back. None = all time.
     """
-    feedback = _load_feedback()
-    
-    if days:
-        cutoff = (datetime.utcnow() - timedelta(days=days)).isoformat()
-        feedback = [f for f in feedback if f["created_at"] >= cutoff]
+    with SessionLocal() as db:
+        avg = _since(db.query(func.avg(Feedback.rating)), days).scalar()
     
-    if not feedback:
+    if avg is None:
         return 0.0
     
-    total_rating = sum(f["rating"] for f in feedback)
-    return round(total_rating / len(feedback), 2)
+    return round(avg, 2)
+
+def _rating_distribution(db, days: Optional[int]) -> Dict[int, int]:
+    distribution = {1: 0, 2: 0, 3: 0, 4: 0, 5: 0}
+    query = db.query(Feedback.rating, func.count(Feedback.id)).group_by(Feedback.rating)
+    for rating, count in _since(query, days):
+        distribution[rating] = count
+    return distribution
 
 def get_rating_distribution(days: int = None) -> Dict[int, int]:
     """
     Get distribution of ratings.
     Returns dict like {1: 5, 2: 10, 3: 25, 4: 40, 5: 20}
     """
-    feedback = _load_feedback()
-    
-    if days:
-        cutoff = (datetime.utcnow() - timedelta(days=days)).isoformat()
-        feedback = [f for f in feedback if f["created_at"] >= cutoff]
-    
-    distribution = {1: 0, 2: 0, 3: 0, 4: 0, 5: 0}
-    for f in feedback:
-        rating = f.get("rating", 3)
-        distribution[rating] = distribution.get(rating, 0) + 1
-    
-    return distribution
+    with SessionLocal() as db:
+        return _rating_distribution(db, days)
 
 def get_feedback_trends(interval: str = "daily", days: int = 30) -> List[Dict[str, Any]]:
     """
@@ -132,57 +177,29 @@ def get_feedback_trends(interval: str = "daily", days: int = 30) -> List[Dict[st
         interval: "daily", "weekly", or "monthly"
         days: Number of days to look back
     """
-    feedback = _load_feedback()
-    cutoff = (datetime.utcnow() - timedelta(days=days)).isoformat()
-    feedback = [f for f in feedback if f["created_at"] >= cutoff]
-    
-    # Group by date
-    daily_data = {}
-    for f in feedback:
-        date = f["created_at"][:10]  # YYYY-MM-DD
-        if date not in daily_data:
-            daily_data[date] = {"ratings": [], "count": 0}
-        daily_data[date]["ratings"].append(f["rating"])
-        daily_data[date]["count"] += 1
-    
-    # Calculate averages
-    result = []
-    for date in sorted(daily_data.keys()):
-        data = daily_data[date]
-        result.append({
-            "date": date,
-            "count": data["count"],
-            "avg_rating": round(sum(data["ratings"]) / len(data["ratings"]), 2)
-        })
-    
-    return result
+    day = func.date(Feedback.created_at)
+    with SessionLocal() as db:
+        query = db.query(day, func.count(Feedback.id), func.avg(Feedback.rating)).group_by(day).order_by(day)
+        rows = _since(query, days).all()
+    
+    return [
+        {"date": date, "count": count, "avg_rating": round(avg, 2)}
+        for date, count, avg in rows
+    ]
+
+def _category_breakdown(db, days: Optional[int]) -> Dict[str, Dict[str, Any]]:
+    query = db.query(_CATEGORY, func.count(Feedback.id), func.avg(Feedback.rating)).group_by(_CATEGORY)
+    return {
+        cat: {"count": count, "avg_rating": round(avg, 2)}
+        for cat, count, avg in _since(query, days)
+    }
 
 def get_category_breakdown(days: int = None) -> Dict[str, Dict[str, Any]]:
     """
     Get feedback breakdown by category.
     """
-    feedback = _load_feedback()
-    
-    if days:
-        cutoff = (datetime.utcnow() - timedelta(days=days)).isoformat()
-        feedback = [f for f in feedback if f["created_at"] >= cutoff]
-    
-    categories = {}
-    for f in feedback:
-        cat = f.get("category") or "general"
-        if cat not in categories:
-            categories[cat] = {"ratings": [], "count": 0}
-        categories[cat]["ratings"].append(f["rating"])
-        categories[cat]["count"] += 1
-    
-    result = {}
-    for cat, data in categories.items():
-        result[cat] = {
-            "count": data["count"],
-            "avg_rating": round(sum(data["ratings"]) / len(data["ratings"]), 2) if data["ratings"] else 0
-        }
-    
-    return result
+    with SessionLocal() as db:
+        return _category_breakdown(db, days)
 
 def get_low_rating_sessions(threshold: int = 2, limit: int = 20) -> List[Dict[str, Any]]:
     """
@@ -193,84 +210,91 @@ def get_low_rating_sessions(threshold: int = 2, limit: int = 20) -> List[Dict[st
         threshold: Rating threshold (return sessions with avg rating <= this)
         limit: Maximum number of sessions to return
     """
-    feedback = _load_feedback()
-    
-    # Group by session
-    session_ratings = {}
-    for f in feedback:
-        sid = f["session_id"]
-        if sid not in session_ratings:
-            session_ratings[sid] = {"ratings": [], "comments": [], "last_feedback": f["created_at"]}
-        session_ratings[sid]["ratings"].append(f["rating"])
-        if f.get("comment"):
-            session_ratings[sid]["comments"].append(f["comment"])
-        if f["created_at"] > session_ratings[sid]["last_feedback"]:
-            session_ratings[sid]["last_feedback"] = f["created_at"]
-    
-    # Filter low ratings
-    low_rated = []
-    for sid, data in session_ratings.items():
-        avg = sum(data["ratings"]) / len(data["ratings"])
-        if avg <= threshold:
-            low_rated.append({
-                "session_id": sid,
-                "avg_rating": round(avg, 2),
-                "feedback_count": len(data["ratings"]),
-                "comments": data["comments"],
-                "last_feedback": data["last_feedback"]
-            })
-    
-    # Sort by avg rating (lowest first)
-    low_rated.sort(key=lambda x: x["avg_rating"])
-    
-    return low_rated[:limit]
+    avg = func.avg(Feedback.rating)
+    with SessionLocal() as db:
+        # Lowest average first; ties keep the order sessions first left feedback
+        sessions = (
+            db.query(Feedback.session_id, avg, func.count(Feedback.id), func.max(Feedback.created_at))
+            .group_by(Feedback.session_id)
+            .having(avg <= threshold)
+            .order_by(avg, func.min(Feedback.id))
+            .limit(limit)
+            .all()
+        )
+        
+        comments = {sid: [] for sid, *_ in sessions}
+        if comments:
+            rows = (
+                db.query(Feedback.session_id, Feedback.comment)
+                .filter(Feedback.session_id.in_(comments), Feedback.comment.isnot(None), Feedback.comment != "")
+                .order_by(Feedback.id)
+            )
+            for sid, comment in rows:
+                comments[sid].append(comment)
+    
+    return [
+        {
+            "session_id": sid,
+            "avg_rating": round(session_avg, 2),
+            "feedback_count": count,
+            "comments": comments[sid],
+            "last_feedback": last.isoformat()
+        }
+        for sid, session_avg, count, last in sessions
+    ]
 
 def get_recent_comments(limit: int = 20, min_rating: int = None, max_rating: int = None) -> List[dict]:
     """
     Get recent feedback with comments.
     Useful for understanding user sentiment.
     """
-    feedback = _load_feedback()
-    
-    # Filter to only those with comments
-    with_comments = [f for f in feedback if f.get("comment")]
-    
-    # Apply rating filters
-    if min_rating is not None:
-        with_comments = [f for f in with_comments if f["rating"] >= min_rating]
-    if max_rating is not None:
-        with_comments = [f for f in with_comments if f["rating"] <= max_rating]
-    
-    # Sort by date (newest first) and limit
-    with_comments.sort(key=lambda x: x["created_at"], reverse=True)
-    
-    return with_comments[:limit]
+    with SessionLocal() as db:
+        query = db.query(Feedback).filter(Feedback.comment.isnot(None), Feedback.comment != "")
+        if min_rating is not None:
+            query = query.filter(Feedback.rating >= min_rating)
+        if max_rating is not None:
+            query = query.filter(Feedback.rating <= max_rating)
+        
+        # Newest first
+        rows = query.order_by(Feedback.created_at.desc(), Feedback.id.desc()).limit(limit).all()
+        return [_to_dict(f) for f in rows]
 
 def get_feedback_summary() -> Dict[str, Any]:
     """Get comprehensive feedback summary for dashboard"""
-    feedback = _load_feedback()
-    
-    if not feedback:
-        return {
-            "total_feedback": 0,
-            "avg_rating": 0,
-            "rating_distribution": {1: 0, 2: 0, 3: 0, 4: 0, 5: 0},
-            "category_breakdown": {},
-            "satisfaction_rate": 0,
-            "recent_trend": "neutral"
-        }
+    recent = Feedback.created_at >= datetime.utcnow() - timedelta(days=7)
+    with SessionLocal() as db:
+        hist = _rating_distribution(db, None)
+        total = sum(hist.values())
+        
+        if not total:
+            return {
+                "total_feedback": 0,
+                "avg_rating": 0,
+                "rating_distribution": {1: 0, 2: 0, 3: 0, 4: 0, 5: 0},
+                "category_breakdown": {},
+                "satisfaction_rate": 0,
+                "recent_trend": "neutral"
+            }
+        
+        recent_n, recent_sum = db.query(
+            func.count(case((recent, 1))),
+            func.coalesce(func.sum(case((recent, Feedback.rating))), 0)
+        ).one()
+        categories = _category_breakdown(db, None)
+    
+    rating_sum = sum(rating * n for rating, n in hist.items())
     
     # Calculate satisfaction rate (4 or 5 stars)
-    satisfied = sum(1 for f in feedback if f["rating"] >= 4)
-    satisfaction_rate = round(satisfied / len(feedback) * 100, 1)
+    satisfied = sum(n for rating, n in hist.items() if rating >= 4)
+    satisfaction_rate = round(satisfied / total * 100, 1)
     
     # Determine recent trend
-    recent = [f for f in feedback if f["created_at"] >= (datetime.utcnow() - timedelta(days=7)).isoformat()]
-    older = [f for f in feedback if f["created_at"] < (datetime.utcnow() - timedelta(days=7)).isoformat()]
+    older_n = total - recent_n
+    older_sum = rating_sum - recent_sum
     
-    if recent and older:
-        recent_avg = sum(f["rating"] for f in recent) / len(recent)
-        older_avg = sum(f["rating"] for f in older) / len(older)
+    if recent_n and older_n:
+        recent_avg = recent_sum / recent_n
+        older_avg = older_sum / older_n
         if recent_avg > older_avg + 0.2:
             trend = "improving"
         elif recent_avg < older_avg - 0.2:
@@ -281,12 +305,12 @@ def get_feedback_summary() -> Dict[str, Any]:
         trend = "insufficient_data"
     
     return {
-        "total_feedback": len(feedback),
-        "avg_rating": get_average_rating(),
-        "rating_distribution": get_rating_distribution(),
-        "category_breakdown": get_category_breakdown(),
+        "total_feedback": total,
+        "avg_rating": round(rating_sum / total, 2),
+        "rating_distribution": hist,
+        "category_breakdown": categories,
         "satisfaction_rate": satisfaction_rate,
         "recent_trend": trend,
-        "feedback_last_7_days": len(recent),
-        "low_rating_count": sum(1 for f in feedback if f["rating"] <= 2)
+        "feedback_last_7_days": recent_n,
+        "low_rating_count": sum(n for rating, n in hist.items() if rating <= 2)
     }
@@ -0,0 +1,100 @@
+"""
+Graph Reachability for the causal services
+Precomputes which nodes can reach which, so causal path checks need no graph search
+"""
+import sys
+import numpy as np
+import networkx as nx
+from typing import Dict, FrozenSet, Hashable, Iterable, List
+
+def node_id(name: str) -> str:
+    """
+    Canonical graph node id: lowercased and interned. Entity strings and the
+    reachability tables then share one object per id, so dict lookups match
+    on identity before comparing characters.
+    """
+    return sys.intern(name.lower())
+
+class Reachability:
+    """
+    Transitive closure of a directed graph, computed once over its condensation
+    (strongly connected components collapse to single nodes, leaving a DAG).
+    has_path(a, b) is then two dict lookups and a set membership test instead
+    of a BFS per call.
+
+    The closure is also kept as bit matrices, one row of uint64 words per
+    component (bit j of row i set when i reaches j, and the reverse), so
+    checks over whole entity lists run as numpy ops rather than pair loops.
+    """
+    
+    def __init__(self, graph: nx.DiGraph):
+        condensed = nx.condensation(graph)
+        self.component: Dict[Hashable, int] = {  # node -> SCC id
+            sys.intern(node) if isinstance(node, str) else node: comp
+            for node, comp in condensed.graph["mapping"].items()
+        }
+        self.size = condensed.number_of_nodes()
+        # Walk the DAG sinks-first so every successor's closure is already known
+        self.reach: Dict[int, FrozenSet[int]] = {}
+        for comp in reversed(list(nx.topological_sort(condensed))):
+            reachable = {comp}
+            for succ in condensed.successors(comp):
+                reachable |= self.reach[succ]
+            self.reach[comp] = frozenset(reachable)
+        
+        words = (self.size + 63) // 64
+        self.forward = np.zeros((self.size, words), dtype=np.uint64)
+        self.backward = np.zeros((self.size, words), dtype=np.uint64)
+        for comp, reachable in self.reach.items():
+            targets = np.fromiter(reachable, dtype=np.int64, count=len(reachable))
+            self._set_bits(self.forward[comp], targets)
+            # comp reaches each target, so each target's backward row gets comp
+            self.backward[targets, comp >> 6] |= np.uint64(1) << np.uint64(comp & 63)
+    
+    @staticmethod
+    def _set_bits(row: np.ndarray, ids: np.ndarray):
+        np.bitwise_or.at(row, ids >> 6, np.left_shift(np.uint64(1), (ids & 63).astype(np.uint64)))
+    
+    def has_path(self, source: Hashable, target: Hashable) -> bool:
+        """Same answer as nx.has_path for nodes in the graph; False if either node is missing"""
+        src = self.component.get(source)
+        dst = self.component.get(target)
+        if src is None or dst is None:
+            return False
+        return dst in self.reach[src]
+    
+    def index(self, nodes: Iterable[Hashable]) -> np.ndarray:
+        """Component id per node; nodes missing from the graph map to self.size"""
+        get = self.component.get
+        missing = self.size
+        return np.fromiter((get(n, missing) for n in nodes), dtype=np.int32)
+    
+    def _bitmap(self, ids: np.ndarray) -> np.ndarray:
+        row = np.zeros(self.forward.shape[1], dtype=np.uint64)
+        self._set_bits(row, ids[ids < self.size].astype(np.int64))
+        return row
+    
+    def any_path(self, a_nodes: List[Hashable], b_nodes: List[Hashable]) -> bool:
+        """True if some node of a_nodes has a path to or from some node of b_nodes"""
+        a_ids = self.index(a_nodes)
+        a_ids = a_ids[a_ids < self.size]
+        if not a_ids.size:
+            return False
+        b_bits = self._bitmap(self.index(b_nodes))
+        return bool((self.forward[a_ids] & b_bits).any() or (self.backward[a_ids] & b_bits).any())
+    
+    def path_counts(self, sources: List[Hashable]) -> np.ndarray:
+        """
+        For each component, how many of sources have a path to or from it.
+        The array has one extra trailing zero so index() results can be used
+        directly, with missing nodes counting nothing.
+        """
+        counts = np.zeros(self.size + 1, dtype=np.int64)
+        ids = self.index(sources)
+        ids = ids[ids < self.size]
+        if ids.size:
+            rows = self.forward[ids] | self.backward[ids]
+            cols = np.arange(self.size)
+            bits = (rows[:, cols >> 6] >> (cols & 63).astype(np.uint64)) & np.uint64(1)
+            counts[:self.size] = bits.sum(axis=0)
+        return counts
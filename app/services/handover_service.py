@@ -2,6 +2,7 @@
 Handover Service for Enterprise Bot
 Manages escalation detection, handover queue, and notifications
 """
+import functools
 import re
 import smtplib
 from email.mime.text import MIMEText
@@ -10,7 +11,15 @@ from datetime import datetime
 from typing import Tuple, List, Dict, Any, Optional
 import httpx
 import json
-from app.database import SessionLocal
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import SessionLocal, Handover, Message
+
+# Stored sort key per priority (urgent first)
+PRIORITY_RANK = {"urgent": 0, "high": 1, "normal": 2}
+
+# Pre-database handover store, read once by import_legacy_handovers()
+LEGACY_HANDOVERS_FILE = "data/handovers.json"
 
 # Escalation keywords with priority weights
 ESCALATION_KEYWORDS = {
@@ -41,36 +50,58 @@ NEGATIVE_INDICATORS = [
     "unacceptable", "pathetic", "incompetent"
 ]
 
-def analyze_sentiment(message: str) -> float:
+# Positive sentiment indicators
+POSITIVE_INDICATORS = ["thanks", "great", "helpful", "appreciate", "good", "excellent"]
+
+# Priority as an int level for comparisons (index into PRIORITY_NAMES)
+PRIORITY_LEVEL = {"normal": 1, "high": 2, "urgent": 3}
+PRIORITY_NAMES = ("", "normal", "high", "urgent")
+
+# (keyword, priority level), in ESCALATION_KEYWORDS order
+_ESCALATION_LEVELS = tuple((keyword, PRIORITY_LEVEL[priority]) for keyword, (priority, _) in ESCALATION_KEYWORDS.items())
+
+# Every phrase either check looks for, so a message is scanned once for both
+_SCAN_TERMS = tuple(dict.fromkeys([*ESCALATION_KEYWORDS, *NEGATIVE_INDICATORS, *POSITIVE_INDICATORS]))
+
+@functools.lru_cache(maxsize=256)
+def _scan(message_lower: str) -> frozenset:
     """
-    Basic sentiment analysis.
-    Returns score from -1 (negative) to 1 (positive).
+    Phrases present in a lowercased message.
+    Memoized so detect_escalation_need and analyze_sentiment on the same
+    message share one scan.
     """
-    if not message:
-        return 0.0
-    
-    message_lower = message.lower()
+    return frozenset(term for term in _SCAN_TERMS if term in message_lower)
+
+def _sentiment(hits: frozenset) -> float:
     score = 0.0
     
     # Check negative indicators
     for indicator in NEGATIVE_INDICATORS:
-        if indicator in message_lower:
+        if indicator in hits:
             score -= 0.3
     
-    # Check escalation keywords
-    for keyword, (priority, weight) in ESCALATION_KEYWORDS.items():
-        if keyword in message_lower:
-            if priority in ["urgent", "high"]:
-                score -= 0.2
+    # Check escalation keywords (high and urgent only)
+    for keyword, level in _ESCALATION_LEVELS:
+        if level >= 2 and keyword in hits:
+            score -= 0.2
     
     # Check positive indicators
-    positive_words = ["thanks", "great", "helpful", "appreciate", "good", "excellent"]
-    for word in positive_words:
-        if word in message_lower:
+    for word in POSITIVE_INDICATORS:
+        if word in hits:
             score += 0.2
     
     return max(-1.0, min(1.0, score))
 
+def analyze_sentiment(message: str) -> float:
+    """
+    Basic sentiment analysis.
+    Returns score from -1 (negative) to 1 (positive).
+    """
+    if not message:
+        return 0.0
+    
+    return _sentiment(_scan(message.lower()))
+
 def detect_escalation_need(
     message: str, 
     session_history: List[str] = None
@@ -87,24 +118,23 @@ def detect_escalation_need(
     if not message:
         return False, "", "normal"
     
-    message_lower = message.lower()
+    hits = _scan(message.lower())
     reasons = []
-    max_priority = "normal"
-    priority_order = {"normal": 1, "high": 2, "urgent": 3}
+    max_level = 1
     
     # Check for escalation keywords
-    for keyword, (priority, weight) in ESCALATION_KEYWORDS.items():
-        if keyword in message_lower:
+    for keyword, level in _ESCALATION_LEVELS:
+        if keyword in hits:
             reasons.append(f"keyword:{keyword}")
-            if priority_order.get(priority, 1) > priority_order.get(max_priority, 1):
-                max_priority = priority
+            if level > max_level:
+                max_level = level
     
     # Check sentiment
-    sentiment = analyze_sentiment(message)
+    sentiment = _sentiment(hits)
     if sentiment < -0.5:
         reasons.append("negative_sentiment")
-        if max_priority == "normal":
-            max_priority = "high"
+        if max_level == 1:
+            max_level = 2
     
     # Check session history for patterns
     if session_history and len(session_history) > 4:
@@ -115,13 +145,13 @@ def detect_escalation_need(
         ))
         if similarity_count >= 2:
             reasons.append("repeated_issues")
-            if max_priority == "normal":
-                max_priority = "high"
+            if max_level == 1:
+                max_level = 2
     
     needs_handover = len(reasons) > 0
     reason = ", ".join(reasons) if reasons else ""
     
-    return needs_handover, reason, max_priority
+    return needs_handover, reason, PRIORITY_NAMES[max_level]
 
 def create_handover(
     session_id: str, 
@@ -133,31 +163,19 @@ def create_handover(
     Create a handover record in the database.
     Returns the created handover data.
     """
-    from app.database import SessionLocal
-    
     db = SessionLocal()
     try:
-        # Check if Handover model exists, if not create record in a simple way
-        # For now, we'll store in a JSON file until DB migration
-        import os
-        os.makedirs("data", exist_ok=True)
-        
-        handover = {
-            "id": _get_next_handover_id(),
-            "session_id": session_id,
-            "reason": reason,
-            "priority": priority,
-            "status": "pending",
-            "assigned_to": None,
-            "created_at": datetime.utcnow().isoformat(),
-            "resolved_at": None,
-            "notes": notes
-        }
-        
-        # Append to handovers file
-        handovers = _load_handovers()
-        handovers.append(handover)
-        _save_handovers(handovers)
+        record = Handover(
+            session_id=session_id,
+            reason=reason,
+            priority=priority,
+            priority_rank=PRIORITY_RANK.get(priority, 2),
+            status="pending",
+            notes=notes
+        )
+        db.add(record)
+        db.commit()
+        handover = handover_to_dict(record)
         
         # Log the event
         from app.services import logging_service
@@ -172,80 +190,161 @@ def create_handover(
     finally:
         db.close()
 
-def _get_next_handover_id() -> int:
-    """Get next handover ID"""
-    handovers = _load_handovers()
-    if not handovers:
-        return 1
-    return max(h["id"] for h in handovers) + 1
+def handover_to_dict(h: Handover) -> dict:
+    """Serialize a Handover row to the API shape (ISO timestamps)"""
+    return {
+        "id": h.id,
+        "session_id": h.session_id,
+        "reason": h.reason,
+        "priority": h.priority,
+        "status": h.status,
+        "assigned_to": h.assigned_to,
+        "created_at": h.created_at.isoformat() if h.created_at else None,
+        "resolved_at": h.resolved_at.isoformat() if h.resolved_at else None,
+        "notes": h.notes
+    }
 
-def _load_handovers() -> List[dict]:
-    """Load handovers from JSON file"""
+def import_legacy_handovers(path: str = LEGACY_HANDOVERS_FILE) -> int:
+    """
+    One-off migration of the old JSON handover store into the handovers table.
+    Only runs while the table is empty; returns the number of rows imported.
+    """
     try:
-        with open("data/handovers.json", "r") as f:
-            return json.load(f)
+        with open(path, "r") as f:
+            legacy = json.load(f)
     except (FileNotFoundError, json.JSONDecodeError):
-        return []
+        return 0
+    
+    db = SessionLocal()
+    try:
+        if not legacy or db.query(Handover.id).first() is not None:
+            return 0
+        
+        def _parse(ts):
+            return datetime.fromisoformat(ts) if ts else None
+        
+        db.add_all([
+            Handover(
+                id=h["id"],
+                session_id=h.get("session_id"),
+                reason=h.get("reason"),
+                priority=h.get("priority", "normal"),
+                priority_rank=PRIORITY_RANK.get(h.get("priority", "normal"), 2),
+                status=h.get("status", "pending"),
+                assigned_to=h.get("assigned_to"),
+                created_at=_parse(h.get("created_at")) or datetime.utcnow(),
+                resolved_at=_parse(h.get("resolved_at")),
+                notes=h.get("notes")
+            )
+            for h in legacy
+        ])
+        db.commit()
+        return len(legacy)
+    finally:
+        db.close()
 
-def _save_handovers(handovers: List[dict]):
-    """Save handovers to JSON file"""
-    import os
-    os.makedirs("data", exist_ok=True)
-    with open("data/handovers.json", "w") as f:
-        json.dump(handovers, f, indent=2)
+async def list_handovers(
+    db: AsyncSession,
+    status: Optional[str] = None,
+    priority: Optional[str] = None,
+    limit: int = 50
+) -> Tuple[List[dict], int]:
+    """Handovers matching the filters, most urgent then oldest first, plus the total match count"""
+    filters = []
+    if status:
+        filters.append(Handover.status == status)
+    if priority:
+        filters.append(Handover.priority == priority)
+    
+    # Filter, sort and limit in SQL (served by ix_handover_status_rank_created)
+    result = await db.execute(
+        select(Handover).where(*filters).order_by(Handover.priority_rank, Handover.created_at).limit(limit)
+    )
+    total = await db.scalar(select(func.count(Handover.id)).where(*filters))
+    return [handover_to_dict(h) for h in result.scalars().all()], total
 
-def get_pending_handovers() -> List[dict]:
-    """Get all pending handovers"""
-    handovers = _load_handovers()
-    return [h for h in handovers if h["status"] == "pending"]
+async def get_pending_handovers(db: AsyncSession) -> List[dict]:
+    """Get all pending handovers, most urgent then oldest first"""
+    result = await db.execute(
+        select(Handover).where(Handover.status == "pending").order_by(Handover.priority_rank, Handover.created_at)
+    )
+    return [handover_to_dict(h) for h in result.scalars().all()]
 
 def get_handover(handover_id: int) -> Optional[dict]:
     """Get a specific handover by ID"""
-    handovers = _load_handovers()
-    for h in handovers:
-        if h["id"] == handover_id:
-            return h
-    return None
+    db = SessionLocal()
+    try:
+        h = db.get(Handover, handover_id)
+        return handover_to_dict(h) if h else None
+    finally:
+        db.close()
+
+async def get_handover_with_conversation(db: AsyncSession, handover_id: int, message_limit: int = 50) -> Optional[dict]:
+    """Get a handover plus its session's messages (oldest first) for context"""
+    h = await db.get(Handover, handover_id)
+    if not h:
+        return None
+    
+    result = await db.execute(
+        select(Message)
+        .where(Message.session_id == h.session_id)
+        .order_by(Message.timestamp)
+        .limit(message_limit)
+    )
+    return {
+        "handover": handover_to_dict(h),
+        "conversation": [
+            {"role": m.role, "content": m.content, "timestamp": m.timestamp.isoformat()}
+            for m in result.scalars().all()
+        ]
+    }
+
+def _update_handover(handover_id: int, **values) -> Optional[dict]:
+    """Single-statement UPDATE ... RETURNING; None if there is no such handover"""
+    db = SessionLocal()
+    try:
+        h = db.scalars(
+            update(Handover).where(Handover.id == handover_id).values(**values).returning(Handover)
+        ).one_or_none()
+        # Serialize before commit, which would expire the row and reload it
+        handover = handover_to_dict(h) if h else None
+        db.commit()
+        return handover
+    finally:
+        db.close()
 
 def assign_handover(handover_id: int, staff_email: str) -> Optional[dict]:
     """Assign a handover to a staff member"""
-    handovers = _load_handovers()
-    for h in handovers:
-        if h["id"] == handover_id:
-            h["status"] = "assigned"
-            h["assigned_to"] = staff_email
-            _save_handovers(handovers)
-            
-            from app.services import logging_service
-            logging_service.log_handover_event(
-                session_id=h["session_id"],
-                handover_id=handover_id,
-                action="assigned",
-                details={"assigned_to": staff_email}
-            )
-            return h
-    return None
+    handover = _update_handover(handover_id, status="assigned", assigned_to=staff_email)
+    if handover is None:
+        return None
+    
+    from app.services import logging_service
+    logging_service.log_handover_event(
+        session_id=handover["session_id"],
+        handover_id=handover_id,
+        action="assigned",
+        details={"assigned_to": staff_email}
+    )
+    return handover
 
 def resolve_handover(handover_id: int, notes: str = None) -> Optional[dict]:
     """Mark a handover as resolved"""
-    handovers = _load_handovers()
-    for h in handovers:
-        if h["id"] == handover_id:
-            h["status"] = "resolved"
-            h["resolved_at"] = datetime.utcnow().isoformat()
-            if notes:
-                h["notes"] = (h.get("notes") or "") + f"\nResolution: {notes}"
-            _save_handovers(handovers)
-            
-            from app.services import logging_service
-            logging_service.log_handover_event(
-                session_id=h["session_id"],
-                handover_id=handover_id,
-                action="resolved",
-                details={"notes": notes}
-            )
-            return h
-    return None
+    values = {"status": "resolved", "resolved_at": datetime.utcnow()}
+    if notes:
+        values["notes"] = func.coalesce(Handover.notes, "") + f"\nResolution: {notes}"
+    handover = _update_handover(handover_id, **values)
+    if handover is None:
+        return None
+    
+    from app.services import logging_service
+    logging_service.log_handover_event(
+        session_id=handover["session_id"],
+        handover_id=handover_id,
+        action="resolved",
+        details={"notes": notes}
+    )
+    return handover
 
 async def send_notification(handover: dict, channels: List[str] = None):
     """
@@ -364,9 +463,19 @@ async def send_webhook(handover: dict, url: str):
 
 def get_handover_stats() -> Dict[str, Any]:
     """Get handover statistics"""
-    handovers = _load_handovers()
+    # Hours from creation to resolution (NULL until resolved)
+    hours = (func.julianday(Handover.resolved_at) - func.julianday(Handover.created_at)) * 24
+    db = SessionLocal()
+    try:
+        # At most one row per (status, priority) pair, so the DB does the counting
+        rows = db.execute(
+            select(Handover.status, Handover.priority, func.count(Handover.id), func.sum(hours), func.count(hours))
+            .group_by(Handover.status, Handover.priority)
+        ).all()
+    finally:
+        db.close()
     
-    if not handovers:
+    if not rows:
         return {
             "total": 0,
             "pending": 0,
@@ -378,25 +487,19 @@ def get_handover_stats() -> Dict[str, Any]:
     
     status_counts = {"pending": 0, "assigned": 0, "resolved": 0}
     priority_counts = {"normal": 0, "high": 0, "urgent": 0}
-    resolution_times = []
+    resolution_hours = 0.0
+    resolved_count = 0
     
-    for h in handovers:
-        status_counts[h.get("status", "pending")] += 1
-        priority_counts[h.get("priority", "normal")] += 1
-        
-        if h.get("resolved_at") and h.get("created_at"):
-            try:
-                created = datetime.fromisoformat(h["created_at"])
-                resolved = datetime.fromisoformat(h["resolved_at"])
-                hours = (resolved - created).total_seconds() / 3600
-                resolution_times.append(hours)
-            except:
-                pass
+    for status, priority, count, hours_sum, hours_count in rows:
+        status_counts[status or "pending"] += count
+        priority_counts[priority or "normal"] += count
+        resolution_hours += hours_sum or 0.0
+        resolved_count += hours_count
     
-    avg_resolution = sum(resolution_times) / len(resolution_times) if resolution_times else 0
+    avg_resolution = resolution_hours / resolved_count if resolved_count else 0
     
     return {
-        "total": len(handovers),
+        "total": sum(status_counts.values()),
         "pending": status_counts["pending"],
         "assigned": status_counts["assigned"],
         "resolved": status_counts["resolved"],
@@ -1,6 +1,10 @@
 import chromadb
 from chromadb.utils import embedding_functions
+import functools
+import numpy as np
 import os
+from typing import Iterable, List, Tuple
+from app.services import cache_service
 
 # Initialize Chroma Client with persistence
 CHROMA_PATH = "data/chroma_db"
@@ -11,15 +15,87 @@ chroma_client = chromadb.PersistentClient(path=CHROMA_PATH)
 # Use a standard, fast local embedding model
 embedding_fn = embedding_functions.SentenceTransformerEmbeddingFunction(model_name="all-MiniLM-L6-v2")
 
+# HNSW index tuning for the collection. Cosine space so results come back ranked by
+# cosine similarity; only applied when the collection is created (see rebuild_index).
+COLLECTION_NAME = "enterprise_kb"
+HNSW_INDEX_METADATA = {
+    "hnsw:space": "cosine",
+    "hnsw:M": 16,
+    "hnsw:construction_ef": 64,
+    "hnsw:search_ef": 40,
+}
+
+# Repeated queries (FAQ-style questions) are answered from memory, skipping the
+# embedding forward pass and the index search
+QUERY_CACHE_SIZE = 1024
+
 # Get or create collection
 collection = chroma_client.get_or_create_collection(
-    name="enterprise_kb",
-    embedding_function=embedding_fn
+    name=COLLECTION_NAME,
+    embedding_function=embedding_fn,
+    metadata=HNSW_INDEX_METADATA
 )
 
-def add_document(doc_id: str, text: str, metadata: dict):
+def index_needs_rebuild() -> bool:
+    """True if the collection predates the cosine HNSW settings (Chroma never alters them in place)"""
+    current = collection.metadata or {}
+    return any(current.get(key) != value for key, value in HNSW_INDEX_METADATA.items())
+
+def rebuild_index(page_size: int = 5000) -> int:
     """
-    Split text into chunks and add to vector store.
+    Recreate the collection with HNSW_INDEX_METADATA, copying the stored
+    chunks and embeddings across (nothing is re-embedded). The copy is built
+    under a temporary name and only swapped in once complete.
+    Returns the number of chunks copied.
+    """
+    global collection
+    tmp_name = f"{COLLECTION_NAME}_rebuild"
+    try:
+        chroma_client.delete_collection(tmp_name)  # Leftover from an interrupted rebuild
+    except Exception:
+        pass
+    rebuilt = chroma_client.create_collection(
+        name=tmp_name,
+        embedding_function=embedding_fn,
+        metadata=HNSW_INDEX_METADATA
+    )
+    
+    copied = 0
+    while True:
+        page = collection.get(
+            include=["embeddings", "documents", "metadatas"],
+            limit=page_size,
+            offset=copied
+        )
+        if not page["ids"]:
+            break
+        rebuilt.add(
+            ids=page["ids"],
+            embeddings=page["embeddings"],
+            documents=page["documents"],
+            metadatas=page["metadatas"]
+        )
+        copied += len(page["ids"])
+    
+    chroma_client.delete_collection(COLLECTION_NAME)
+    rebuilt.modify(name=COLLECTION_NAME)
+    collection = rebuilt
+    return copied
+
+if index_needs_rebuild():
+    import logging
+    logging.getLogger(__name__).warning(
+        "Knowledge base collection uses old HNSW settings; run scripts/reindex_knowledge_base.py "
+        "to rebuild it in cosine space."
+    )
+
+# ChromaDB has a maximum batch size (usually 5461); stay safely below it
+CHROMA_ADD_BATCH_SIZE = 5000
+
+def _chunk_document(doc_id: str, text: str, metadata: dict):
+    """
+    Split text into overlapping chunks, preferring to break at newlines.
+    Returns (chunks, ids, metadatas).
     """
     # Improved chunking: try to split at newlines
     chunk_size = 1000
@@ -68,30 +144,65 @@ def add_document(doc_id: str, text: str, metadata: dict):
         start = next_start
         last_start = start
         
-    if chunks:
-        # ChromaDB has a maximum batch size (usually 5461)
-        # We use a safe batch size of 5000
-        batch_size_limit = 5000
-        for i in range(0, len(chunks), batch_size_limit):
-            batch_chunks = chunks[i:i + batch_size_limit]
-            batch_ids = ids[i:i + batch_size_limit]
-            batch_metadatas = metadatas[i:i + batch_size_limit]
-            
-            collection.add(
-                documents=batch_chunks,
-                ids=batch_ids,
-                metadatas=batch_metadatas
-            )
+    return chunks, ids, metadatas
 
-def query_knowledge(query_text: str, n_results: int = 5):
+def add_documents_bulk(items: Iterable[Tuple[str, str, dict]]):
     """
-    Search for relevant documents in vector store.
+    Chunk several (doc_id, text, metadata) documents and add them to the vector store
+    together. Chunks from all documents share each collection.add call, so the
+    embedding model runs over full batches instead of once per document.
     """
-    results = collection.query(
-        query_texts=[query_text],
-        n_results=n_results
-    )
+    chunks = []
+    ids = []
+    metadatas = []
+    for doc_id, text, metadata in items:
+        doc_chunks, doc_ids, doc_metadatas = _chunk_document(doc_id, text, metadata)
+        chunks.extend(doc_chunks)
+        ids.extend(doc_ids)
+        metadatas.extend(doc_metadatas)
+    
+    for i in range(0, len(chunks), CHROMA_ADD_BATCH_SIZE):
+        collection.add(
+            documents=chunks[i:i + CHROMA_ADD_BATCH_SIZE],
+            ids=ids[i:i + CHROMA_ADD_BATCH_SIZE],
+            metadatas=metadatas[i:i + CHROMA_ADD_BATCH_SIZE]
+        )
     
+    # Cached completions and search results were produced against the previous knowledge base
+    cache_service.completion_cache.clear()
+    _query.cache_clear()
+
+def add_document(doc_id: str, text: str, metadata: dict):
+    """
+    Split text into chunks and add to vector store.
+    """
+    add_documents_bulk([(doc_id, text, metadata)])
+
+def embed_batch(texts: List[str]) -> np.ndarray:
+    """
+    Embed several texts in one forward pass of the collection's embedding model.
+    Returns a contiguous (len(texts), dim) float32 array.
+    """
+    return np.ascontiguousarray(embedding_fn(texts), dtype=np.float32)
+
+def normalize_query(query_text: str) -> str:
+    """Cache key for a query: lowercased with whitespace collapsed (the embedding model is uncased)"""
+    return " ".join(query_text.lower().split())
+
+@functools.lru_cache(maxsize=QUERY_CACHE_SIZE)
+def _embed_normalized(query_norm: str) -> np.ndarray:
+    embedding = embed_batch([query_norm])[0]
+    embedding.flags.writeable = False  # Shared by every caller that hits the cache
+    return embedding
+
+def embed_query(query_text: str) -> np.ndarray:
+    """
+    Embed a query with the collection's embedding model.
+    The returned array is cached and read-only; copy it before modifying.
+    """
+    return _embed_normalized(normalize_query(query_text))
+
+def _format_results(results) -> str:
     # Return formatted context string
     context = ""
     if results['documents']:
@@ -100,18 +211,49 @@ def query_knowledge(query_text: str, n_results: int = 5):
                 context += f"{doc}\n---\n"
     return context
 
+@functools.lru_cache(maxsize=QUERY_CACHE_SIZE)
+def _query(query_norm: str, n_results: int) -> str:
+    results = collection.query(
+        query_embeddings=[_embed_normalized(query_norm).tolist()],
+        n_results=n_results
+    )
+    return _format_results(results)
+
+def query_knowledge(query_text: str, n_results: int = 5, query_embedding=None):
+    """
+    Search for relevant documents in vector store.
+    Results are cached per normalized query text and n_results until the next
+    add_document/delete_document. query_embedding is only used when there is no
+    query text; otherwise the embedding comes from the same cache as embed_query.
+    """
+    if query_text:
+        return _query(normalize_query(query_text), n_results)
+    
+    results = collection.query(
+        query_embeddings=[np.asarray(query_embedding).tolist()],
+        n_results=n_results
+    )
+    return _format_results(results)
+
 import asyncio
 from concurrent.futures import ThreadPoolExecutor
 
 # Create a thread pool for blocking operations
 executor = ThreadPoolExecutor(max_workers=3)
 
-async def query_knowledge_async(query_text: str, n_results: int = 5):
+async def query_knowledge_async(query_text: str, n_results: int = 5, query_embedding=None):
     """
     Search for relevant documents in vector store asynchronously.
     """
     loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(None, query_knowledge, query_text, n_results)
+    return await loop.run_in_executor(None, query_knowledge, query_text, n_results, query_embedding)
+
+async def embed_query_async(query_text: str):
+    """
+    Embed a query without blocking the event loop.
+    """
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, embed_query, query_text)
 
 def delete_document(doc_id: str):
     """
@@ -119,3 +261,5 @@ def delete_document(doc_id: str):
     """
     # Since IDs are prefixed with doc_id, we can filter by metadata
     collection.delete(where={"source_id": doc_id})
+    cache_service.completion_cache.clear()
+    _query.cache_clear()
@@ -2,13 +2,17 @@
 Centralized Logging Service for Enterprise Bot
 Provides structured logging with database and file handlers
 """
+import atexit
 import logging
-import json
 import os
+import queue
 import uuid
-from datetime import datetime
+import traceback
+import orjson
+from collections import deque
+from datetime import datetime, timezone
 from typing import Optional, Dict, Any
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
 # Create logs directory
 os.makedirs("logs", exist_ok=True)
@@ -17,7 +21,8 @@ os.makedirs("logs", exist_ok=True)
 class JSONFormatter(logging.Formatter):
     def format(self, record):
         log_entry = {
-            "timestamp": datetime.utcnow().isoformat(),
+            # When the record was made, not when the listener thread got to it (naive UTC)
+            "timestamp": datetime.fromtimestamp(record.created, timezone.utc).replace(tzinfo=None).isoformat(),
             "level": record.levelname,
             "logger": record.name,
             "message": record.getMessage(),
@@ -33,10 +38,24 @@ class JSONFormatter(logging.Formatter):
         if record.exc_info:
             log_entry["exception"] = self.formatException(record.exc_info)
             
-        return json.dumps(log_entry)
+        # Non-str keys (e.g. rating -> count maps) are stringified, as stdlib json did
+        return orjson.dumps(log_entry, option=orjson.OPT_NON_STR_KEYS).decode()
+
+class _LocalQueueHandler(QueueHandler):
+    """
+    Hands records to the listener thread as they are.
+    The queue never leaves the process, so the stock prepare() (which formats
+    the message on the caller's thread and drops exc_info) isn't needed.
+    """
+    def prepare(self, record):
+        return record
+
+# Writes queued records to the real handlers on its own thread
+_listener: Optional[QueueListener] = None
 
 # Setup main logger
 def setup_logger(name: str = "enterprise_bot", level: str = "INFO") -> logging.Logger:
+    global _listener
     logger = logging.getLogger(name)
     
     if logger.handlers:
@@ -51,7 +70,6 @@ def setup_logger(name: str = "enterprise_bot", level: str = "INFO") -> logging.L
         '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     )
     console_handler.setFormatter(console_format)
-    logger.addHandler(console_handler)
     
     # File handler with JSON format
     file_handler = RotatingFileHandler(
@@ -61,7 +79,6 @@ def setup_logger(name: str = "enterprise_bot", level: str = "INFO") -> logging.L
     )
     file_handler.setLevel(logging.DEBUG)
     file_handler.setFormatter(JSONFormatter())
-    logger.addHandler(file_handler)
     
     # Error file handler
     error_handler = RotatingFileHandler(
@@ -71,13 +88,35 @@ def setup_logger(name: str = "enterprise_bot", level: str = "INFO") -> logging.L
     )
     error_handler.setLevel(logging.ERROR)
     error_handler.setFormatter(JSONFormatter())
-    logger.addHandler(error_handler)
+    
+    # Callers only enqueue; formatting and file I/O happen on the listener thread
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(_LocalQueueHandler(log_queue))
+    _listener = QueueListener(log_queue, console_handler, file_handler, error_handler, respect_handler_level=True)
+    _listener.start()
+    # Registered after logging's own shutdown hook, so it runs first and drains the queue
+    atexit.register(stop_listener)
     
     return logger
 
+def stop_listener():
+    """Write out everything queued and stop the listener thread (safe to call twice)"""
+    global _listener
+    listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop()
+
 # Global logger instance
 logger = setup_logger()
 
+def _emit(level: int, message: str, data: Dict[str, Any]):
+    """
+    Hand a structured record to the handlers.
+    Built with makeRecord rather than logger.log, which would walk the stack
+    for caller info that these helpers don't use.
+    """
+    logger.handle(logger.makeRecord(logger.name, level, "", 0, message, (), None, extra={"extra_data": data}))
+
 def generate_request_id() -> str:
     """Generate unique request ID for tracking"""
     return str(uuid.uuid4())[:8]
@@ -91,6 +130,9 @@ def log_request(
     extra: Dict[str, Any] = None
 ):
     """Log incoming request"""
+    if not logger.isEnabledFor(logging.INFO):
+        return
+    
     data = {
         "request_id": request_id,
         "endpoint": endpoint,
@@ -102,12 +144,7 @@ def log_request(
     if extra:
         data.update(extra)
     
-    record = logger.makeRecord(
-        logger.name, logging.INFO, "", 0,
-        f"Request: {method} {endpoint}", (), None
-    )
-    record.extra_data = data
-    logger.handle(record)
+    _emit(logging.INFO, f"Request: {method} {endpoint}", data)
 
 def log_response(
     request_id: str,
@@ -116,6 +153,10 @@ def log_response(
     extra: Dict[str, Any] = None
 ):
     """Log outgoing response"""
+    level = logging.INFO if status_code < 400 else logging.WARNING
+    if not logger.isEnabledFor(level):
+        return
+    
     data = {
         "request_id": request_id,
         "status_code": status_code,
@@ -125,22 +166,24 @@ def log_response(
     if extra:
         data.update(extra)
     
-    level = logging.INFO if status_code < 400 else logging.WARNING
-    record = logger.makeRecord(
-        logger.name, level, "", 0,
-        f"Response: {status_code} in {response_time_ms:.2f}ms", (), None
-    )
-    record.extra_data = data
-    logger.handle(record)
+    _emit(level, f"Response: {status_code} in {response_time_ms:.2f}ms", data)
 
 def log_error(
     error_type: str,
     message: str,
     stack_trace: str = None,
     context: Dict[str, Any] = None,
-    request_id: str = None
+    request_id: str = None,
+    exc: BaseException = None
 ):
-    """Log error with context"""
+    """
+    Log error with context.
+    Pass `exc` instead of a pre-formatted `stack_trace` to have the traceback
+    formatted (once) only when error logging is enabled.
+    """
+    if not logger.isEnabledFor(logging.ERROR):
+        return
+    
     data = {
         "error_type": error_type,
         "category": "error",
@@ -148,15 +191,12 @@ def log_error(
     }
     if context:
         data.update(context)
+    if stack_trace is None and exc is not None:
+        stack_trace = "".join(traceback.format_exception(exc))
     if stack_trace:
         data["stack_trace"] = stack_trace
     
-    record = logger.makeRecord(
-        logger.name, logging.ERROR, "", 0,
-        f"Error [{error_type}]: {message}", (), None
-    )
-    record.extra_data = data
-    logger.handle(record)
+    _emit(logging.ERROR, f"Error [{error_type}]: {message}", data)
 
 def log_chat_interaction(
     session_id: str,
@@ -167,6 +207,9 @@ def log_chat_interaction(
     model: str = None
 ):
     """Log chat interaction for analytics"""
+    if not logger.isEnabledFor(logging.INFO):
+        return
+    
     data = {
         "session_id": session_id,
         "user_message_length": len(user_message),
@@ -177,12 +220,7 @@ def log_chat_interaction(
         "category": "chat"
     }
     
-    record = logger.makeRecord(
-        logger.name, logging.INFO, "", 0,
-        f"Chat: Session {session_id[:8]}... - {tokens_used} tokens", (), None
-    )
-    record.extra_data = data
-    logger.handle(record)
+    _emit(logging.INFO, f"Chat: Session {session_id[:8]}... - {tokens_used} tokens", data)
 
 def log_security_event(
     event_type: str,
@@ -190,6 +228,10 @@ def log_security_event(
     context: Dict[str, Any] = None
 ):
     """Log security-related events"""
+    level = logging.WARNING if severity != "critical" else logging.CRITICAL
+    if not logger.isEnabledFor(level):
+        return
+    
     data = {
         "event_type": event_type,
         "severity": severity,
@@ -198,13 +240,7 @@ def log_security_event(
     if context:
         data.update(context)
     
-    level = logging.WARNING if severity != "critical" else logging.CRITICAL
-    record = logger.makeRecord(
-        logger.name, level, "", 0,
-        f"Security Event [{event_type}]: {severity}", (), None
-    )
-    record.extra_data = data
-    logger.handle(record)
+    _emit(level, f"Security Event [{event_type}]: {severity}", data)
 
 def log_handover_event(
     session_id: str,
@@ -213,6 +249,9 @@ def log_handover_event(
     details: Dict[str, Any] = None
 ):
     """Log handover/escalation events"""
+    if not logger.isEnabledFor(logging.INFO):
+        return
+    
     data = {
         "session_id": session_id,
         "handover_id": handover_id,
@@ -222,12 +261,7 @@ def log_handover_event(
     if details:
         data.update(details)
     
-    record = logger.makeRecord(
-        logger.name, logging.INFO, "", 0,
-        f"Handover: {action} for session {session_id[:8]}...", (), None
-    )
-    record.extra_data = data
-    logger.handle(record)
+    _emit(logging.INFO, f"Handover: {action} for session {session_id[:8]}...", data)
 
 def log_metric(
     metric_name: str,
@@ -235,6 +269,9 @@ def log_metric(
     tags: Dict[str, str] = None
 ):
     """Log metrics for monitoring"""
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    
     data = {
         "metric_name": metric_name,
         "value": value,
@@ -242,12 +279,7 @@ def log_metric(
         "category": "metric"
     }
     
-    record = logger.makeRecord(
-        logger.name, logging.DEBUG, "", 0,
-        f"Metric: {metric_name}={value}", (), None
-    )
-    record.extra_data = data
-    logger.handle(record)
+    _emit(logging.DEBUG, f"Metric: {metric_name}={value}", data)
 
 def get_recent_logs(limit: int = 100, level: str = None, category: str = None) -> list:
     """
@@ -256,18 +288,20 @@ def get_recent_logs(limit: int = 100, level: str = None, category: str = None) -
     """
     logs = []
     try:
-        with open("logs/app.log", "r") as f:
-            lines = f.readlines()[-limit:]
-            for line in lines:
-                try:
-                    entry = json.loads(line.strip())
-                    if level and entry.get("level") != level:
-                        continue
-                    if category and entry.get("data", {}).get("category") != category:
-                        continue
-                    logs.append(entry)
-                except json.JSONDecodeError:
-                    continue
+        with open("logs/app.log", "rb") as f:
+            # Only the last `limit` lines are kept while reading
+            lines = deque(f, maxlen=limit)
     except FileNotFoundError:
-        pass
+        return logs
+    
+    for line in lines:
+        try:
+            entry = orjson.loads(line)
+        except orjson.JSONDecodeError:
+            continue
+        if level and entry.get("level") != level:
+            continue
+        if category and entry.get("data", {}).get("category") != category:
+            continue
+        logs.append(entry)
     return logs
@@ -1,8 +1,44 @@
+import asyncio
 import httpx
 from typing import List, Dict, Any
+from openai import AsyncOpenAI
 
 OPENROUTER_API_URL = "https://openrouter.ai/api/v1"
 
+# One long-lived chat client per API key so requests reuse pooled (HTTP/2) connections
+_clients: Dict[str, AsyncOpenAI] = {}
+
+def get_client(api_key: str) -> AsyncOpenAI:
+    """Returns the shared AsyncOpenAI client for the given OpenRouter key."""
+    client = _clients.get(api_key)
+    if client is None:
+        client = AsyncOpenAI(
+            base_url=OPENROUTER_API_URL,
+            api_key=api_key,
+            default_headers={
+                "HTTP-Referer": "http://localhost:8000",
+                "X-Title": "Enterprise AI Chatbot",
+            },
+            http_client=httpx.AsyncClient(
+                http2=True,
+                limits=httpx.Limits(max_keepalive_connections=50, max_connections=100)
+            )
+        )
+        _clients[api_key] = client
+    return client
+
+# Upper bound on concurrent completion streams to OpenRouter; excess requests
+# wait here instead of piling onto the upstream connection pool
+MAX_CONCURRENT_STREAMS = 50
+stream_semaphore = asyncio.Semaphore(MAX_CONCURRENT_STREAMS)
+
+async def close_clients():
+    """Closes all cached chat clients (called on application shutdown)."""
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        await client.close()
+
 async def fetch_available_models() -> Dict[str, List[Dict[str, Any]]]:
     """
     Fetches models from OpenRouter and groups them by Maker (Organization).
@@ -50,6 +50,11 @@ PROMPT_INJECTION_PATTERNS = [
     (r"```system|<\|system\|>|\[SYSTEM\]", 0.9),
 ]
 
+# Precompiled once at import so the per-request scan skips re's cache lookup
+# and the upper()/lower() copies of the message
+_SQL_INJECTION_REGEXES = [(p, re.compile(p, re.IGNORECASE)) for p in SQL_INJECTION_PATTERNS]
+_PROMPT_INJECTION_REGEXES = [(p, re.compile(p, re.IGNORECASE), c) for p, c in PROMPT_INJECTION_PATTERNS]
+
 # XSS patterns
 XSS_PATTERNS = [
     r"<script[^>]*>.*?</script>",
@@ -59,6 +64,7 @@ XSS_PATTERNS = [
     r"<object",
     r"<embed",
 ]
+_XSS_REGEXES = [re.compile(p, re.IGNORECASE) for p in XSS_PATTERNS]
 
 def sanitize_input(text: str) -> str:
     """
@@ -72,8 +78,8 @@ def sanitize_input(text: str) -> str:
     sanitized = html.escape(text)
     
     # Remove any remaining script-like patterns
-    for pattern in XSS_PATTERNS:
-        sanitized = re.sub(pattern, "", sanitized, flags=re.IGNORECASE)
+    for regex in _XSS_REGEXES:
+        sanitized = regex.sub("", sanitized)
     
     # Normalize whitespace
     sanitized = " ".join(sanitized.split())
@@ -88,12 +94,7 @@ def detect_sql_injection(text: str) -> Tuple[bool, List[str]]:
     if not text:
         return False, []
     
-    matched = []
-    text_upper = text.upper()
-    
-    for pattern in SQL_INJECTION_PATTERNS:
-        if re.search(pattern, text_upper, re.IGNORECASE):
-            matched.append(pattern)
+    matched = [pattern for pattern, regex in _SQL_INJECTION_REGEXES if regex.search(text)]
     
     return len(matched) > 0, matched
 
@@ -113,10 +114,9 @@ def detect_prompt_injection(text: str) -> Tuple[bool, float, List[str]]:
     
     matched = []
     max_confidence = 0.0
-    text_lower = text.lower()
     
-    for pattern, confidence in PROMPT_INJECTION_PATTERNS:
-        if re.search(pattern, text_lower, re.IGNORECASE):
+    for pattern, regex, confidence in _PROMPT_INJECTION_REGEXES:
+        if regex.search(text):
             matched.append(pattern)
             max_confidence = max(max_confidence, confidence)
     
@@ -131,13 +131,14 @@ def detect_prompt_injection(text: str) -> Tuple[bool, float, List[str]]:
 def validate_session_id(session_id: str) -> bool:
     """
     Validate session ID format to prevent injection.
-    Expected format: UUID (36 characters with hyphens)
+    Expected format: UUID, either 36 characters with hyphens or the
+    32-character hex form issued by the chat router
     """
     if not session_id:
         return False
     
     # UUID pattern
-    uuid_pattern = r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$"
+    uuid_pattern = r"^(?:[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}|[0-9a-f]{32})$"
     return bool(re.match(uuid_pattern, session_id.lower()))
 
 def validate_email(email: str) -> bool:
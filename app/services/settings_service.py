@@ -1,6 +1,8 @@
 import json
 import os
-from typing import Dict, Any
+import threading
+import time
+from typing import Dict, Any, Optional, Tuple
 
 SETTINGS_FILE = "settings.json"
 
@@ -17,34 +19,87 @@ DEFAULT_SETTINGS = {
     "crm_api_key": ""
 }
 
+# STATIC CORE IDENTITY (Regardless of Admin Settings)
+STATIC_IDENTITY = (
+    "Your name is 6thIntel. You are a research-focused AI specializing in Causal-Fractal RAG. "
+    "You provide academic-grade responses centered on data integrity and causal analysis. "
+    "You never mention that you are an AI assistant unless explicitly asked about your architecture. "
+    "Style: Professional, concise, and technical where appropriate. "
+    "Behavior: Address users directly. Use data and examples from the provided context to support claims. "
+    "If data is missing or out of scope, state that from a research perspective and suggest relevant inquiry types. "
+)
+
+# (mtime_ns, settings) of the last parsed settings file
+_cache: Optional[Tuple[int, Dict[str, Any]]] = None
+# Within this window the cached settings are served without even a stat()
+SETTINGS_TTL_SECONDS = 1.0
+_checked_at = 0.0
+# Bumped whenever the cached settings change, so callers can memoize derived values
+_version = 0
+# (settings version, prompt prefix) for get_system_prompt_prefix
+_prompt_prefix: Optional[Tuple[int, str]] = None
+# Serializes read-modify-write cycles in save_settings
+_write_lock = threading.Lock()
+
 def load_settings() -> Dict[str, Any]:
-    if not os.path.exists(SETTINGS_FILE):
+    global _cache, _checked_at, _version
+    now = time.monotonic()
+    if _cache and now - _checked_at < SETTINGS_TTL_SECONDS:
+        return _cache[1]
+    
+    try:
+        mtime_ns = os.stat(SETTINGS_FILE).st_mtime_ns
+    except FileNotFoundError:
         # Create file directly to avoid recursion via save_settings
         with open(SETTINGS_FILE, "w") as f:
             json.dump(DEFAULT_SETTINGS, f, indent=4)
         return DEFAULT_SETTINGS
     
+    # Serve from memory until the file changes on disk
+    _checked_at = now
+    if _cache and _cache[0] == mtime_ns:
+        return _cache[1]
+    
     try:
         with open(SETTINGS_FILE, "r") as f:
-            return json.load(f)
+            settings = json.load(f)
     except:
         return DEFAULT_SETTINGS
+    _cache = (mtime_ns, settings)
+    _version += 1
+    return settings
 
-def save_settings(settings: Dict[str, Any]):
-    # Read directly to avoid recursion if we used load_settings() here while it was also trying to save
-    current = {}
-    if os.path.exists(SETTINGS_FILE):
-        try:
-            with open(SETTINGS_FILE, "r") as f:
-                current = json.load(f)
-        except:
-            current = DEFAULT_SETTINGS.copy()
-    else:
-        current = DEFAULT_SETTINGS.copy()
+def save_settings(settings: Dict[str, Any]) -> Dict[str, Any]:
+    """Merge `settings` into the settings file and return the merged result"""
+    global _cache, _checked_at, _version
+    with _write_lock:
+        # Merge onto the cached copy (load_settings only re-reads if the file changed)
+        current = dict(load_settings())
+        current.update(settings)
         
-    current.update(settings)
-    with open(SETTINGS_FILE, "w") as f:
-        json.dump(current, f, indent=4)
+        # Write to a temp file and swap it in so readers never see a partial file
+        tmp_path = f"{SETTINGS_FILE}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(current, f, indent=4)
+        os.replace(tmp_path, SETTINGS_FILE)
+        _cache = (os.stat(SETTINGS_FILE).st_mtime_ns, current)
+        _checked_at = time.monotonic()
+        _version += 1
+    return current
+
+def get_settings_version() -> int:
+    """Counter that changes whenever load_settings() would return different settings"""
+    load_settings()
+    return _version
 
 def get_setting(key: str, default=None):
     return load_settings().get(key, default)
+
+def get_system_prompt_prefix() -> str:
+    """Static identity plus the admin-configured persona; rebuilt only when settings change"""
+    global _prompt_prefix
+    version = get_settings_version()
+    if _prompt_prefix is None or _prompt_prefix[0] != version:
+        persona = load_settings().get("system_persona") or ""
+        _prompt_prefix = (version, STATIC_IDENTITY + "\n\nAdditional Data:\n" + persona)
+    return _prompt_prefix[1]
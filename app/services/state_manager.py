@@ -83,22 +83,30 @@ class StateManager:
         Applied in the Renormalization Group step.
         """
         try:
-            # Re-open session in task
+            # Re-open session in task; don't hold a pooled connection across the LLM call
             db = SessionLocal()
-            node = db.query(Message).filter(Message.node_id == node_id).first()
-            if not node or not node.parent_id:
-                return
-                
-            parent = db.query(Message).filter(Message.node_id == node.parent_id).first()
+            try:
+                node = db.query(Message).filter(Message.node_id == node_id).first()
+                if not node or not node.parent_id:
+                    return
+                parent_id = node.parent_id
+                parent = db.query(Message).filter(Message.node_id == parent_id).first()
+                if not parent:
+                    return
+                prompt = f"Summarize the following interaction into a single concise state for long-term memory:\n\nParent: {parent.content}\n\nChild: {node.content}\n\nSummary:"
+            finally:
+                db.close()
             
             # Request summary from LLM
-            prompt = f"Summarize the following interaction into a single concise state for long-term memory:\n\nParent: {parent.content}\n\nChild: {node.content}\n\nSummary:"
             summary = await openrouter_service.generate_fast_summary(prompt) # To be implemented
             
-            node.summary = summary
-            db.commit()
-            db.close()
-            logger.info(f"Coarse-grained node {node_id} with parent {node.parent_id}")
+            db = SessionLocal()
+            try:
+                db.query(Message).filter(Message.node_id == node_id).update({"summary": summary})
+                db.commit()
+            finally:
+                db.close()
+            logger.info(f"Coarse-grained node {node_id} with parent {parent_id}")
         except Exception as e:
             logger.error(f"Coarse-graining failed: {e}")
 
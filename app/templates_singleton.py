@@ -0,0 +1,4 @@
+from fastapi.templating import Jinja2Templates
+
+# Shared across routers so there is a single Jinja2 Environment and compiled-template cache
+templates = Jinja2Templates(directory="app/templates")
@@ -8,6 +8,7 @@ from pathlib import Path
 from sqlalchemy.orm import Session
 from app.database import SessionLocal, KnowledgeDoc
 from app.services.causal_service import CausalService
+from app.services.graph_reachability import node_id
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -20,6 +21,8 @@ def build_graph():
     if not causal_service.nlp:
         logger.error("Spacy model not found. Run: python -m spacy download en_core_web_md")
         return
+    # The shared pipeline disables the parser for chunk verification; sentence splitting needs it
+    causal_service.nlp.enable_pipe("parser")
 
     db = SessionLocal()
     docs = db.query(KnowledgeDoc).all()
@@ -57,7 +60,7 @@ def build_graph():
                                 for e in effect_entities:
                                     if len(c) > 2 and len(e) > 2:
                                         logger.info(f"Adding causal link: {c} -> {e}")
-                                        causal_service.graph.add_edge(c.lower(), e.lower(), mechanism=verb, source_doc=doc.id)
+                                        causal_service.graph.add_edge(node_id(c), node_id(e), mechanism=verb, source_doc=doc.id)
 
     causal_service.save_graph()
     db.close()
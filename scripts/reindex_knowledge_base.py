@@ -0,0 +1,13 @@
+from app.services import knowledge_service
+
+def reindex():
+    if not knowledge_service.index_needs_rebuild():
+        print("Knowledge base collection already uses the current HNSW settings. Nothing to do.")
+        return
+
+    print(f"Rebuilding collection '{knowledge_service.COLLECTION_NAME}' with {knowledge_service.HNSW_INDEX_METADATA}...")
+    copied = knowledge_service.rebuild_index()
+    print(f"Rebuild complete: {copied} chunks copied.")
+
+if __name__ == "__main__":
+    reindex()
@@ -0,0 +1,69 @@
+"""
+Background Service Tests
+Verifies deferred jobs run in order, survive failures and are drained on shutdown.
+"""
+import asyncio
+import threading
+import pytest
+from app.services import background_service, logging_service
+
+@pytest.mark.asyncio
+async def test_jobs_run_in_order_off_the_loop():
+    ran = []
+    loop_thread = threading.get_ident()
+
+    def job(n, tag=None):
+        ran.append((n, tag, threading.get_ident() != loop_thread))
+
+    for n in range(5):
+        await background_service.submit(job, n, tag="x")
+    await background_service.shutdown()
+
+    assert ran == [(n, "x", True) for n in range(5)]
+    assert background_service.pending() == 0
+
+@pytest.mark.asyncio
+async def test_failing_job_is_logged_and_worker_continues(monkeypatch):
+    errors = []
+    monkeypatch.setattr(logging_service, "log_error", lambda **kw: errors.append(kw))
+    ran = []
+
+    def boom():
+        raise RuntimeError("disk full")
+
+    await background_service.submit(boom)
+    await background_service.submit(ran.append, "after")
+    await background_service.shutdown()
+
+    assert ran == ["after"]
+    assert errors[0]["error_type"] == "background_job_error"
+    assert errors[0]["context"] == {"job": "boom"}
+
+@pytest.mark.asyncio
+async def test_shutdown_waits_for_queued_jobs():
+    release = threading.Event()
+    ran = []
+    await background_service.submit(release.wait, 5)
+    await background_service.submit(ran.append, 1)
+    assert background_service.pending() >= 1
+
+    asyncio.get_running_loop().call_later(0.05, release.set)
+    await background_service.shutdown()
+    assert ran == [1]
+
+@pytest.mark.asyncio
+async def test_drain_finalize_tasks_waits_for_in_flight_saves():
+    from app.routers import chat
+    done = []
+
+    async def finalize():
+        await asyncio.sleep(0.05)
+        done.append(True)
+
+    task = asyncio.create_task(finalize())
+    chat._finalize_tasks.add(task)
+    task.add_done_callback(chat._finalize_tasks.discard)
+
+    await chat.drain_finalize_tasks()
+    assert done == [True]
+    assert not chat._finalize_tasks
@@ -0,0 +1,74 @@
+"""
+Completion Cache Tests
+Covers embedding-similarity matching, context isolation, TTL and LRU eviction.
+"""
+import numpy as np
+import pytest
+from app.services import cache_service
+from app.services.cache_service import CompletionCache, completion_context_key
+
+def vec(*components):
+    v = np.zeros(8, dtype=np.float32)
+    v[:len(components)] = components
+    return v
+
+@pytest.fixture
+def cache():
+    return CompletionCache(max_size=3, similarity_threshold=0.97, default_ttl=60)
+
+def test_near_identical_query_hits(cache):
+    cache.set(vec(1, 0), "ctx", "answer")
+    assert cache.get(vec(1, 0.01), "ctx") == "answer"
+    assert cache.get(vec(1, 1), "ctx") is None
+    assert cache.get_stats()["hits"] == 1
+
+def test_context_key_must_match(cache):
+    cache.set(vec(1, 0), "ctx-a", "answer")
+    assert cache.get(vec(1, 0), "ctx-b") is None
+
+def test_context_key_covers_temperature_and_history():
+    history = [{"role": "user", "content": "hi"}]
+    base = completion_context_key("m", "persona", 0.7, history)
+    assert base == completion_context_key("m", "persona", 0.7, list(history))
+    assert base != completion_context_key("m", "persona", 0.2, history)
+    assert base != completion_context_key("m", "persona", 0.7, [])
+    assert base != completion_context_key("other", "persona", 0.7, history)
+
+def test_expired_best_match_does_not_hide_fresh_runner_up(cache, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache_service.time, "time", lambda: now[0])
+    cache.set(vec(1, 0), "ctx", "stale")
+    now[0] += 50
+    cache.set(vec(1, 0.1), "ctx", "fresh")
+    now[0] += 20  # First entry is now past its TTL
+    assert cache.get(vec(1, 0), "ctx") == "fresh"
+    now[0] += 60
+    assert cache.get(vec(1, 0), "ctx") is None
+
+def test_lru_eviction_reuses_slots(cache):
+    for i, v in enumerate([vec(1), vec(0, 1), vec(0, 0, 1)]):
+        cache.set(v, "ctx", f"r{i}")
+    assert cache.get(vec(1), "ctx") == "r0"  # r0 becomes most recently used
+    cache.set(vec(0, 0, 0, 1), "ctx", "r3")  # Evicts r1
+    assert cache.get(vec(0, 1), "ctx") is None
+    assert cache.get(vec(1), "ctx") == "r0"
+    assert cache.get(vec(0, 0, 0, 1), "ctx") == "r3"
+    assert cache.get_stats()["size"] == 3
+
+def test_clear(cache):
+    cache.set(vec(1), "ctx", "answer")
+    cache.clear()
+    assert cache.get(vec(1), "ctx") is None
+    cache.set(vec(1), "ctx", "again")
+    assert cache.get(vec(1), "ctx") == "again"
+
+def test_personal_queries_are_not_cacheable():
+    assert cache_service.should_cache("What is the price of a 2 bedroom flat?")
+    assert not cache_service.should_cache("What is my name again?")
+    assert not cache_service.should_cache("What is the rent right now?")
+
+def test_should_cache_pattern_precedence():
+    assert cache_service.should_cache("Where is the cheapest area?")
+    assert not cache_service.should_cache("Tell me a joke please")  # No cacheable pattern
+    assert not cache_service.should_cache("rent?")  # Too short
+    assert not cache_service.should_cache("Is the phone price negotiable?")  # Personal beats cacheable
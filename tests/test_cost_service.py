@@ -0,0 +1,89 @@
+"""
+Cost Service Tests
+Covers usage recording, the legacy JSON import and the SQL aggregates.
+"""
+import json
+from datetime import date, datetime
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.database import Base, UsageRecord
+from app.services import cost_service
+
+@pytest.fixture
+def db(monkeypatch):
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+    monkeypatch.setattr(cost_service, "SessionLocal", Session)
+    monkeypatch.setattr(cost_service, "_check_budget_alerts", lambda: None)
+    monkeypatch.setattr(cost_service, "_month_total", {"month": None, "cost": 0.0})
+    return Session
+
+def record(model="openai/gpt-4o", cost=1.0, when=None):
+    when = when or datetime.utcnow()
+    return {"timestamp": when.isoformat(), "date": when.date().isoformat(), "model": model,
+            "tokens_in": 10, "tokens_out": 20, "cost": cost, "session_id": None}
+
+def add(Session, *records):
+    with Session() as s:
+        s.add_all(UsageRecord(**{**r, "timestamp": datetime.fromisoformat(r["timestamp"])}) for r in records)
+        s.commit()
+
+def test_record_usage_inserts_a_row(db):
+    cost_service.record_usage("openai/gpt-4o", 1_000_000, 0, session_id="s1")
+    with db() as s:
+        row = s.query(UsageRecord).one()
+    assert (row.model, row.cost, row.session_id, row.date) == ("openai/gpt-4o", 5.0, "s1", date.today().isoformat())
+
+def test_legacy_import_runs_once(db, tmp_path):
+    path = tmp_path / "usage_records.json"
+    path.write_text(json.dumps([record(cost=2.0), record(cost=0.5), {"cost": 9}]))
+    assert cost_service.import_legacy_usage(str(path)) == 2
+    assert cost_service.import_legacy_usage(str(path)) == 0
+    assert cost_service.get_daily_cost() == 2.5
+    assert cost_service.import_legacy_usage(str(tmp_path / "missing.json")) == 0
+
+def test_getters_aggregate_usage(db):
+    add(db, record(cost=1.5), record(model="google/gemini-pro", cost=0.25),
+        record(cost=9.0, when=datetime(2001, 1, 2)), record(cost=4.0, when=datetime(2001, 12, 31, 23)))
+    today = date.today()
+    assert cost_service.get_daily_cost() == 1.75
+    assert cost_service.get_daily_cost(date(2001, 1, 2)) == 9.0
+    assert cost_service.get_monthly_cost() == 1.75
+    assert cost_service.get_monthly_cost(2001, 1) == 9.0
+    assert cost_service.get_monthly_cost(2001, 12) == 4.0
+    breakdown = cost_service.get_cost_breakdown_by_model(30)
+    assert breakdown["openai/gpt-4o"] == {"calls": 1, "tokens_in": 10, "tokens_out": 20, "cost": 1.5}
+    assert set(breakdown) == {"openai/gpt-4o", "google/gemini-pro"}
+    trend = cost_service.get_cost_trend(7)
+    assert trend[-1] == {"date": today.isoformat(), "cost": 1.75}
+    assert len(trend) == 8 and trend[0]["cost"] == 0
+
+def test_usage_summary(db):
+    add(db, record(cost=3.0))
+    summary = cost_service.get_usage_summary()
+    assert summary["daily_cost"] == summary["monthly_cost"] == 3.0
+    assert summary["model_breakdown"]["openai/gpt-4o"]["calls"] == 1
+    assert summary["cost_trend"][-1]["cost"] == 3.0
+
+def test_monthly_total_is_seeded_once_then_kept_current(db, monkeypatch):
+    add(db, record(cost=2.0))
+    assert cost_service.get_monthly_cost() == 2.0
+    sums = []
+    real_sum = cost_service._monthly_sum
+    monkeypatch.setattr(cost_service, "_monthly_sum", lambda *a: sums.append(a) or real_sum(*a))
+    cost_service.record_usage("openai/gpt-4o", 1_000_000, 0)
+    cost_service.record_usage("openai/gpt-4o", 0, 1_000_000)
+    assert cost_service.get_monthly_cost() == 22.0
+    assert cost_service.get_usage_summary()["monthly_cost"] == 22.0
+    assert sums == []  # Served from the running total
+    assert cost_service.get_monthly_cost(2001, 1) == 0
+
+def test_pricing_lookup():
+    assert cost_service.calculate_cost("openai/gpt-4o", 1_000_000, 1_000_000) == 20.0
+    # Exact match ignores case instead of falling through to the gpt-4 prefix
+    assert cost_service.calculate_cost("OpenAI/GPT-4o", 1_000_000, 0) == 5.0
+    assert cost_service.calculate_cost("anthropic/claude-3-haiku-20240307", 1_000_000, 0) == 0.25
+    assert cost_service.calculate_cost("google/gemma-3n-e2b-it:free", 10**6, 10**6) == 0
+    assert cost_service.calculate_cost("someone/unknown-model", 1_000_000, 1_000_000) == 3.0
@@ -0,0 +1,211 @@
+"""
+CRM Service Tests
+Covers the shared HTTP client and token handling, against a mocked HubSpot API.
+"""
+import asyncio
+import json
+import os
+from datetime import datetime, timedelta, timezone
+import httpx
+import pytest
+from app.services import crm_service
+from app.services.crm_service import CRMService
+
+class FakeHubspot:
+    def __init__(self):
+        self.requests = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        if request.url.path == "/oauth/v1/token":
+            return httpx.Response(200, json={"access_token": f"token-{len(self.requests)}", "expires_in": 3600})
+        return httpx.Response(200, json={"id": "42", "path": request.url.path})
+
+@pytest.fixture
+def api():
+    return FakeHubspot()
+
+@pytest.fixture
+def crm(api, monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)  # Credentials are saved under ./data
+    service = CRMService()
+    service.provider = "hubspot"
+    service.access_token = "token-0"
+    service.refresh_token = "refresh"
+    service.expires_at = datetime.now(timezone.utc) + timedelta(hours=1)
+    service._client = httpx.AsyncClient(transport=httpx.MockTransport(api))
+    return service
+
+@pytest.mark.asyncio
+async def test_requests_share_one_client(crm, api):
+    client = crm._client
+    await crm.create_contact({"email": "a@b.c"})
+    await crm.update_contact("42", {"phone": "1"})
+    assert crm._client is client
+    assert [r.method for r in api.requests] == ["POST", "PATCH"]
+    assert api.requests[0].headers["Authorization"] == "Bearer token-0"
+    await crm.aclose()
+    assert client.is_closed and crm._client is None
+    await crm.aclose()  # Idempotent
+
+@pytest.mark.asyncio
+async def test_token_refreshed_once_before_expiry(crm, api):
+    crm.expires_at = datetime.now(timezone.utc) + timedelta(minutes=2)  # Inside the refresh window
+    await asyncio.gather(*(crm.update_contact("42", {}) for _ in range(5)))
+    paths = [r.url.path for r in api.requests]
+    assert paths.count("/oauth/v1/token") == 1
+    assert api.requests[-1].headers["Authorization"] == "Bearer token-1"
+    assert crm.expires_at > datetime.now(timezone.utc) + timedelta(minutes=55)
+
+@pytest.mark.asyncio
+async def test_failed_early_refresh_keeps_valid_token(crm):
+    crm._client = httpx.AsyncClient(transport=httpx.MockTransport(
+        lambda r: httpx.Response(400 if r.url.path == "/oauth/v1/token" else 200, json={})))
+    crm.expires_at = datetime.now(timezone.utc) + timedelta(minutes=2)
+    assert await crm.update_contact("42", {}) == {}
+    crm.expires_at = datetime.now(timezone.utc) - timedelta(seconds=1)
+    with pytest.raises(Exception, match="refresh failed"):
+        await crm.update_contact("42", {})
+
+def test_naive_saved_expiry_is_read_as_utc(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+    (tmp_path / "data" / "crm_credentials.json").write_text(json.dumps(
+        {"provider": "hubspot", "access_token": "t", "expires_at": "2030-01-01T00:00:00"}))
+    service = CRMService()
+    assert service.expires_at == datetime(2030, 1, 1, tzinfo=timezone.utc)
+    assert service.get_connection_status()["expired"] is False
+
+@pytest.mark.asyncio
+async def test_contact_lookups_are_cached_until_updated(crm, api, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(crm_service.time, "monotonic", lambda: now[0])
+    first = await crm.lookup_contact(email="a@b.c")
+    assert await crm.lookup_contact(email="a@b.c") is first
+    assert len(api.requests) == 1
+    now[0] += crm_service.CONTACT_CACHE_TTL_SECONDS
+    await crm.lookup_contact(email="a@b.c")
+    assert len(api.requests) == 2  # Expired
+    await crm.update_contact("42", {"phone": "1"})
+    await crm.lookup_contact(email="a@b.c")
+    assert len(api.requests) == 4  # PATCH, then a fresh lookup
+    assert await crm.lookup_contact(phone="123") is None  # Phone search isn't supported; nothing cached
+    assert len(crm._contact_cache) == 1
+
+def test_credentials_round_trip_atomically(crm):
+    crm._save_credentials()
+    assert not os.path.exists(f"{crm_service.CREDENTIALS_FILE}.tmp")
+    loaded = CRMService()
+    assert (loaded.provider, loaded.access_token, loaded.expires_at) == ("hubspot", "token-0", crm.expires_at)
+    crm.disconnect()
+    assert CRMService().provider is None
+
+@pytest.mark.asyncio
+async def test_refresh_uses_crm_settings(crm, api, monkeypatch):
+    from app.services import settings_service
+    monkeypatch.setattr(settings_service, "load_settings", lambda: {"crm": {"client_id": "app-1", "client_secret": "s"}})
+    assert await crm.refresh_access_token()
+    assert b"client_id=app-1" in api.requests[-1].content
+    with pytest.raises(ValueError):
+        monkeypatch.setattr(settings_service, "load_settings", lambda: {})
+        crm.get_auth_url()
+
+@pytest.mark.asyncio
+async def test_operations_dispatch_on_provider(crm, api, monkeypatch):
+    from app.services import settings_service
+    monkeypatch.setattr(settings_service, "load_settings", lambda: {"crm": {"client_id": "app-1"}})
+    assert "prompt=consent" in crm.get_auth_url("salesforce")
+    assert crm.provider == "salesforce"
+    assert await crm.lookup_contact(email="a@b.c") is None
+    with pytest.raises(NotImplementedError, match="log_conversation not implemented for salesforce"):
+        await crm.log_conversation("42", "session-1", "hi")
+    assert api.requests == []
+    assert "optional_scope=" in crm.get_auth_url("hubspot")
+    await crm.log_conversation("42", "session-123456789", "hi")
+    note = json.loads(api.requests[-1].content)
+    assert api.requests[-1].url.path == "/crm/v3/objects/notes"
+    assert note["properties"]["hs_note_body"].startswith("Chatbot Conversation (Session: session-...)")
+    assert note["associations"][0]["to"] == {"id": "42"}
+
+@pytest.mark.asyncio
+async def test_expiry_follows_the_monotonic_clock(crm, api, monkeypatch):
+    now = [crm_service.time.monotonic()]
+    monkeypatch.setattr(crm_service.time, "monotonic", lambda: now[0])
+    crm.expires_at = datetime.now(timezone.utc) + timedelta(hours=1)
+    assert not crm._token_expiring() and not crm.get_connection_status()["expired"]
+    now[0] += 3600 - crm_service.REFRESH_SKEW_SECONDS
+    assert crm._token_expiring()
+    await crm.update_contact("42", {})
+    assert [r.url.path for r in api.requests][0] == "/oauth/v1/token"
+    assert not crm._token_expiring()
+    crm.expires_at = None
+    assert not crm._token_expiring() and not crm.get_connection_status()["expired"]
+
+@pytest.mark.asyncio
+async def test_queued_notes_are_sent_in_background_with_retries(crm, api, monkeypatch):
+    from app.services import logging_service
+    errors = []
+    monkeypatch.setattr(logging_service, "log_error", lambda **kw: errors.append(kw))
+    monkeypatch.setattr(crm_service, "NOTE_RETRY_BACKOFF_SECONDS", 0)
+    failures = [2]
+
+    def flaky(request):
+        if request.url.path == "/crm/v3/objects/notes" and failures[0]:
+            failures[0] -= 1
+            return httpx.Response(503, text="busy")
+        return api(request)
+
+    crm._client = httpx.AsyncClient(transport=httpx.MockTransport(flaky))
+    await crm.queue_conversation_log("42", "session-1", "first")
+    assert api.requests == []  # Queued, not sent yet
+    await crm.aclose()  # Drains the queue
+    assert [json.loads(r.content)["properties"]["hs_note_body"][-5:] for r in api.requests] == ["first"]
+
+    failures[0] = crm_service.NOTE_SEND_ATTEMPTS
+    crm._client = httpx.AsyncClient(transport=httpx.MockTransport(flaky))
+    await crm.queue_conversation_log("43", "session-2", "lost")
+    await crm.aclose()
+    assert len(api.requests) == 1
+    assert errors[0]["error_type"] == "crm_note_error"
+    assert errors[0]["context"] == {"contact_id": "43", "session_id": "session-2"}
+
+@pytest.mark.asyncio
+async def test_shutdown_drops_notes_after_drain_timeout(crm, monkeypatch):
+    from app.services import logging_service
+    errors = []
+    monkeypatch.setattr(logging_service, "log_error", lambda **kw: errors.append(kw))
+    monkeypatch.setattr(crm_service, "NOTE_DRAIN_TIMEOUT_SECONDS", 0.1)
+    crm._client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(503)))
+    for n in range(3):
+        await crm.queue_conversation_log(str(n), f"session-{n}", "down")
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    await crm.aclose()  # The worker is asleep in its retry backoff
+    assert loop.time() - started < 1
+    assert errors[0]["error_type"] == "crm_notes_dropped"
+    assert [note["contact_id"] for note in errors[0]["context"]["notes"]] == ["0", "1", "2"]
+    assert crm._note_queue is None and crm._client is None
+
+@pytest.mark.asyncio
+async def test_queueing_a_note_for_unsupported_provider_fails_fast(crm):
+    crm.provider = "zoho"
+    with pytest.raises(NotImplementedError):
+        await crm.queue_conversation_log("42", "session-1", "hi")
+    assert crm._note_queue is None
+
+@pytest.mark.asyncio
+async def test_empty_response_body_is_an_empty_dict(crm):
+    crm._client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(204)))
+    assert await crm.update_contact("42", {"phone": "1"}) == {}
+
+@pytest.mark.asyncio
+async def test_headers_are_reused_until_the_token_changes(crm, api):
+    headers = crm._auth_headers()
+    await crm.lookup_contact(email="a@b.c")
+    assert crm._auth_headers() is headers
+    assert api.requests[0].method == "GET" and api.requests[0].content == b""
+    crm.access_token = "token-9"
+    assert crm._auth_headers()["Authorization"] == "Bearer token-9"
+    with pytest.raises(ValueError):
+        await crm._make_request("DELETE", "/crm/v3/objects/contacts/42")
@@ -0,0 +1,81 @@
+"""
+Database Service Tests
+Covers the request-scoped dependency, message writes, stats and index use.
+"""
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from app.database import Base, Message, Session
+from app.services import db_service
+from app.services.db_service import DatabaseService, get_db_service
+
+@pytest.fixture
+def engine(monkeypatch):
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    monkeypatch.setattr(db_service, "SessionLocal", sessionmaker(bind=engine))
+    return engine
+
+def test_dependency_yields_a_fresh_service_and_closes_it(engine):
+    first = get_db_service()
+    service = next(first)
+    service.get_chat_session("missing")
+    assert service._session is not None
+    with pytest.raises(StopIteration):
+        next(first)
+    assert service._session is None
+    assert next(get_db_service()) is not service
+
+def test_save_message_creates_session_in_one_commit(engine):
+    commits = []
+    event.listen(engine, "commit", lambda conn: commits.append(1))
+    with DatabaseService() as service:
+        service.save_message("s1", "user", "hello", tokens=3)
+        service.save_message("s1", "assistant", "hi")
+        assert service.get_message_count("s1") == 2
+        created = service.get_chat_session("s1")
+        assert created.name == "New Chat" and created.created_at is not None
+    assert len(commits) == 2
+
+def test_save_message_keeps_an_existing_session(engine):
+    with DatabaseService() as service:
+        service.create_chat_session("s1", name="Chat with Ada")
+        service.save_message("s1", "user", "hello")
+        assert service.get_chat_session("s1").name == "Chat with Ada"
+        assert service.get_session_count() == 1
+
+def test_stats_count_everything_and_today(engine):
+    with DatabaseService() as service:
+        service.save_message("s1", "user", "hello")
+        service.save_message("s1", "assistant", "hi")
+        old = Session(id="s0", name="Old", created_at=datetime.utcnow() - timedelta(days=2))
+        service.get_session().add(old)
+        service.get_session().add(Message(session_id="s0", role="user", content="x", timestamp=old.created_at))
+        service.get_session().commit()
+        stats = service.get_stats()
+    assert stats == {
+        "total_sessions": 2, "total_messages": 3, "total_kb_docs": 0, "total_users": 0,
+        "messages_today": 2, "sessions_today": 1,
+    }
+
+@pytest.mark.parametrize("method, args, index", [
+    ("get_messages", ("s1",), "ix_msg_session_time"),
+    ("get_recent_messages", (), "ix_messages_timestamp"),
+])
+def test_message_queries_use_an_index(engine, method, args, index):
+    plans = []
+
+    def explain(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().startswith("SELECT") and "FROM messages" in statement:
+            plans.append(conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).fetchall())
+
+    with DatabaseService() as service:
+        service.save_message("s1", "user", "hello")
+        event.listen(engine, "before_cursor_execute", explain)
+        try:
+            assert len(getattr(service, method)(*args)) == 1
+        finally:
+            event.remove(engine, "before_cursor_execute", explain)
+    detail = " ".join(row[-1] for row in plans[0])
+    assert f"USING INDEX {index}" in detail
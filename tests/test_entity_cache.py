@@ -0,0 +1,62 @@
+"""
+Entity Cache Tests
+Verifies memoization and batching of entity extraction.
+"""
+import spacy
+from app.services.entity_cache import EntityCache
+
+class CountingPipe:
+    """Wraps a blank pipeline and records which texts went through pipe()"""
+    def __init__(self):
+        self.nlp = spacy.blank("en")
+        self.batches = []
+
+    def pipe(self, texts, **kwargs):
+        texts = list(texts)
+        self.batches.append(texts)
+        return self.nlp.pipe(texts, **kwargs)
+
+def tokens(doc):
+    return [t.text.lower() for t in doc]
+
+def test_misses_are_batched_and_deduplicated():
+    nlp = CountingPipe()
+    cache = EntityCache(tokens)
+    assert cache.extract_batch(nlp, ["Smoking kills", "Rent rises", "Smoking kills"]) == [
+        ["smoking", "kills"], ["rent", "rises"], ["smoking", "kills"]
+    ]
+    assert nlp.batches == [["Smoking kills", "Rent rises"]]
+
+def test_hits_skip_the_pipeline():
+    nlp = CountingPipe()
+    cache = EntityCache(tokens)
+    cache.extract_batch(nlp, ["a b"])
+    assert cache.extract_batch(nlp, ["a b", "c"]) == [["a", "b"], ["c"]]
+    assert nlp.batches == [["a b"], ["c"]]
+    cache.extract_batch(nlp, ["c"])
+    assert len(nlp.batches) == 2
+
+def test_least_recently_used_text_is_evicted():
+    nlp = CountingPipe()
+    cache = EntityCache(tokens, max_size=2)
+    cache.extract_batch(nlp, ["a", "b"])
+    cache.extract_batch(nlp, ["a"])
+    cache.extract_batch(nlp, ["c"])
+    assert list(cache.entries) == ["a", "c"]
+
+def test_causal_services_share_one_pipeline(monkeypatch, tmp_path):
+    from pathlib import Path
+    from app.services import _spacy_singleton
+    from app.services.causal_filter import CausalFilter
+    from app.services.causal_service import CausalService
+    loads = []
+    monkeypatch.setattr(_spacy_singleton.spacy, "load", lambda name, **kw: loads.append(name) or spacy.blank("en"))
+    monkeypatch.setattr("app.services.causal_service.model_available", lambda: True)
+    _spacy_singleton.get_nlp.cache_clear()
+    try:
+        service = CausalService(str(tmp_path / "graph.json"))
+        causal_filter = CausalFilter(Path(tmp_path / "graph.json"))
+        assert service.nlp is causal_filter.nlp
+        assert loads == ["en_core_web_md"]
+    finally:
+        _spacy_singleton.get_nlp.cache_clear()
@@ -0,0 +1,112 @@
+"""
+Feedback Service Tests
+Covers feedback storage, the legacy file import and the SQL aggregates served to the dashboard.
+"""
+import json
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.database import Base, Feedback
+from app.services import feedback_service, metrics_service
+
+@pytest.fixture(autouse=True)
+def store(monkeypatch):
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+    monkeypatch.setattr(feedback_service, "SessionLocal", Session)
+    monkeypatch.setattr(metrics_service, "record_feedback", lambda *a, **kw: None)
+    return Session
+
+def days_ago(n):
+    return datetime.utcnow() - timedelta(days=n)
+
+def seed(store, *records):
+    with store() as s:
+        s.add_all(
+            Feedback(session_id=session_id, rating=rating, category=category, comment=comment, created_at=created_at)
+            for session_id, rating, category, comment, created_at in records
+        )
+        s.commit()
+
+def test_submit_returns_stored_record(store):
+    first = feedback_service.submit_feedback("s1", 5, comment="great")
+    second = feedback_service.submit_feedback("s2", 2)
+    assert (first["id"], second["id"]) == (1, 2)
+    assert feedback_service.get_feedback_by_id(2)["session_id"] == "s2"
+    assert feedback_service.get_feedback_by_id(3) is None
+    assert feedback_service.get_session_feedback("s1") == [first]
+    assert datetime.fromisoformat(first["created_at"]) <= datetime.utcnow()
+    with pytest.raises(ValueError):
+        feedback_service.submit_feedback("s1", 6)
+
+def test_legacy_json_lines_import_once_keeping_ids(store, tmp_path):
+    lines = tmp_path / "feedback.jsonl"
+    lines.write_text(
+        json.dumps({"id": 7, "session_id": "s", "rating": 2, "created_at": days_ago(0).isoformat()})
+        + '\n\n{"id": 8, "sess'
+    )
+    array = tmp_path / "feedback.json"
+    array.write_text(json.dumps([{"id": 1, "session_id": "old", "rating": 5, "created_at": days_ago(9).isoformat()}]))
+    paths = (str(lines), str(array))
+    assert feedback_service.import_legacy_feedback(paths) == 1
+    assert feedback_service.import_legacy_feedback(paths) == 0
+    assert feedback_service.submit_feedback("s", 5)["id"] == 8
+
+def test_legacy_json_array_is_used_without_json_lines(store, tmp_path):
+    array = tmp_path / "feedback.json"
+    array.write_text(json.dumps([{"id": 3, "session_id": "s", "rating": 4, "category": "speed",
+                                  "created_at": days_ago(1).isoformat()}]))
+    assert feedback_service.import_legacy_feedback((str(tmp_path / "missing.jsonl"), str(array))) == 1
+    assert feedback_service.get_category_breakdown() == {"speed": {"count": 1, "avg_rating": 4.0}}
+
+def test_aggregates(store):
+    seed(store,
+         ("s1", 5, "speed", "fast", days_ago(1)),
+         ("s1", 4, None, None, days_ago(2)),
+         ("s2", 1, "accuracy", "wrong", days_ago(20)),
+         ("s2", 2, "accuracy", None, days_ago(40)),
+         ("s3", 3, "", "ok", days_ago(3)))
+    assert feedback_service.get_average_rating() == 3.0
+    assert feedback_service.get_average_rating(days=10) == 4.0
+    assert feedback_service.get_rating_distribution() == {1: 1, 2: 1, 3: 1, 4: 1, 5: 1}
+    assert feedback_service.get_rating_distribution(days=30) == {1: 1, 2: 0, 3: 1, 4: 1, 5: 1}
+    assert feedback_service.get_category_breakdown() == {
+        "speed": {"count": 1, "avg_rating": 5.0},
+        "general": {"count": 2, "avg_rating": 3.5},
+        "accuracy": {"count": 2, "avg_rating": 1.5},
+    }
+    trends = feedback_service.get_feedback_trends(days=30)
+    assert [t["count"] for t in trends] == [1, 1, 1, 1]
+    low = feedback_service.get_low_rating_sessions()
+    assert [(s["session_id"], s["avg_rating"], s["comments"]) for s in low] == [("s2", 1.5, ["wrong"])]
+    assert [c["comment"] for c in feedback_service.get_recent_comments()] == ["fast", "ok", "wrong"]
+    assert [c["comment"] for c in feedback_service.get_recent_comments(max_rating=3, limit=1)] == ["ok"]
+
+def test_summary(store):
+    assert feedback_service.get_feedback_summary()["total_feedback"] == 0
+    seed(store,
+         ("s1", 5, None, None, days_ago(1)),
+         ("s1", 4, None, None, days_ago(2)),
+         ("s2", 1, None, None, days_ago(20)),
+         ("s2", 2, None, None, days_ago(40)))
+    summary = feedback_service.get_feedback_summary()
+    assert summary["total_feedback"] == 4
+    assert summary["avg_rating"] == 3.0
+    assert summary["satisfaction_rate"] == 50.0
+    assert summary["recent_trend"] == "improving"
+    assert summary["feedback_last_7_days"] == 2
+    assert summary["low_rating_count"] == 2
+    assert summary["rating_distribution"] == {1: 1, 2: 1, 3: 0, 4: 1, 5: 1}
+
+def test_low_rating_sessions_in_sql(store):
+    seed(store,
+         ("s1", 2, None, "slow", days_ago(3)),
+         ("s1", 2, None, "", days_ago(1)),
+         ("s2", 1, None, None, days_ago(2)),
+         ("s3", 2, None, "meh", days_ago(1)),
+         ("s4", 5, None, "great", days_ago(1)))
+    low = feedback_service.get_low_rating_sessions(limit=2)
+    assert [(s["session_id"], s["feedback_count"], s["comments"]) for s in low] == [("s2", 1, []), ("s1", 2, ["slow"])]
+    assert low[1]["last_feedback"][:10] == days_ago(1).date().isoformat()
@@ -0,0 +1,57 @@
+"""
+Graph Reachability Tests
+Checks the precomputed closure against networkx path search.
+"""
+import random
+import networkx as nx
+from app.services.graph_reachability import Reachability
+
+def test_matches_nx_has_path_on_random_graphs():
+    rng = random.Random(7)
+    for _ in range(20):
+        graph = nx.gnp_random_graph(30, 0.06, seed=rng.randrange(10**6), directed=True)
+        reach = Reachability(graph)
+        for a in graph.nodes:
+            for b in graph.nodes:
+                assert reach.has_path(a, b) == nx.has_path(graph, a, b)
+
+def test_cycles_and_missing_nodes():
+    graph = nx.DiGraph([("smoking", "tar"), ("tar", "cancer"), ("cancer", "tar"), ("stress", "smoking")])
+    reach = Reachability(graph)
+    assert reach.has_path("stress", "cancer")
+    assert reach.has_path("cancer", "tar")
+    assert not reach.has_path("cancer", "smoking")
+    assert not reach.has_path("smoking", "unknown")
+    assert not Reachability(nx.DiGraph()).has_path("a", "a")
+
+def test_any_path_matches_pairwise_check():
+    rng = random.Random(11)
+    graph = nx.gnp_random_graph(150, 0.01, seed=3, directed=True)  # Spans several 64-bit words
+    reach = Reachability(graph)
+    nodes = list(graph.nodes) + ["unknown"]
+    for _ in range(300):
+        a = rng.sample(nodes, rng.randint(0, 4))
+        b = rng.sample(nodes, rng.randint(0, 4))
+        expected = any(reach.has_path(x, y) or reach.has_path(y, x) for x in a for y in b)
+        assert reach.any_path(a, b) == expected
+
+def test_path_counts_match_pairwise_counts():
+    graph = nx.gnp_random_graph(100, 0.015, seed=9, directed=True)
+    reach = Reachability(graph)
+    sources = [0, 5, 5, 42, "unknown"]
+    counts = reach.path_counts(sources)
+    targets = list(graph.nodes) + ["unknown"]
+    ids = reach.index(targets)
+    for node, idx in zip(targets, ids):
+        expected = sum(reach.has_path(s, node) or reach.has_path(node, s) for s in sources)
+        assert counts[idx] == expected
+
+def test_node_ids_are_interned():
+    from app.services.graph_reachability import node_id
+    built = "".join(["Tar", "Content"])
+    assert node_id(built) == "tarcontent"
+    assert node_id(built) is node_id("TARCONTENT")
+    # Keys loaded from JSON are fresh strings; the table holds the interned copy
+    reach = Reachability(nx.DiGraph([("".join(["tar", "content"]), "cancer")]))
+    key = next(k for k in reach.component if k == "tarcontent")
+    assert key is node_id("tarcontent")
@@ -0,0 +1,101 @@
+"""
+Handover Service Tests
+Covers escalation detection, sentiment scoring and the handover table.
+"""
+import json
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import create_engine, event, update
+from sqlalchemy.orm import sessionmaker
+from app.database import Base, Handover
+from app.services import handover_service, logging_service
+from app.services.handover_service import analyze_sentiment, detect_escalation_need
+
+def test_keywords_set_reasons_and_highest_priority():
+    needs, reason, priority = detect_escalation_need("This is URGENT, let me talk to a human")
+    assert needs
+    assert reason == "keyword:urgent, keyword:human, keyword:talk to, negative_sentiment"
+    assert priority == "urgent"
+    assert detect_escalation_need("What does a flat in Lekki cost?") == (False, "", "normal")
+    assert detect_escalation_need("") == (False, "", "normal")
+
+def test_negative_sentiment_and_repeated_issues_raise_priority():
+    assert detect_escalation_need("terrible, useless and a waste of time") == (True, "negative_sentiment", "high")
+    history = ["hi", "price?", "still not working", "help", "again nothing"]
+    assert detect_escalation_need("ok", history) == (True, "repeated_issues", "high")
+
+def test_sentiment_scores_overlapping_phrases():
+    # "not helpful" also contains "helpful", and both count
+    assert analyze_sentiment("not helpful") == pytest.approx(-0.1)
+    assert analyze_sentiment("thanks, great and helpful") == pytest.approx(0.6)
+    assert analyze_sentiment("awful horrible terrible worst useless") == -1.0
+    assert analyze_sentiment("") == 0.0
+
+def test_one_scan_serves_both_checks():
+    handover_service._scan.cache_clear()
+    message = "I am frustrated, get me a manager"
+    detect_escalation_need(message)
+    analyze_sentiment(message)
+    info = handover_service._scan.cache_info()
+    assert (info.misses, info.hits) == (1, 1)
+
+@pytest.fixture
+def db(monkeypatch):
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    monkeypatch.setattr(handover_service, "SessionLocal", sessionmaker(bind=engine))
+    monkeypatch.setattr(logging_service, "log_handover_event", lambda **kw: None)
+    return engine
+
+def test_assign_and_resolve_are_single_updates(db):
+    created = handover_service.create_handover("s1", "keyword:human", "high", notes="VIP")
+    statements = []
+    event.listen(db, "before_cursor_execute", lambda conn, cursor, sql, *a: statements.append(sql.split()[0]))
+    assigned = handover_service.assign_handover(created["id"], "ops@example.com")
+    assert (assigned["status"], assigned["assigned_to"]) == ("assigned", "ops@example.com")
+    resolved = handover_service.resolve_handover(created["id"], notes="called back")
+    assert statements == ["UPDATE", "UPDATE"]
+    assert resolved["status"] == "resolved" and resolved["resolved_at"]
+    assert resolved["notes"] == "VIP\nResolution: called back"
+    assert handover_service.get_handover(created["id"]) == resolved
+    assert handover_service.assign_handover(999, "ops@example.com") is None
+    assert handover_service.resolve_handover(999) is None
+
+def test_resolve_without_existing_notes(db):
+    created = handover_service.create_handover("s1", "negative_sentiment")
+    assert handover_service.resolve_handover(created["id"], notes="done")["notes"] == "\nResolution: done"
+    assert handover_service.resolve_handover(created["id"])["notes"] == "\nResolution: done"
+
+def test_legacy_json_import_runs_once(db, tmp_path):
+    path = tmp_path / "handovers.json"
+    created = (datetime.utcnow() - timedelta(hours=3)).isoformat()
+    path.write_text(json.dumps([
+        {"id": 4, "session_id": "s1", "reason": "r", "priority": "urgent", "status": "pending", "created_at": created},
+    ]))
+    assert handover_service.import_legacy_handovers(str(path)) == 1
+    assert handover_service.import_legacy_handovers(str(path)) == 0
+    assert handover_service.get_handover(4)["created_at"] == created
+    assert handover_service.create_handover("s2", "r")["id"] == 5
+
+def test_stats_are_aggregated_in_sql(db):
+    assert handover_service.get_handover_stats()["total"] == 0
+    first = handover_service.create_handover("s1", "r", "urgent")
+    second = handover_service.create_handover("s2", "r", "high")
+    handover_service.create_handover("s3", "r")
+    handover_service.assign_handover(second["id"], "ops@example.com")
+    with handover_service.SessionLocal() as s:
+        now = datetime.utcnow()
+        s.execute(update(Handover).where(Handover.id == first["id"])
+                  .values(status="resolved", created_at=now - timedelta(hours=3), resolved_at=now))
+        s.execute(update(Handover).where(Handover.id == second["id"])
+                  .values(status="resolved", created_at=now - timedelta(hours=1), resolved_at=now))
+        s.commit()
+    statements = []
+    event.listen(db, "before_cursor_execute", lambda conn, cursor, sql, *a: statements.append(sql))
+    stats = handover_service.get_handover_stats()
+    assert len(statements) == 1
+    assert stats == {
+        "total": 3, "pending": 1, "assigned": 0, "resolved": 2,
+        "by_priority": {"normal": 1, "high": 1, "urgent": 1},
+        "avg_resolution_time_hours": 2.0,
+    }
@@ -0,0 +1,65 @@
+"""
+Logging Service Tests
+Covers the JSON log format and reading recent entries back for the dashboard.
+"""
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+from app.services import logging_service
+from app.services.logging_service import JSONFormatter
+
+def make_record(message="hello", level=logging.INFO, data=None):
+    record = logging.getLogger("test").makeRecord("test", level, "", 0, message, (), None)
+    if data is not None:
+        record.extra_data = data
+    return record
+
+def test_formatter_writes_one_json_object_per_record():
+    line = JSONFormatter().format(make_record(data={"category": "metric", "hist": {1: 2, 5: 3}}))
+    entry = json.loads(line)
+    assert "\n" not in line
+    assert (entry["level"], entry["message"]) == ("INFO", "hello")
+    assert entry["data"] == {"category": "metric", "hist": {"1": 2, "5": 3}}
+
+def test_recent_logs_keep_the_tail_and_filter(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "logs").mkdir()
+    formatter = JSONFormatter()
+    lines = [formatter.format(make_record(f"m{i}", data={"category": "chat" if i % 2 else "request"}))
+             for i in range(10)]
+    lines.insert(8, "{torn")
+    (tmp_path / "logs" / "app.log").write_text("\n".join(lines) + "\n")
+    assert [e["message"] for e in logging_service.get_recent_logs(4)] == ["m7", "m8", "m9"]
+    assert [e["message"] for e in logging_service.get_recent_logs(5, category="chat")] == ["m7", "m9"]
+    assert logging_service.get_recent_logs(5, level="ERROR") == []
+
+def test_logger_only_enqueues():
+    handlers = logging_service.logger.handlers
+    assert len(handlers) == 1 and isinstance(handlers[0], logging.handlers.QueueHandler)
+    assert len(logging_service._listener.handlers) == 3
+
+def test_queued_records_keep_exception_info_for_the_formatter():
+    q = queue.SimpleQueue()
+    handler = logging_service._LocalQueueHandler(q)
+    try:
+        raise ValueError("bad")
+    except ValueError:
+        record = logging.getLogger("test").makeRecord("test", logging.ERROR, "", 0, "failed %s", ("x",), sys.exc_info())
+    handler.handle(record)
+    entry = json.loads(JSONFormatter().format(q.get_nowait()))
+    assert entry["message"] == "failed x"
+    assert "ValueError: bad" in entry["exception"]
+
+def test_filtered_levels_build_no_record(monkeypatch):
+    handled = []
+    monkeypatch.setattr(logging_service.logger, "handle", handled.append)
+    logging_service.log_metric("latency", 1.5)  # DEBUG, below the logger's INFO level
+    assert handled == []
+    logging_service.log_request("r1", "/api/chat", "POST", extra={"user": "u"})
+    logging_service.log_response("r1", 503, 12.345)
+    assert [(r.levelname, r.getMessage()) for r in handled] == [
+        ("INFO", "Request: POST /api/chat"), ("WARNING", "Response: 503 in 12.35ms")]
+    assert handled[0].extra_data["user"] == "u"
+    assert handled[1].extra_data["response_time_ms"] == 12.35
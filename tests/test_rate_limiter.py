@@ -0,0 +1,108 @@
+"""
+Rate Limiter Tests
+Covers the per-IP token bucket and the exponential block backoff.
+"""
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+from app.middleware import rate_limiter
+from app.middleware.rate_limiter import RateLimitMiddleware
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(rate_limiter.time, "monotonic", fake)
+    return fake
+
+@pytest.fixture
+def limiter():
+    return RateLimitMiddleware(app=None, requests_per_minute=3, chat_requests_per_minute=2)
+
+def make_request(path: str = "/api/test", ip: str = "10.0.0.1") -> Request:
+    return Request({"type": "http", "method": "GET", "path": path, "headers": [], "client": (ip, 1234)})
+
+async def call_next(request):
+    return "ok"
+
+async def hit(limiter, path: str = "/api/test"):
+    """Returns the block duration if the request was rejected, else None"""
+    try:
+        await limiter.dispatch(make_request(path), call_next)
+        return None
+    except HTTPException as e:
+        assert e.status_code == 429
+        return e.detail
+
+def test_bucket_refills_continuously():
+    limiter = RateLimitMiddleware(app=None, requests_per_minute=60)
+    buckets = {}
+    assert limiter._consume(buckets, "ip", 60, 0.0)
+    assert buckets["ip"] == (59, 0.0)
+    # One token per second at 60/min
+    for _ in range(59):
+        assert limiter._consume(buckets, "ip", 60, 0.0)
+    assert not limiter._consume(buckets, "ip", 60, 0.0)
+    assert limiter._consume(buckets, "ip", 60, 1.0)
+    assert not limiter._consume(buckets, "ip", 60, 1.0)
+
+@pytest.mark.asyncio
+async def test_block_after_bucket_is_empty(limiter, clock):
+    for _ in range(3):
+        assert await hit(limiter) is None
+    detail = await hit(limiter)
+    assert "120 seconds" in detail
+    # Blocked even though the bucket has refilled a little
+    clock.now += 30
+    assert "Try again in" in await hit(limiter)
+    clock.now += 91
+    assert await hit(limiter) is None
+
+async def drain_until_blocked(limiter):
+    """Send requests until one is blocked; returns the block duration in seconds"""
+    while (detail := await hit(limiter)) is None:
+        pass
+    return int(detail.split()[-2])
+
+@pytest.mark.asyncio
+async def test_repeat_violations_back_off_exponentially(limiter, clock):
+    durations = []
+    for _ in range(3):
+        durations.append(await drain_until_blocked(limiter))
+        # Back right after the block ends: the bucket has refilled, but the history is kept
+        clock.now += durations[-1] + 1
+    assert durations == [120, 240, 480]
+
+@pytest.mark.asyncio
+async def test_violations_reset_after_quiet_period(limiter, clock):
+    assert await drain_until_blocked(limiter) == 120
+    clock.now += 121
+    assert await drain_until_blocked(limiter) == 240
+    # Under the limit for longer than the last block (240s) after it ended
+    clock.now += 240 + 30
+    assert await hit(limiter) is None
+    clock.now += 220
+    assert await drain_until_blocked(limiter) == 120
+    assert limiter.violations["10.0.0.1"][0] == 1
+
+@pytest.mark.asyncio
+async def test_chat_bucket_is_separate(limiter, clock):
+    assert await hit(limiter, "/api/chat") is None
+    assert await hit(limiter, "/api/chat") is None
+    assert await hit(limiter, "/api/chat") == "Chat rate limit exceeded. Please slow down."
+    assert "10.0.0.1" not in limiter.blocked_ips
+
+@pytest.mark.asyncio
+async def test_rejected_chat_request_keeps_general_token(limiter, clock):
+    for _ in range(2):
+        assert await hit(limiter, "/api/chat") is None
+    assert await hit(limiter, "/api/chat") == "Chat rate limit exceeded. Please slow down."
+    # One general token left after the two accepted chats
+    assert await hit(limiter) is None
+    assert "120 seconds" in await hit(limiter)
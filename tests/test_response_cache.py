@@ -0,0 +1,93 @@
+"""
+Response Cache Tests
+Covers LRUCache expiry/eviction and the sharded wrapper's capacity and routing.
+"""
+import pytest
+from app.services import cache_service
+from app.services.cache_service import LRUCache, ShardedLRUCache
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache_service.time, "time", lambda: now[0])
+    return now
+
+def test_lru_get_set_and_stats():
+    cache = LRUCache(max_size=2)
+    assert cache.get("q") is None
+    cache.set("q", "a")
+    assert cache.get("q") == "a"
+    stats = cache.get_stats()
+    assert (stats["hits"], stats["misses"], stats["size"]) == (1, 1, 1)
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(max_size=2)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    cache.get("a")
+    cache.set("c", "3")
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    assert cache.get("c") == "3"
+
+def test_lru_entries_expire(clock):
+    cache = LRUCache(max_size=2, default_ttl=60)
+    cache.set("a", "1")
+    cache.set("b", "2", ttl=10)
+    clock[0] += 30
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    assert len(cache.cache) == 1  # Expired entry dropped on read
+
+def test_lru_invalidate_matches_query_keys():
+    cache = LRUCache()
+    cache.set("rent in lagos", "x")
+    cache.set("price of villa", "rent is high")
+    cache.invalidate("rent")
+    assert cache.get("rent in lagos") is None
+    assert cache.get("price of villa") == "rent is high"
+    cache.invalidate()
+    assert cache.get_stats()["size"] == 0
+
+def test_sharded_capacity_rounds_up_per_shard():
+    cache = ShardedLRUCache(max_size=500, num_shards=16)
+    assert all(shard.max_size == 32 for shard in cache.shards)
+    assert cache.max_size == 512
+    with pytest.raises(ValueError):
+        ShardedLRUCache(num_shards=12)
+
+def test_sharded_routes_queries_consistently():
+    # Room for every entry in any one shard, so hash skew can't evict anything
+    cache = ShardedLRUCache(max_size=160, num_shards=4)
+    for i in range(40):
+        cache.set(f"q{i}", f"r{i}")
+    for i in range(40):
+        assert cache.get(f"q{i}") == f"r{i}"
+        shard = cache._shard(f"q{i}")
+        assert f"q{i}" in shard.cache
+    stats = cache.get_stats()
+    assert (stats["size"], stats["hits"], stats["shards"]) == (40, 40, 4)
+
+def test_sharded_eviction_is_per_shard():
+    cache = ShardedLRUCache(max_size=8, num_shards=4)  # 2 entries per shard
+    queries = [f"q{i}" for i in range(200)]
+    shard = cache.shards[0]
+    same_shard = [q for q in queries if cache._shard(q) is shard][:3]
+    for q in same_shard:
+        cache.set(q, q)
+    # The shard's oldest entry goes even though the cache as a whole has room
+    assert cache.get(same_shard[0]) is None
+    assert cache.get(same_shard[1]) == same_shard[1]
+    assert cache.get(same_shard[2]) == same_shard[2]
+    assert cache.get_stats()["size"] == 2
+
+def test_sharded_invalidate_and_reset_stats():
+    cache = ShardedLRUCache(max_size=64, num_shards=4)
+    for i in range(10):
+        cache.set(f"rent {i}", "x")
+    cache.set("villa", "y")
+    cache.get("villa")
+    cache.invalidate("rent")
+    assert cache.get_stats()["size"] == 1
+    cache.reset_stats()
+    assert cache.get_stats()["hits"] == 0
@@ -149,6 +149,7 @@ class TestSessionValidation:
             "550e8400-e29b-41d4-a716-446655440000",
             "123e4567-e89b-12d3-a456-426614174000",
             "a0eebc99-9c0b-4ef8-bb6d-6bb9bd380a11",
+            "550e8400e29b41d4a716446655440000",  # uuid4().hex form
         ]
         
         for uuid in valid_uuids:
@@ -0,0 +1,60 @@
+"""
+Semantic Cache Tests
+Checks the bitset Jaccard lookup against the plain set computation and the eviction bound.
+"""
+import random
+from app.services.cache_service import SemanticCache
+
+def jaccard(a: str, b: str) -> float:
+    a, b = set(a.lower().split()), set(b.lower().split())
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+def test_matches_reference_jaccard():
+    rng = random.Random(5)
+    words = [f"w{i}" for i in range(90)] + ["Rent", "rent", "LAGOS"]
+    cache = SemanticCache(similarity_threshold=0.5)
+    stored = []
+    for i in range(120):
+        query = " ".join(rng.choices(words, k=rng.randint(1, 6)))
+        if query not in stored:
+            stored.append(query)
+        cache.set(query, f"r{stored.index(query)}")
+    for _ in range(300):
+        query = " ".join(rng.choices(words, k=rng.randint(0, 6)))
+        expected = next((f"r{i}" for i, q in enumerate(stored) if q == query), None)
+        if expected is None:
+            expected = next((f"r{i}" for i, q in enumerate(stored) if jaccard(query, q) >= 0.5), None)
+        assert cache.get(query) == expected
+
+def test_eviction_drops_oldest_and_their_words():
+    cache = SemanticCache(similarity_threshold=0.8, max_size=200)
+    for i in range(201):
+        cache.set(f"query number {i}", str(i))
+    assert len(cache.cache) == 151
+    assert cache.get("query number 0") is None
+    assert cache.get("query number 49") is None
+    assert cache.get("query number 50") == "50"
+    assert cache.get("number 200 query") == "200"
+    assert "0" not in cache.vocab and "200" in cache.vocab
+
+def test_clear():
+    cache = SemanticCache()
+    cache.set("price of a villa in lekki", "x")
+    cache.clear()
+    assert cache.get("price of a villa in lekki") is None
+    assert not cache.vocab
+
+def test_length_filter_skips_unreachable_rows(monkeypatch):
+    from app.services import cache_service
+    cache = SemanticCache(similarity_threshold=0.75)
+    cache.set("two bedroom flat", "short")
+    cache.set("two bedroom flat in lekki phase one", "long")
+    scored = []
+    real = cache_service._popcount_rows
+    monkeypatch.setattr(cache_service, "_popcount_rows", lambda bits: scored.append(len(bits)) or real(bits))
+    assert cache.get("two bedroom flat lekki") == "short"  # 3/4 words shared
+    assert scored == [1]  # The 7-word entry can't reach 0.75 against 4 words
+    assert cache.get("single word") is None
+    assert scored == [1]